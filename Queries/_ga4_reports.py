@@ -0,0 +1,154 @@
+"""
+Shared GA4 Data API plumbing for the recipe report scripts.
+
+Holds the per-process client cache, relative-date snapping, metric filters and
+the on-disk response cache shared by the GA4 Data API report scripts. The
+leading underscore keeps run_all and the web app from listing it as a query.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+from zoneinfo import ZoneInfo
+
+# The GA4 client pulls in grpc and hundreds of protobuf modules, so it is
+# imported where it is used; scripts that import it eagerly pay nothing extra.
+if TYPE_CHECKING:
+    from google.analytics.data_v1beta import BetaAnalyticsDataClient
+    from google.analytics.data_v1beta.types import (
+        Filter,
+        FilterExpression,
+        NumericValue,
+        RunReportRequest,
+        RunReportResponse,
+    )
+
+API_ENDPOINT = "analyticsdata.googleapis.com:443"
+CACHE_DIR = Path(os.getenv("GA4_CACHE_DIR", str(Path.home() / ".cache" / "ga4")))
+DEFAULT_CACHE_TTL = 3600
+# The property's reporting timezone; GA4 resolves today/yesterday/NdaysAgo in it.
+DEFAULT_TZ = os.getenv("GA_TZ", "America/Los_Angeles")
+RELATIVE_DAYS_PATTERN = re.compile(r"^(\d+)daysAgo$")
+# Multi-property rollups keep at most this many run_report calls in flight,
+# under GA4's limit of roughly 10 concurrent requests.
+MAX_CONCURRENT_REPORTS = 8
+
+
+# Clients (and their gRPC channels) are cached per key path for the life of the
+# process, so drivers that import these modules and run several reports share
+# one channel. Separate CLI invocations still build their own client.
+@functools.lru_cache(maxsize=8)
+def create_client(service_account_key: Optional[str]) -> BetaAnalyticsDataClient:
+    from google.analytics.data_v1beta import BetaAnalyticsDataClient
+
+    credentials = None
+    if service_account_key:
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_file(
+            service_account_key,
+            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
+        )
+    return BetaAnalyticsDataClient(
+        credentials=credentials,
+        transport="grpc",
+        client_options={"api_endpoint": API_ENDPOINT},
+    )
+
+
+def metric_threshold(metric_name: str, operation: Filter.NumericFilter.Operation, value: NumericValue) -> FilterExpression:
+    from google.analytics.data_v1beta.types import Filter, FilterExpression
+
+    return FilterExpression(
+        filter=Filter(
+            field_name=metric_name,
+            numeric_filter=Filter.NumericFilter(operation=operation, value=value),
+        )
+    )
+
+
+def property_id_list(value: str) -> list[str]:
+    """argparse type for --property-ids: comma-separated IDs, at least one."""
+    property_ids = [pid.strip() for pid in value.split(",") if pid.strip()]
+    if not property_ids:
+        raise argparse.ArgumentTypeError("expected at least one comma-separated property ID")
+    return property_ids
+
+
+def snap_to_day(value: str, timezone: str = DEFAULT_TZ) -> str:
+    """Resolve today/yesterday/NdaysAgo to YYYY-MM-DD; other values pass through."""
+    # Resolved on the property's calendar rather than the host's, so near
+    # midnight the dates (and cache key) agree with what GA4 would report.
+    text = value.strip()
+    today = datetime.now(ZoneInfo(timezone)).date()
+    if text == "today":
+        return today.isoformat()
+    if text == "yesterday":
+        return (today - timedelta(days=1)).isoformat()
+    match = RELATIVE_DAYS_PATTERN.match(text)
+    if match:
+        return (today - timedelta(days=int(match.group(1)))).isoformat()
+    return text
+
+
+def cache_path(request: RunReportRequest) -> Path:
+    from google.analytics.data_v1beta.types import RunReportRequest
+
+    request_dict = RunReportRequest.to_dict(request)
+    key = hashlib.sha1(json.dumps(request_dict, sort_keys=True).encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}.pb"
+
+
+def load_cached(path: Path, cache_ttl: float) -> Optional[RunReportResponse]:
+    """Return the response stored at `path` if it is younger than `cache_ttl` seconds."""
+    from google.analytics.data_v1beta.types import RunReportResponse
+
+    try:
+        if time.time() - os.path.getmtime(path) < cache_ttl:
+            return RunReportResponse.deserialize(path.read_bytes())
+    except OSError:
+        pass
+    return None
+
+
+def store_cached(path: Path, response: RunReportResponse) -> None:
+    # Serialized protobuf bytes, not a pickle, so the files stay small and are
+    # readable by any process.
+    from google.analytics.data_v1beta.types import RunReportResponse
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(RunReportResponse.serialize(response))
+    except OSError:
+        pass
+
+
+def run_report_cached(
+    client: BetaAnalyticsDataClient,
+    request: RunReportRequest,
+    cache_ttl: float = DEFAULT_CACHE_TTL,
+    refresh: bool = False,
+) -> RunReportResponse:
+    # Responses are stored under the shared GA4 cache dir, keyed by the
+    # canonical request, so repeat runs skip the API.
+    if cache_ttl <= 0:
+        return client.run_report(request)
+
+    path = cache_path(request)
+    if not refresh:
+        response = load_cached(path, cache_ttl)
+        if response is not None:
+            return response
+
+    response = client.run_report(request)
+    store_cached(path, response)
+    return response
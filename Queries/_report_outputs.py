@@ -0,0 +1,46 @@
+"""
+Shared output helpers for the GA4 report scripts.
+
+Holds the per-process chart figure and the content-hashed file suffix used by
+category_performance, hidden_gem_recipes and high_traffic_low_engagement. The
+leading underscore keeps run_all and the web app from listing it as a query.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+_chart_figure = None
+
+
+def chart_figure(figsize: tuple[float, float]) -> Figure:
+    """Return the process's Agg figure, cleared and resized to `figsize`."""
+    # One figure per process, reused by every chart the pool worker renders,
+    # instead of a new pyplot figure (and backend lookup) for every call.
+    # matplotlib is imported on first use so --no-chart runs never load it.
+    global _chart_figure
+    if _chart_figure is None:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        from matplotlib.figure import Figure
+
+        _chart_figure = Figure(figsize=figsize)
+    else:
+        _chart_figure.clear()
+        _chart_figure.set_size_inches(figsize)
+    return _chart_figure
+
+
+def output_suffix(*parts) -> str:
+    # Output names hash the inputs and data, so an identical re-run maps to the
+    # same file and can skip writing it again.
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:10]
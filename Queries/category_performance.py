@@ -14,43 +14,98 @@ Example:
 """
 
 import argparse
-from datetime import datetime
+import sys
+from pathlib import Path
 from typing import Optional
 
+import numpy as np
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, OrderBy, RunReportRequest
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
+    DateRange,
+    Dimension,
+    Filter,
+    FilterExpression,
+    Metric,
+    NumericValue,
+    OrderBy,
+    RunReportRequest,
+    RunReportResponse,
+)
+
+from _ga4_reports import DEFAULT_CACHE_TTL, cache_path, create_client, load_cached, snap_to_day, store_cached
+from _report_outputs import chart_figure, output_suffix
 
 try:
-    import matplotlib.pyplot as plt
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
 except ImportError:  # pragma: no cover - optional dependency
-    plt = None
+    Figure = None
 
 QUERY_NAME = "Recipe Category Performance"
 RECOMMENDED_CHART = "Stacked bar or grouped bar chart per category"
+DEFAULT_MIN_REVENUE = 0.01
+PAGE_SIZE = 10000
+MAX_BATCH_REPORTS = 5
+# mm:ss strings for the first hour, where nearly every average duration falls.
+_MMSS = tuple(f"{s // 60:02d}:{s % 60:02d}" for s in range(3600))
 
-def create_client(service_account_key: Optional[str]) -> BetaAnalyticsDataClient:
-    if service_account_key:
-        from google.oauth2 import service_account
 
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_key,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-        )
-        return BetaAnalyticsDataClient(credentials=credentials)
-    return BetaAnalyticsDataClient()
+def format_seconds(value: float) -> str:
+    seconds = int(round(value))
+    if 0 <= seconds < len(_MMSS):
+        return _MMSS[seconds]
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def fetch_reports_batch(
+    client: BetaAnalyticsDataClient, property_id: str, requests: list[RunReportRequest]
+) -> list[RunReportResponse]:
+    # batchRunReports runs up to five reports for one property in a single
+    # round-trip, returned in request order.
+    response = client.batch_run_reports(
+        BatchRunReportsRequest(property=f"properties/{property_id}", requests=requests)
+    )
+    return list(response.reports)
 
 
-def fetch_report(
+def run_reports_cached(
     client: BetaAnalyticsDataClient,
+    property_id: str,
+    requests: list[RunReportRequest],
+    cache_ttl: float = DEFAULT_CACHE_TTL,
+    refresh: bool = False,
+) -> list[RunReportResponse]:
+    responses: list[Optional[RunReportResponse]] = [None] * len(requests)
+    cache_paths = [cache_path(request) for request in requests]
+    if cache_ttl > 0 and not refresh:
+        responses = [load_cached(path, cache_ttl) for path in cache_paths]
+
+    missing = [index for index, response in enumerate(responses) if response is None]
+    for start in range(0, len(missing), MAX_BATCH_REPORTS):
+        chunk = missing[start : start + MAX_BATCH_REPORTS]
+        fetched = fetch_reports_batch(client, property_id, [requests[index] for index in chunk])
+        for index, response in zip(chunk, fetched):
+            responses[index] = response
+            if cache_ttl > 0:
+                store_cached(cache_paths[index], response)
+    return responses
+
+
+def build_request(
     property_id: str,
     category_dimension: str,
     start_date: str,
     end_date: str,
+    offset: int,
     limit: int,
-):
-    request = RunReportRequest(
+    min_revenue: float = DEFAULT_MIN_REVENUE,
+) -> RunReportRequest:
+    return RunReportRequest(
         property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+        date_ranges=[DateRange(start_date=snap_to_day(start_date), end_date=snap_to_day(end_date))],
         dimensions=[Dimension(name=category_dimension)],
         metrics=[
             Metric(name="engagedSessions"),
@@ -58,18 +113,75 @@ def fetch_report(
             Metric(name="screenPageViews"),
             Metric(name="totalAdRevenue"),
         ],
+        # Zero-revenue rows are dropped by GA4 instead of being shipped back.
+        metric_filter=FilterExpression(
+            filter=Filter(
+                field_name="totalAdRevenue",
+                numeric_filter=Filter.NumericFilter(
+                    operation=Filter.NumericFilter.Operation.GREATER_THAN_OR_EQUAL,
+                    value=NumericValue(double_value=min_revenue),
+                ),
+            )
+        ),
         order_bys=[OrderBy(metric=OrderBy.MetricOrderBy(metric_name="totalAdRevenue"), desc=True)],
+        offset=offset,
         limit=limit,
+        metric_aggregations=[],
+        return_property_quota=True,
+    )
+
+
+def iter_report(
+    client: BetaAnalyticsDataClient,
+    property_id: str,
+    category_dimension: str,
+    start_date: str,
+    end_date: str,
+    limit: int,
+    cache_ttl: float = DEFAULT_CACHE_TTL,
+    refresh: bool = False,
+    min_revenue: float = DEFAULT_MIN_REVENUE,
+):
+    if limit <= 0:
+        return
+    first_size = min(PAGE_SIZE, limit)
+    (first,) = run_reports_cached(
+        client,
+        property_id,
+        [build_request(property_id, category_dimension, start_date, end_date, 0, first_size, min_revenue)],
+        cache_ttl=cache_ttl,
+        refresh=refresh,
     )
-    return client.run_report(request)
+    yield first
+    if len(first._pb.rows) < first_size:
+        return
+
+    # row_count is the full result size, so the remaining pages are known after
+    # the first one and go out batched instead of one round-trip each.
+    total = min(limit, first.row_count)
+    requests = [
+        build_request(
+            property_id, category_dimension, start_date, end_date, offset, min(PAGE_SIZE, total - offset), min_revenue
+        )
+        for offset in range(first_size, total, PAGE_SIZE)
+    ]
+    yield from run_reports_cached(client, property_id, requests, cache_ttl=cache_ttl, refresh=refresh)
 
 
 def save_chart(categories, revenues, sessions, dimension_name, start_date, end_date):
-    if plt is None or not categories:
+    if Figure is None or not categories:
         return ""
 
+    suffix = output_suffix(
+        dimension_name, start_date, end_date, "\n".join(categories), revenues.tobytes(), sessions.tobytes()
+    )
+    filename = Path(f"recipe_category_performance_{suffix}.png")
+    if filename.exists():
+        return str(filename)
+
     indices = range(len(categories))
-    fig, ax1 = plt.subplots(figsize=(12, 6))
+    fig = chart_figure((12, 6))
+    ax1 = fig.add_subplot(111)
 
     ax1.bar(indices, revenues, color="#5B4B8A", label="Total Ad Revenue ($)")
     ax1.set_ylabel("Total Ad Revenue ($)")
@@ -91,14 +203,12 @@ def save_chart(categories, revenues, sessions, dimension_name, start_date, end_d
     lines2, labels2 = ax2.get_legend_handles_labels()
     ax1.legend(lines + lines2, labels + labels2, loc="upper left")
 
-    plt.tight_layout()
-    filename = f"recipe_category_performance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+    fig.tight_layout()
     fig.savefig(filename, dpi=150)
-    plt.close(fig)
-    return filename
+    return str(filename)
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Summarize recipe category performance from GA4")
     parser.add_argument("--property-id", required=True, help="GA4 property ID")
     parser.add_argument("--service-account-key", help="Path to service account JSON key")
@@ -110,19 +220,27 @@ def main():
     parser.add_argument("--start-date", default="30daysAgo", help="Start date (YYYY-MM-DD or relative)")
     parser.add_argument("--end-date", default="yesterday", help="End date (YYYY-MM-DD or relative)")
     parser.add_argument("--limit", type=int, default=50, help="Maximum number of categories to display")
+    parser.add_argument(
+        "--min-revenue",
+        type=float,
+        default=DEFAULT_MIN_REVENUE,
+        help=f"Minimum total ad revenue for a row to be returned (default {DEFAULT_MIN_REVENUE})",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help="Seconds to reuse a cached GA4 response (0 disables the cache)",
+    )
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached GA4 responses and re-fetch")
+    return parser
 
-    args = parser.parse_args()
 
-    client = create_client(args.service_account_key)
+def run(args: argparse.Namespace) -> None:
+    args.start_date = snap_to_day(args.start_date)
+    args.end_date = snap_to_day(args.end_date)
 
-    response = fetch_report(
-        client,
-        args.property_id,
-        args.category_dimension,
-        args.start_date,
-        args.end_date,
-        args.limit,
-    )
+    client = create_client(args.service_account_key)
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
@@ -138,37 +256,85 @@ def main():
     )
     print("-" * 120)
 
-    if not response.rows:
+    categories = []
+    revenues = np.empty(max(args.limit, 0), dtype=np.float64)
+    sessions = np.empty(max(args.limit, 0), dtype=np.int64)
+    count = 0
+    response = None
+
+    for response in iter_report(
+        client,
+        args.property_id,
+        args.category_dimension,
+        args.start_date,
+        args.end_date,
+        args.limit,
+        cache_ttl=args.cache_ttl,
+        refresh=args.refresh,
+        min_revenue=args.min_revenue,
+    ):
+        # Read the raw protobuf rows; the proto-plus wrappers in response.rows are
+        # rebuilt on every field access.
+        rows = response._pb.rows
+        page_count = len(rows)
+        if not page_count:
+            continue
+        page_categories = [(row.dimension_values[0].value or "(not set)")[:40] for row in rows]
+        page_sessions = np.fromiter((int(row.metric_values[0].value or 0) for row in rows), np.int64, page_count)
+        durations = [format_seconds(float(row.metric_values[1].value or 0)) for row in rows]
+        page_views = np.fromiter((int(row.metric_values[2].value or 0) for row in rows), np.int64, page_count)
+        page_revenues = np.fromiter((float(row.metric_values[3].value or 0) for row in rows), np.float64, page_count)
+
+        sys.stdout.write(
+            "".join(
+                category.ljust(40)
+                + " "
+                + str(engaged).rjust(18)
+                + " "
+                + duration
+                + " "
+                + str(views).rjust(12)
+                + " $"
+                + f"{revenue:,.2f}".rjust(10)
+                + "\n"
+                for category, engaged, duration, views, revenue in zip(
+                    page_categories,
+                    page_sessions.tolist(),
+                    durations,
+                    page_views.tolist(),
+                    page_revenues.tolist(),
+                )
+            )
+        )
+        categories.extend(page_categories)
+        revenues[count : count + page_count] = page_revenues
+        sessions[count : count + page_count] = page_sessions
+        count += page_count
+
+    if response is not None:
+        quota = response.property_quota.tokens_per_day
+        if quota.consumed or quota.remaining:
+            print(f"GA4 tokens today: {quota.consumed} used, {quota.remaining} remaining")
+
+    if not count:
         print("No data returned.")
         return
 
-    categories = []
-    revenues = []
-    sessions = []
-
-    for row in response.rows:
-        category = row.dimension_values[0].value or "(not set)"
-        engaged_sessions = int(row.metric_values[0].value or 0)
-        avg_session_duration = float(row.metric_values[1].value or 0)
-        views = int(row.metric_values[2].value or 0)
-        revenue = float(row.metric_values[3].value or 0)
-        minutes, seconds = divmod(int(round(avg_session_duration)), 60)
-        print(
-            f"{category[:40]:<40} {engaged_sessions:>18} {minutes:02d}:{seconds:02d}"
-            f" {views:>12} ${revenue:>10,.2f}"
-        )
-        categories.append(category[:40])
-        revenues.append(revenue)
-        sessions.append(engaged_sessions)
+    revenues = revenues[:count]
+    sessions = sessions[:count]
 
     chart_path = save_chart(categories, revenues, sessions, args.category_dimension, args.start_date, args.end_date)
     if chart_path:
         print(f"Saved bar chart to {chart_path}")
-    elif plt is None:
+    elif Figure is None:
         print("matplotlib not installed; skipping chart generation.")
     else:
         print("No chart was produced; insufficient numeric data.")
 
 
+def main():
+    run(build_parser().parse_args())
+
+
 if __name__ == "__main__":
     main()
@@ -10,36 +10,43 @@ Recommended Visualization: Line chart over time
 Original SQL:
     -- Engagement of email-acquired users vs others
 
-    WITH first_touch AS (
-      -- Identify each user's first session and its acquisition source
+    WITH events_filtered AS (
+      -- Single scan of the export; every CTE below reads from this
       SELECT
         user_pseudo_id,
-        MIN(TIMESTAMP_MICROS(event_timestamp)) AS first_session_ts,
-        ANY_VALUE(traffic_source.source) AS first_source,
-        ANY_VALUE(traffic_source.medium) AS first_medium,
-        ANY_VALUE(traffic_source.name) AS first_campaign
+        event_timestamp,
+        event_name,
+        (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS ga_session_id,
+        traffic_source
       FROM `websitecountryspikes.analytics_427048881.events_*`
       WHERE
-        _TABLE_SUFFIX BETWEEN '20251101' AND FORMAT_DATE('%Y%m%d', CURRENT_DATE())
-        AND event_name = 'session_start'
-      GROUP BY user_pseudo_id
+        _TABLE_SUFFIX BETWEEN @start AND @end
+        AND event_name IN ('session_start', 'page_view')
+    ),
+
+    first_touch AS (
+      -- Identify each user's first session and its acquisition source
+      SELECT
+        user_pseudo_id,
+        TIMESTAMP_MICROS(event_timestamp) AS first_session_ts,
+        traffic_source.source AS first_source,
+        traffic_source.medium AS first_medium,
+        traffic_source.name AS first_campaign
+      FROM events_filtered
+      WHERE event_name = 'session_start'
+      QUALIFY ROW_NUMBER() OVER (PARTITION BY user_pseudo_id ORDER BY event_timestamp) = 1
     ),
 
     all_sessions AS (
       -- All subsequent sessions (for lifetime behavior)
       SELECT
         user_pseudo_id,
-        (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS ga_session_id,
-        CONCAT(user_pseudo_id, '.', CAST(
-          (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS STRING)
-        ) AS full_session_id,
+        ga_session_id,
+        CONCAT(user_pseudo_id, '.', CAST(ga_session_id AS STRING)) AS full_session_id,
         event_name,
         TIMESTAMP_MICROS(event_timestamp) AS event_ts,
         TIMESTAMP_TRUNC(TIMESTAMP_MICROS(event_timestamp), DAY) AS event_day
-      FROM `websitecountryspikes.analytics_427048881.events_*`
-      WHERE
-        _TABLE_SUFFIX BETWEEN '20251101' AND FORMAT_DATE('%Y%m%d', CURRENT_DATE())
-        AND event_name IN ('session_start', 'page_view')
+      FROM events_filtered
     ),
 
     session_rollup AS (
@@ -59,7 +66,8 @@ Original SQL:
       -- Aggregate user-level engagement metrics
       SELECT
         user_pseudo_id,
-        COUNT(DISTINCT full_session_id) AS total_sessions,
+        -- session_rollup has one row per session, so COUNT(*) is exact
+        COUNT(*) AS total_sessions,
         AVG(session_duration_seconds) AS avg_session_duration_seconds,
         SUM(pageviews) AS total_pageviews
       FROM session_rollup
@@ -72,7 +80,9 @@ Original SQL:
           WHEN LOWER(first_source) LIKE '%email%' OR LOWER(first_medium) LIKE '%email%' THEN 'email_acquired'
           ELSE 'non_email'
         END AS user_group,
-        COUNT(DISTINCT ue.user_pseudo_id) AS users,
+        -- One user_engagement row and one first_touch row per user, so the join
+        -- yields one row per user
+        COUNT(*) AS users,
         AVG(total_sessions) AS avg_sessions_per_user,
         AVG(avg_session_duration_seconds) AS avg_session_duration_seconds,
         AVG(total_pageviews) AS avg_total_pageviews
@@ -95,8 +105,9 @@ Original SQL:
 from __future__ import annotations
 
 import argparse
+import hashlib
 import os
-from datetime import datetime
+from datetime import date
 from pathlib import Path
 
 import pandas as pd
@@ -104,9 +115,11 @@ from google.cloud import bigquery
 
 QUERY_NAME = 'Engagement of email-acquired users vs others'
 RECOMMENDED_CHART = 'Line chart over time'
-SQL = "-- Engagement of email-acquired users vs others\n\nWITH first_touch AS (\n  -- Identify each user's first session and its acquisition source\n  SELECT\n    user_pseudo_id,\n    MIN(TIMESTAMP_MICROS(event_timestamp)) AS first_session_ts,\n    ANY_VALUE(traffic_source.source) AS first_source,\n    ANY_VALUE(traffic_source.medium) AS first_medium,\n    ANY_VALUE(traffic_source.name) AS first_campaign\n  FROM `websitecountryspikes.analytics_427048881.events_*`\n  WHERE\n    _TABLE_SUFFIX BETWEEN '20251101' AND FORMAT_DATE('%Y%m%d', CURRENT_DATE())\n    AND event_name = 'session_start'\n  GROUP BY user_pseudo_id\n),\n\nall_sessions AS (\n  -- All subsequent sessions (for lifetime behavior)\n  SELECT\n    user_pseudo_id,\n    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS ga_session_id,\n    CONCAT(user_pseudo_id, '.', CAST(\n      (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS STRING)\n    ) AS full_session_id,\n    event_name,\n    TIMESTAMP_MICROS(event_timestamp) AS event_ts,\n    TIMESTAMP_TRUNC(TIMESTAMP_MICROS(event_timestamp), DAY) AS event_day\n  FROM `websitecountryspikes.analytics_427048881.events_*`\n  WHERE\n    _TABLE_SUFFIX BETWEEN '20251101' AND FORMAT_DATE('%Y%m%d', CURRENT_DATE())\n    AND event_name IN ('session_start', 'page_view')\n),\n\nsession_rollup AS (\n  SELECT\n    full_session_id,\n    user_pseudo_id,\n    MIN(event_ts) AS session_start_ts,\n    MAX(event_ts) AS session_end_ts,\n    TIMESTAMP_DIFF(MAX(event_ts), MIN(event_ts), SECOND) AS session_duration_seconds,\n    COUNTIF(event_name = 'page_view') AS pageviews\n  FROM all_sessions\n  WHERE full_session_id IS NOT NULL\n  GROUP BY full_session_id, user_pseudo_id\n),\n\nuser_engagement AS (\n  -- Aggregate user-level engagement metrics\n  SELECT\n    user_pseudo_id,\n    COUNT(DISTINCT full_session_id) AS total_sessions,\n    AVG(session_duration_seconds) AS avg_session_duration_seconds,\n    SUM(pageviews) AS total_pageviews\n  FROM session_rollup\n  GROUP BY user_pseudo_id\n),\n\nemail_vs_non AS (\n  SELECT\n    CASE\n      WHEN LOWER(first_source) LIKE '%email%' OR LOWER(first_medium) LIKE '%email%' THEN 'email_acquired'\n      ELSE 'non_email'\n    END AS user_group,\n    COUNT(DISTINCT ue.user_pseudo_id) AS users,\n    AVG(total_sessions) AS avg_sessions_per_user,\n    AVG(avg_session_duration_seconds) AS avg_session_duration_seconds,\n    AVG(total_pageviews) AS avg_total_pageviews\n  FROM user_engagement ue\n  JOIN first_touch ft\n    ON ue.user_pseudo_id = ft.user_pseudo_id\n  GROUP BY user_group\n)\n\nSELECT\n  user_group,\n  users,\n  ROUND(avg_sessions_per_user, 2) AS avg_sessions_per_user,\n  ROUND(avg_session_duration_seconds, 1) AS avg_session_duration_seconds,\n  ROUND(avg_total_pageviews, 1) AS avg_total_pageviews\nFROM email_vs_non\nORDER BY user_group;"
+SQL = "-- Engagement of email-acquired users vs others\n\nWITH events_filtered AS (\n  -- Single scan of the export; every CTE below reads from this\n  SELECT\n    user_pseudo_id,\n    event_timestamp,\n    event_name,\n    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS ga_session_id,\n    traffic_source\n  FROM `websitecountryspikes.analytics_427048881.events_*`\n  WHERE\n    _TABLE_SUFFIX BETWEEN @start AND @end\n    AND event_name IN ('session_start', 'page_view')\n),\n\nfirst_touch AS (\n  -- Identify each user's first session and its acquisition source\n  SELECT\n    user_pseudo_id,\n    TIMESTAMP_MICROS(event_timestamp) AS first_session_ts,\n    traffic_source.source AS first_source,\n    traffic_source.medium AS first_medium,\n    traffic_source.name AS first_campaign\n  FROM events_filtered\n  WHERE event_name = 'session_start'\n  QUALIFY ROW_NUMBER() OVER (PARTITION BY user_pseudo_id ORDER BY event_timestamp) = 1\n),\n\nall_sessions AS (\n  -- All subsequent sessions (for lifetime behavior)\n  SELECT\n    user_pseudo_id,\n    ga_session_id,\n    CONCAT(user_pseudo_id, '.', CAST(ga_session_id AS STRING)) AS full_session_id,\n    event_name,\n    TIMESTAMP_MICROS(event_timestamp) AS event_ts,\n    TIMESTAMP_TRUNC(TIMESTAMP_MICROS(event_timestamp), DAY) AS event_day\n  FROM events_filtered\n),\n\nsession_rollup AS (\n  SELECT\n    full_session_id,\n    user_pseudo_id,\n    MIN(event_ts) AS session_start_ts,\n    MAX(event_ts) AS session_end_ts,\n    TIMESTAMP_DIFF(MAX(event_ts), MIN(event_ts), SECOND) AS session_duration_seconds,\n    COUNTIF(event_name = 'page_view') AS pageviews\n  FROM all_sessions\n  WHERE full_session_id IS NOT NULL\n  GROUP BY full_session_id, user_pseudo_id\n),\n\nuser_engagement AS (\n  -- Aggregate user-level engagement metrics\n  SELECT\n    user_pseudo_id,\n    -- session_rollup has one row per session, so COUNT(*) is exact\n    COUNT(*) AS total_sessions,\n    AVG(session_duration_seconds) AS avg_session_duration_seconds,\n    SUM(pageviews) AS total_pageviews\n  FROM session_rollup\n  GROUP BY user_pseudo_id\n),\n\nemail_vs_non AS (\n  SELECT\n    CASE\n      WHEN LOWER(first_source) LIKE '%email%' OR LOWER(first_medium) LIKE '%email%' THEN 'email_acquired'\n      ELSE 'non_email'\n    END AS user_group,\n    -- One user_engagement row and one first_touch row per user, so the join\n    -- yields one row per user\n    COUNT(*) AS users,\n    AVG(total_sessions) AS avg_sessions_per_user,\n    AVG(avg_session_duration_seconds) AS avg_session_duration_seconds,\n    AVG(total_pageviews) AS avg_total_pageviews\n  FROM user_engagement ue\n  JOIN first_touch ft\n    ON ue.user_pseudo_id = ft.user_pseudo_id\n  GROUP BY user_group\n)\n\nSELECT\n  user_group,\n  users,\n  ROUND(avg_sessions_per_user, 2) AS avg_sessions_per_user,\n  ROUND(avg_session_duration_seconds, 1) AS avg_session_duration_seconds,\n  ROUND(avg_total_pageviews, 1) AS avg_total_pageviews\nFROM email_vs_non\nORDER BY user_group;"
 DEFAULT_PROJECT = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET = os.getenv("GA_DATASET_ID", "analytics_427048881")
+DEFAULT_START_DATE = "2025-11-01"
+NUMERIC_FIELD_TYPES = {"INT64", "INTEGER", "FLOAT64", "FLOAT", "NUMERIC", "BIGNUMERIC"}
 
 
 def resolve_sql(project: str, dataset: str) -> str:
@@ -115,14 +128,26 @@ def resolve_sql(project: str, dataset: str) -> str:
     return text
 
 
-def run_query(project: str, dataset: str) -> pd.DataFrame:
+def run_query(project: str, dataset: str, start_date: str, end_date: str) -> tuple[pd.DataFrame, list[str]]:
     client = bigquery.Client(project=project)
     rendered_sql = resolve_sql(project, dataset)
-    job = client.query(rendered_sql)
-    return job.result().to_dataframe(create_bqstorage_client=True)
+    # The date range goes in as parameters so the SQL text stays identical
+    # between runs and BigQuery can answer repeats from its result cache.
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("start", "STRING", start_date.replace("-", "")),
+            bigquery.ScalarQueryParameter("end", "STRING", end_date.replace("-", "")),
+        ],
+        use_query_cache=True,
+    )
+    job = client.query(rendered_sql, job_config=job_config)
+    result = job.result()
+    numeric_cols = [field.name for field in result.schema if field.field_type in NUMERIC_FIELD_TYPES]
+    table = result.to_arrow(create_bqstorage_client=True)
+    return table.to_pandas(types_mapper=pd.ArrowDtype), numeric_cols
 
 
-def main() -> None:
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description=f"Run '{QUERY_NAME}' query")
     parser.add_argument("--project", default=DEFAULT_PROJECT, help="GCP project ID")
     parser.add_argument("--dataset", default=DEFAULT_DATASET, help="BigQuery dataset ID (used for placeholder replacement)")
@@ -131,46 +156,45 @@ def main() -> None:
         default='engagement-of-email-acquired-users-vs-others',
         help="Prefix for CSV output",
     )
-    parser.add_argument("--start-date", help="Optional date range start label")
-    parser.add_argument("--end-date", help="Optional date range end label")
-    args = parser.parse_args()
+    parser.add_argument("--start-date", default=DEFAULT_START_DATE, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="End date (YYYY-MM-DD, default: today)")
+    return parser
 
-    df = run_query(args.project, args.dataset)
+
+def run(args: argparse.Namespace) -> None:
+    end_date = args.end_date or date.today().isoformat()
+    df, numeric_cols = run_query(args.project, args.dataset, args.start_date, end_date)
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
     print(f"Project: {args.project}")
     print(f"Dataset: {args.dataset}")
-    if args.start_date or args.end_date:
-        print(f"Date range: {args.start_date or 'N/A'} -> {args.end_date or 'N/A'}")
+    print(f"Date range: {args.start_date} -> {end_date}")
     print(f"Returned {len(df)} rows")
     print(df.head())
 
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    csv_path = Path(f"{args.output_prefix}_{ts}.csv")
-    df.to_csv(csv_path, index=False)
-    print(f"Saved raw results to {csv_path}")
+    # Name outputs after the query inputs and result so identical re-runs reuse
+    # the files already on disk.
+    csv_text = df.to_csv(index=False)
+    key = f"{args.project}|{args.dataset}|{args.start_date}|{end_date}|{csv_text}"
+    suffix = hashlib.sha1(key.encode("utf-8")).hexdigest()[:10]
+    csv_path = Path(f"{args.output_prefix}_{suffix}.csv")
+    if csv_path.exists():
+        print(f"Results unchanged: {csv_path}")
+    else:
+        csv_path.write_text(csv_text, encoding="utf-8")
+        print(f"Saved raw results to {csv_path}")
 
     chart_path = None
     try:
         import matplotlib.pyplot as plt  # type: ignore
 
-        numeric_cols: list[str] = []
-        for column in df.columns:
-            series = df[column]
-            if pd.api.types.is_numeric_dtype(series):
-                numeric_cols.append(column)
-                continue
-            coerced = pd.to_numeric(series, errors="coerce")
-            if coerced.notna().any():
-                df[column] = coerced
-                if pd.api.types.is_numeric_dtype(df[column]):
-                    numeric_cols.append(column)
-
         if numeric_cols:
             subset = df[numeric_cols].head(20)
-            if not subset.empty:
-                chart_path = Path(f"{args.output_prefix}_{ts}.png")
+            chart_path = Path(f"{args.output_prefix}_{suffix}.png")
+            if chart_path.exists():
+                print(f"Chart unchanged: {chart_path}")
+            elif not subset.empty:
                 plt.figure(figsize=(12, 6))
                 subset.plot(ax=plt.gca())
                 plt.title(QUERY_NAME)
@@ -188,5 +212,9 @@ def main() -> None:
         print(f"Failed to build chart: {exc}")
 
 
+def main() -> None:
+    run(build_parser().parse_args())
+
+
 if __name__ == "__main__":
     main()
@@ -13,32 +13,46 @@ Example:
 """
 
 import argparse
-from datetime import datetime
+import csv
+import sys
 from pathlib import Path
-from typing import Optional
 
+import numpy as np
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, OrderBy, RunReportRequest
+from google.analytics.data_v1beta.types import (
+    DateRange,
+    Dimension,
+    Filter,
+    FilterExpression,
+    FilterExpressionList,
+    Metric,
+    NumericValue,
+    OrderBy,
+    RunReportRequest,
+)
+
+from _ga4_reports import DEFAULT_CACHE_TTL, create_client, metric_threshold, run_report_cached, snap_to_day
+from _report_outputs import chart_figure, output_suffix
 
 QUERY_NAME = "Hidden Gem Recipes"
 RECOMMENDED_CHART = "Scatter plot of engagement vs views or table sorted by engagement"
 
-def create_client(service_account_key: Optional[str]) -> BetaAnalyticsDataClient:
-    if service_account_key:
-        from google.oauth2 import service_account
 
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_key,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-        )
-        return BetaAnalyticsDataClient(credentials=credentials)
-    return BetaAnalyticsDataClient()
-
-
-def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date: str, end_date: str, limit: int):
+def fetch_report(
+    client: BetaAnalyticsDataClient,
+    property_id: str,
+    start_date: str,
+    end_date: str,
+    limit: int,
+    max_views: int,
+    min_engagement_rate: float,
+    min_engagement_seconds: float,
+    cache_ttl: float = DEFAULT_CACHE_TTL,
+    refresh: bool = False,
+):
     request = RunReportRequest(
         property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+        date_ranges=[DateRange(start_date=snap_to_day(start_date), end_date=snap_to_day(end_date))],
         dimensions=[Dimension(name="pagePathPlusQueryString")],
         metrics=[
             Metric(name="screenPageViews"),
@@ -46,31 +60,131 @@ def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date:
             Metric(name="averageSessionDuration"),
             Metric(name="engagedSessions"),
         ],
-        order_bys=[OrderBy(metric=OrderBy.MetricOrderBy(metric_name="engagementRate"), desc=True)],
+        metric_filter=FilterExpression(
+            and_group=FilterExpressionList(
+                expressions=[
+                    metric_threshold(
+                        "screenPageViews",
+                        Filter.NumericFilter.Operation.LESS_THAN_OR_EQUAL,
+                        NumericValue(int64_value=max_views),
+                    ),
+                    metric_threshold(
+                        "engagementRate",
+                        Filter.NumericFilter.Operation.GREATER_THAN_OR_EQUAL,
+                        NumericValue(double_value=min_engagement_rate),
+                    ),
+                    metric_threshold(
+                        "averageSessionDuration",
+                        Filter.NumericFilter.Operation.GREATER_THAN_OR_EQUAL,
+                        NumericValue(double_value=min_engagement_seconds),
+                    ),
+                ]
+            )
+        ),
+        order_bys=[
+            OrderBy(metric=OrderBy.MetricOrderBy(metric_name="engagementRate"), desc=True),
+            OrderBy(metric=OrderBy.MetricOrderBy(metric_name="averageSessionDuration"), desc=True),
+        ],
         limit=limit,
+        metric_aggregations=[],
+        return_property_quota=True,
     )
-    return client.run_report(request)
+    return run_report_cached(client, request, cache_ttl=cache_ttl, refresh=refresh)
+
+
+def _write_outputs(gems, suffix, write_csv=True, write_chart=True):
+    # matplotlib is only imported here, so runs that find no gems (or skip the
+    # chart) never pay for it.
+    prefix = "hidden_gem_recipes"
+
+    csv_path = Path(f"{prefix}_{suffix}.csv")
+    if write_csv and csv_path.exists():
+        print(f"CSV unchanged: {csv_path}")
+    elif write_csv:
+        with csv_path.open("w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(gems.keys())
+            writer.writerows(zip(*(column.tolist() if isinstance(column, np.ndarray) else column for column in gems.values())))
+        print(f"Saved CSV to {csv_path}")
+
+    if not write_chart:
+        return
 
+    chart_path = Path(f"{prefix}_{suffix}.png")
+    if chart_path.exists():
+        print(f"Chart unchanged: {chart_path}")
+        return
 
-def main():
+    try:
+        fig = chart_figure((14, 7))
+        ax = fig.add_subplot(111)
+        points = ax.scatter(
+            gems["page_views"],
+            gems["avg_session_duration_seconds"],
+            c=gems["engagement_rate"],
+            cmap="viridis",
+            s=np.clip(gems["engaged_sessions"], 1, None) * 4,
+        )
+        fig.colorbar(points, ax=ax, label="Engagement Rate")
+        ax.set_xlabel("Page Views")
+        ax.set_ylabel("Avg Session Duration (sec)")
+        ax.set_title("Hidden Gem Recipe Engagement")
+        fig.tight_layout()
+        fig.savefig(chart_path)
+        print(f"Saved chart to {chart_path}")
+    except ImportError:
+        print("matplotlib not installed; skipping chart generation.")
+    except Exception as exc:
+        print(f"Failed to build chart: {exc}")
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Find low-traffic, high-engagement recipe pages")
     parser.add_argument("--property-id", required=True, help="GA4 property ID")
     parser.add_argument("--service-account-key", help="Path to service account JSON key")
     parser.add_argument("--start-date", default="30daysAgo", help="Start date (YYYY-MM-DD or relative)")
     parser.add_argument("--end-date", default="yesterday", help="End date (YYYY-MM-DD or relative)")
-    parser.add_argument("--limit", type=int, default=200, help="Number of pages to fetch before filtering")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of matching pages to fetch")
     parser.add_argument("--max-views", type=int, default=600, help="Maximum views to consider low traffic")
     parser.add_argument("--min-engagement-rate", type=float, default=0.50, help="Minimum engagement rate (0-1)")
     parser.add_argument("--min-engagement-seconds", type=float, default=90.0, help="Minimum average engagement time in seconds")
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help="Seconds to reuse a cached GA4 response (0 disables the cache)",
+    )
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached GA4 responses and re-fetch")
+    parser.add_argument("--no-csv", action="store_true", help="Skip writing the CSV export")
+    parser.add_argument("--no-chart", action="store_true", help="Skip rendering the scatter chart")
+    parser.add_argument("--no-outputs", action="store_true", help="Print the table only (implies --no-csv --no-chart)")
+    return parser
 
-    args = parser.parse_args()
+
+def run(args: argparse.Namespace) -> None:
+    args.start_date = snap_to_day(args.start_date)
+    args.end_date = snap_to_day(args.end_date)
 
     client = create_client(args.service_account_key)
-    response = fetch_report(client, args.property_id, args.start_date, args.end_date, args.limit)
+    response = fetch_report(
+        client,
+        args.property_id,
+        args.start_date,
+        args.end_date,
+        args.limit,
+        args.max_views,
+        args.min_engagement_rate,
+        args.min_engagement_seconds,
+        cache_ttl=args.cache_ttl,
+        refresh=args.refresh,
+    )
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
     print(f"Date range: {args.start_date} -> {args.end_date}")
+    quota = response.property_quota.tokens_per_day
+    if quota.consumed or quota.remaining:
+        print(f"GA4 tokens today: {quota.consumed} used, {quota.remaining} remaining")
     print(
         f"Hidden gem recipes ({args.start_date} to {args.end_date}) "
         f"[views <= {args.max_views}, engagement rate >= {args.min_engagement_rate}, "
@@ -80,86 +194,56 @@ def main():
     print(f"{'Views':>8} {'Engagement Rate':>17} {'Avg Eng Time':>15} {'Engaged Sessions':>18} {'Page URL':<60}")
     print("-" * 120)
 
-    gems = []
-    for row in response.rows:
-        views = int(row.metric_values[0].value or 0)
-        engagement_rate = float(row.metric_values[1].value or 0)
-        avg_session_duration = float(row.metric_values[2].value or 0)
-        engaged_sessions = int(row.metric_values[3].value or 0)
-        page_url = row.dimension_values[0].value or "(not set)"
-
-        if (
-            views <= args.max_views
-            and engagement_rate >= args.min_engagement_rate
-            and avg_session_duration >= args.min_engagement_seconds
-        ):
-            gems.append(
-                {
-                    "page_views": views,
-                    "engagement_rate": engagement_rate,
-                    "avg_session_duration_seconds": avg_session_duration,
-                    "engaged_sessions": engaged_sessions,
-                    "page_url": page_url,
-                }
-            )
-
-    if not gems:
+    # Read the raw protobuf rows; the proto-plus wrappers in response.rows are
+    # rebuilt on every field access.
+    rows = response._pb.rows
+    count = len(rows)
+    if not count:
         print("No pages met the criteria.")
         return
 
-    gems.sort(key=lambda x: (x["engagement_rate"], x["avg_session_duration_seconds"]), reverse=True)
-
-    for row in gems:
-        views = row["page_views"]
-        engagement_rate = row["engagement_rate"]
-        avg_session_duration = row["avg_session_duration_seconds"]
-        engaged_sessions = row["engaged_sessions"]
-        page_url = row["page_url"]
-        minutes, seconds = divmod(int(round(avg_session_duration)), 60)
-        print(
-            f"{views:>8} {engagement_rate:>17.2%} {minutes:02d}:{seconds:02d}"
-            f" {engaged_sessions:>18} {page_url[:60]}"
+    gems = {
+        "page_views": np.fromiter((int(r.metric_values[0].value or 0) for r in rows), dtype=np.int64, count=count),
+        "engagement_rate": np.fromiter((float(r.metric_values[1].value or 0) for r in rows), dtype=np.float64, count=count),
+        "avg_session_duration_seconds": np.fromiter(
+            (float(r.metric_values[2].value or 0) for r in rows), dtype=np.float64, count=count
+        ),
+        "engaged_sessions": np.fromiter((int(r.metric_values[3].value or 0) for r in rows), dtype=np.int64, count=count),
+        "page_url": [r.dimension_values[0].value or "(not set)" for r in rows],
+    }
+
+    minutes, seconds = np.divmod(np.rint(gems["avg_session_duration_seconds"]).astype(np.int64), 60)
+    sys.stdout.write(
+        "".join(
+            f"{views:>8} {rate:>17.2%} {mins:02d}:{secs:02d} {engaged:>18} {url[:60]}\n"
+            for views, rate, mins, secs, engaged, url in zip(
+                gems["page_views"].tolist(),
+                gems["engagement_rate"].tolist(),
+                minutes.tolist(),
+                seconds.tolist(),
+                gems["engaged_sessions"].tolist(),
+                gems["page_url"],
+            )
         )
+    )
 
-    try:
-        import pandas as pd  # type: ignore
+    if args.no_outputs:
+        return
+    suffix = output_suffix(
+        args.property_id,
+        args.start_date,
+        args.end_date,
+        args.max_views,
+        args.min_engagement_rate,
+        args.min_engagement_seconds,
+        *(column.tobytes() for column in gems.values() if isinstance(column, np.ndarray)),
+        "\n".join(gems["page_url"]),
+    )
+    _write_outputs(gems, suffix, write_csv=not args.no_csv, write_chart=not args.no_chart)
 
-        df = pd.DataFrame(gems)
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        prefix = "hidden_gem_recipes"
-        csv_path = Path(f"{prefix}_{ts}.csv")
-        df.to_csv(csv_path, index=False)
-        print(f"Saved CSV to {csv_path}")
 
-        try:
-            import matplotlib.pyplot as plt  # type: ignore
-
-            if not df.empty:
-                plt.figure(figsize=(14, 7))
-                plt.scatter(
-                    df["page_views"],
-                    df["avg_session_duration_seconds"],
-                    c=df["engagement_rate"],
-                    cmap="viridis",
-                    s=df["engaged_sessions"].clip(lower=1) * 4,
-                )
-                plt.colorbar(label="Engagement Rate")
-                plt.xlabel("Page Views")
-                plt.ylabel("Avg Session Duration (sec)")
-                plt.title("Hidden Gem Recipe Engagement")
-                plt.tight_layout()
-                chart_path = Path(f"{prefix}_{ts}.png")
-                plt.savefig(chart_path)
-                plt.close()
-                print(f"Saved chart to {chart_path}")
-            else:
-                print("Insufficient data to render chart.")
-        except ImportError:
-            print("matplotlib not installed; skipping chart generation.")
-        except Exception as exc:
-            print(f"Failed to build chart: {exc}")
-    except ImportError:
-        print("pandas not installed; skipping CSV/chart generation.")
+def main():
+    run(build_parser().parse_args())
 
 
 if __name__ == "__main__":
@@ -13,29 +13,45 @@ Example:
 """
 
 import argparse
+import csv
+import operator
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
 
+import numpy as np
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, OrderBy, RunReportRequest
+from google.analytics.data_v1beta.types import (
+    DateRange,
+    Dimension,
+    Filter,
+    FilterExpression,
+    FilterExpressionList,
+    Metric,
+    NumericValue,
+    OrderBy,
+    RunReportRequest,
+)
+
+from _ga4_reports import MAX_CONCURRENT_REPORTS, create_client, metric_threshold, property_id_list
+from _report_outputs import chart_figure
 
 QUERY_NAME = "High-Traffic Low-Engagement Pages"
 RECOMMENDED_CHART = "Table or horizontal bar chart sorted by views"
-
-def create_client(service_account_key: Optional[str]) -> BetaAnalyticsDataClient:
-    if service_account_key:
-        from google.oauth2 import service_account
-
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_key,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-        )
-        return BetaAnalyticsDataClient(credentials=credentials)
-    return BetaAnalyticsDataClient()
-
-
-def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date: str, end_date: str, limit: int):
+_row_values = operator.attrgetter("metric_values", "dimension_values")
+ROW_FMT = "{:>12} {:>17.2%} {:02d}:{:02d} {:>18} {:.60}".format
+
+
+def fetch_report(
+    client: BetaAnalyticsDataClient,
+    property_id: str,
+    start_date: str,
+    end_date: str,
+    limit: int,
+    min_views: int,
+    max_engagement_rate: float,
+):
     request = RunReportRequest(
         property=f"properties/{property_id}",
         date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
@@ -46,30 +62,109 @@ def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date:
             Metric(name="averageSessionDuration"),
             Metric(name="engagedSessions"),
         ],
+        metric_filter=FilterExpression(
+            and_group=FilterExpressionList(
+                expressions=[
+                    metric_threshold(
+                        "screenPageViews",
+                        Filter.NumericFilter.Operation.GREATER_THAN_OR_EQUAL,
+                        NumericValue(int64_value=min_views),
+                    ),
+                    metric_threshold(
+                        "engagementRate",
+                        Filter.NumericFilter.Operation.LESS_THAN_OR_EQUAL,
+                        NumericValue(double_value=max_engagement_rate),
+                    ),
+                ]
+            )
+        ),
         order_bys=[OrderBy(metric=OrderBy.MetricOrderBy(metric_name="screenPageViews"), desc=True)],
         limit=limit,
     )
     return client.run_report(request)
 
 
-def main():
+def fetch_reports_batch(
+    client: BetaAnalyticsDataClient,
+    property_ids: list[str],
+    start_date: str,
+    end_date: str,
+    limit: int,
+    min_views: int,
+    max_engagement_rate: float,
+):
+    # batch_run_reports only accepts requests for a single property, so a
+    # multi-property rollup issues one run_report per property concurrently on
+    # the shared client instead; wall time is roughly one round-trip.
+    with ThreadPoolExecutor(max_workers=min(len(property_ids), MAX_CONCURRENT_REPORTS)) as executor:
+        return list(
+            executor.map(
+                lambda property_id: fetch_report(
+                    client, property_id, start_date, end_date, limit, min_views, max_engagement_rate
+                ),
+                property_ids,
+            )
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Highlight high-traffic, low-engagement recipe pages")
-    parser.add_argument("--property-id", required=True, help="GA4 property ID")
+    property_group = parser.add_mutually_exclusive_group(required=True)
+    property_group.add_argument("--property-id", help="GA4 property ID")
+    property_group.add_argument(
+        "--property-ids", type=property_id_list, help="Comma-separated GA4 property IDs to report on together"
+    )
     parser.add_argument("--service-account-key", help="Path to service account JSON key")
     parser.add_argument("--start-date", default="30daysAgo", help="Start date (YYYY-MM-DD or relative)")
     parser.add_argument("--end-date", default="yesterday", help="End date (YYYY-MM-DD or relative)")
-    parser.add_argument("--limit", type=int, default=200, help="Number of pages to pull before filtering")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of matching pages to fetch")
     parser.add_argument("--min-views", type=int, default=800, help="Minimum views to consider high traffic")
     parser.add_argument("--max-engagement-rate", type=float, default=0.35, help="Maximum engagement rate (0-1) to flag")
+    parser.add_argument("--no-csv", action="store_true", help="Skip writing the CSV export")
+    parser.add_argument("--no-chart", action="store_true", help="Skip rendering the bar chart")
+    return parser
 
-    args = parser.parse_args()
+
+def run(args: argparse.Namespace) -> None:
+    property_ids = args.property_ids or [args.property_id]
 
     client = create_client(args.service_account_key)
-    response = fetch_report(client, args.property_id, args.start_date, args.end_date, args.limit)
+    if len(property_ids) == 1:
+        responses = [
+            fetch_report(
+                client,
+                property_ids[0],
+                args.start_date,
+                args.end_date,
+                args.limit,
+                args.min_views,
+                args.max_engagement_rate,
+            )
+        ]
+    else:
+        responses = fetch_reports_batch(
+            client,
+            property_ids,
+            args.start_date,
+            args.end_date,
+            args.limit,
+            args.min_views,
+            args.max_engagement_rate,
+        )
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
     print(f"Date range: {args.start_date} -> {args.end_date}")
+
+    for property_id, response in zip(property_ids, responses):
+        prefix = "high_traffic_low_engagement"
+        if len(property_ids) > 1:
+            print(f"\nProperty: {property_id}")
+            prefix = f"{prefix}_{property_id}"
+        report_property(args, response, prefix)
+
+
+def report_property(args: argparse.Namespace, response, prefix: str) -> None:
     print(
         f"High-traffic, low-engagement pages ({args.start_date} to {args.end_date}) "
         f"[views >= {args.min_views}, engagement rate <= {args.max_engagement_rate}]"
@@ -78,75 +173,78 @@ def main():
     print(f"{'Page Views':>12} {'Engagement Rate':>17} {'Avg Eng Time':>15} {'Engaged Sessions':>18} {'Page URL':<60}")
     print("-" * 120)
 
-    flagged = []
-    for row in response.rows:
-        views = int(row.metric_values[0].value or 0)
-        engagement_rate = float(row.metric_values[1].value or 0)
-        avg_session_duration = float(row.metric_values[2].value or 0)
-        engaged_sessions = int(row.metric_values[3].value or 0)
-        page_url = row.dimension_values[0].value or "(not set)"
-
-        if views >= args.min_views and engagement_rate <= args.max_engagement_rate:
-            flagged.append(
-                {
-                    "page_views": views,
-                    "engagement_rate": engagement_rate,
-                    "avg_session_duration_seconds": avg_session_duration,
-                    "engaged_sessions": engaged_sessions,
-                    "page_url": page_url,
-                }
-            )
-
-    if not flagged:
+    rows = list(response.rows)
+    count = len(rows)
+    if not count:
         print("No pages met the criteria.")
         return
 
-    for row in flagged:
-        views = row["page_views"]
-        engagement_rate = row["engagement_rate"]
-        avg_session_duration = row["avg_session_duration_seconds"]
-        engaged_sessions = row["engaged_sessions"]
-        page_url = row["page_url"]
-        minutes, seconds = divmod(int(round(avg_session_duration)), 60)
-        print(
-            f"{views:>12} {engagement_rate:>17.2%} {minutes:02d}:{seconds:02d}"
-            f" {engaged_sessions:>18} {page_url[:60]}"
+    # Fetch both repeated fields per row in one C-level call.
+    cells = [_row_values(r) for r in rows]
+    flagged = {
+        "page_views": np.fromiter((int(mv[0].value or 0) for mv, _ in cells), dtype=np.int64, count=count),
+        "engagement_rate": np.fromiter((float(mv[1].value or 0) for mv, _ in cells), dtype=np.float64, count=count),
+        "avg_session_duration_seconds": np.fromiter(
+            (float(mv[2].value or 0) for mv, _ in cells), dtype=np.float64, count=count
+        ),
+        "engaged_sessions": np.fromiter((int(mv[3].value or 0) for mv, _ in cells), dtype=np.int64, count=count),
+        "page_url": [dv[0].value or "(not set)" for _, dv in cells],
+    }
+
+    minutes, seconds = np.divmod(np.rint(flagged["avg_session_duration_seconds"]).astype(np.int64), 60)
+    lines = [
+        ROW_FMT(views, engagement_rate, mins, secs, engaged_sessions, page_url)
+        for views, engagement_rate, mins, secs, engaged_sessions, page_url in zip(
+            flagged["page_views"].tolist(),
+            flagged["engagement_rate"].tolist(),
+            minutes.tolist(),
+            seconds.tolist(),
+            flagged["engaged_sessions"].tolist(),
+            flagged["page_url"],
         )
+    ]
+    sys.stdout.write("\n".join(lines))
+    sys.stdout.write("\n")
 
-    try:
-        import pandas as pd  # type: ignore
-
-        df = pd.DataFrame(flagged)
-        df.sort_values("page_views", ascending=False, inplace=True)
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        prefix = "high_traffic_low_engagement"
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if not args.no_csv:
+        # GA4 already returns pages ordered by views, so the CSV keeps that order.
         csv_path = Path(f"{prefix}_{ts}.csv")
-        df.to_csv(csv_path, index=False)
+        with csv_path.open("w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(flagged.keys())
+            writer.writerows(zip(*(column.tolist() if isinstance(column, np.ndarray) else column for column in flagged.values())))
         print(f"Saved CSV to {csv_path}")
 
-        try:
-            import matplotlib.pyplot as plt  # type: ignore
-
-            top = df.head(20)
-            if not top.empty:
-                plt.figure(figsize=(14, 7))
-                plt.bar(top["page_url"], top["page_views"], color="#5B4B8A")
-                plt.xticks(rotation=45, ha="right")
-                plt.ylabel("Page Views")
-                plt.title("High Traffic, Low Engagement Pages")
-                plt.tight_layout()
-                chart_path = Path(f"{prefix}_{ts}.png")
-                plt.savefig(chart_path)
-                plt.close()
-                print(f"Saved chart to {chart_path}")
-            else:
-                print("Insufficient data to render chart.")
-        except ImportError:
-            print("matplotlib not installed; skipping chart generation.")
-        except Exception as exc:
-            print(f"Failed to build chart: {exc}")
+    if args.no_chart:
+        return
+
+    try:
+        top_urls = flagged["page_url"][:20]
+        top_views = flagged["page_views"][:20]
+        fig = chart_figure((14, 7))
+        ax = fig.add_subplot(111)
+        y = np.arange(len(top_urls))
+        bars = ax.barh(y, top_views, color="#5B4B8A")
+        for bar in bars:
+            bar.set_rasterized(True)
+        ax.set_yticks(y)
+        ax.set_yticklabels([url[:60] for url in top_urls], fontsize=8)
+        ax.invert_yaxis()
+        ax.set_xlabel("Page Views")
+        ax.set_title("High Traffic, Low Engagement Pages")
+        fig.tight_layout()
+        chart_path = Path(f"{prefix}_{ts}.png")
+        fig.savefig(chart_path, dpi=100)
+        print(f"Saved chart to {chart_path}")
     except ImportError:
-        print("pandas not installed; skipping CSV/chart generation.")
+        print("matplotlib not installed; skipping chart generation.")
+    except Exception as exc:
+        print(f"Failed to build chart: {exc}")
+
+
+def main():
+    run(build_parser().parse_args())
 
 
 if __name__ == "__main__":
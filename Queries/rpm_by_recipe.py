@@ -12,30 +12,39 @@ Example:
 """
 
 import argparse
-import math
+import csv
+import operator
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
 
+import numpy as np
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, OrderBy, RunReportRequest
+from google.analytics.data_v1beta.types import (
+    DateRange,
+    Dimension,
+    Filter,
+    FilterExpression,
+    Metric,
+    NumericValue,
+    OrderBy,
+    RunReportRequest,
+)
+
+from _ga4_reports import MAX_CONCURRENT_REPORTS, create_client, property_id_list
 
 QUERY_NAME = "Recipe RPM Leaderboard"
 RECOMMENDED_CHART = "Horizontal bar chart of RPM by recipe"
+_row_values = operator.attrgetter("metric_values", "dimension_values")
+RPM_FMT = "{:<5} {:<60.60} {:>10} ${:>10,.2f} {:>10.2f} {:>18}".format
 
-def create_client(service_account_key: Optional[str]) -> BetaAnalyticsDataClient:
-    if service_account_key:
-        from google.oauth2 import service_account
 
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_key,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-        )
-        return BetaAnalyticsDataClient(credentials=credentials)
-    return BetaAnalyticsDataClient()
-
-
-def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date: str, end_date: str, limit: int):
+def fetch_report(
+    client: BetaAnalyticsDataClient, property_id: str, start_date: str, end_date: str, limit: int, min_views: int
+):
+    # RPM is a derived metric so GA4 computes it and orders by it; together
+    # with the view threshold the response is already the final leaderboard.
     request = RunReportRequest(
         property=f"properties/{property_id}",
         date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
@@ -44,105 +53,160 @@ def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date:
             Metric(name="totalAdRevenue"),
             Metric(name="screenPageViews"),
             Metric(name="engagedSessions"),
+            Metric(name="rpm", expression="totalAdRevenue/screenPageViews*1000"),
+        ],
+        metric_filter=FilterExpression(
+            filter=Filter(
+                field_name="screenPageViews",
+                numeric_filter=Filter.NumericFilter(
+                    operation=Filter.NumericFilter.Operation.GREATER_THAN_OR_EQUAL,
+                    value=NumericValue(int64_value=min_views),
+                ),
+            )
+        ),
+        order_bys=[
+            OrderBy(metric=OrderBy.MetricOrderBy(metric_name="rpm"), desc=True),
+            OrderBy(metric=OrderBy.MetricOrderBy(metric_name="totalAdRevenue"), desc=True),
         ],
-        order_bys=[OrderBy(metric=OrderBy.MetricOrderBy(metric_name="totalAdRevenue"), desc=True)],
         limit=limit,
     )
     return client.run_report(request)
 
 
-def main():
+def fetch_reports_batch(
+    client: BetaAnalyticsDataClient,
+    property_ids: list[str],
+    start_date: str,
+    end_date: str,
+    limit: int,
+    min_views: int,
+):
+    # One run_report per property, overlapped on the shared client; gRPC
+    # releases the GIL while waiting so threads scale with the property count.
+    with ThreadPoolExecutor(max_workers=min(len(property_ids), MAX_CONCURRENT_REPORTS)) as executor:
+        return list(
+            executor.map(
+                lambda property_id: fetch_report(client, property_id, start_date, end_date, limit, min_views),
+                property_ids,
+            )
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Calculate RPM per recipe page from GA4")
-    parser.add_argument("--property-id", required=True, help="GA4 property ID")
+    property_group = parser.add_mutually_exclusive_group(required=True)
+    property_group.add_argument("--property-id", help="GA4 property ID")
+    property_group.add_argument(
+        "--property-ids", type=property_id_list, help="Comma-separated GA4 property IDs to report on together"
+    )
     parser.add_argument("--service-account-key", help="Path to service account JSON key")
     parser.add_argument("--start-date", default="30daysAgo", help="Start date (YYYY-MM-DD or relative)")
     parser.add_argument("--end-date", default="yesterday", help="End date (YYYY-MM-DD or relative)")
-    parser.add_argument("--limit", type=int, default=50, help="Number of rows to fetch (default 50)")
+    parser.add_argument("--limit", type=int, default=50, help="Number of top-RPM pages to fetch (default 50)")
     parser.add_argument("--min-views", type=int, default=100, help="Minimum page views required to be included")
+    return parser
 
-    args = parser.parse_args()
+
+def run(args: argparse.Namespace) -> None:
+    property_ids = args.property_ids or [args.property_id]
 
     client = create_client(args.service_account_key)
-    response = fetch_report(client, args.property_id, args.start_date, args.end_date, args.limit)
+    if len(property_ids) == 1:
+        responses = [
+            fetch_report(client, property_ids[0], args.start_date, args.end_date, args.limit, args.min_views)
+        ]
+    else:
+        responses = fetch_reports_batch(
+            client, property_ids, args.start_date, args.end_date, args.limit, args.min_views
+        )
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
     print(f"Date range: {args.start_date} -> {args.end_date}")
+
+    for property_id, response in zip(property_ids, responses):
+        prefix = "rpm_by_recipe"
+        if len(property_ids) > 1:
+            print(f"\nProperty: {property_id}")
+            prefix = f"{prefix}_{property_id}"
+        report_property(args, response, prefix)
+
+
+def report_property(args: argparse.Namespace, response, prefix: str) -> None:
     print(f"RPM (Revenue per 1000 Views) by Recipe Page ({args.start_date} to {args.end_date})")
     print("=" * 110)
     print(f"{'Rank':<5} {'Page URL':<60} {'Views':>10} {'Revenue':>12} {'RPM':>10} {'Engaged Sessions':>18}")
     print("-" * 110)
 
-    rows = []
-    for row in response.rows:
-        page_url = row.dimension_values[0].value or "(not set)"
-        revenue = float(row.metric_values[0].value or 0)
-        views = int(row.metric_values[1].value or 0)
-        engaged_sessions = int(row.metric_values[2].value or 0)
-        if views < args.min_views:
-            continue
-        rpm = revenue / views * 1000 if views else math.nan
-        rows.append(
-            {
-                "page_url": page_url,
-                "page_views": views,
-                "total_ad_revenue": revenue,
-                "rpm": rpm,
-                "engaged_sessions": engaged_sessions,
-            }
-        )
-
-    if not rows:
+    report_rows = response.rows
+    count = len(report_rows)
+    if not count:
         print("No pages met the minimum view threshold.")
         return
 
-    rows.sort(key=lambda x: x["rpm"], reverse=True)
-
-    for idx, row in enumerate(rows, start=1):
-        page_url = row["page_url"]
-        views = row["page_views"]
-        revenue = row["total_ad_revenue"]
-        rpm = row["rpm"]
-        engaged_sessions = row["engaged_sessions"]
-        print(
-            f"{idx:<5} {page_url[:60]:<60} {views:>10} "
-            f"${revenue:>10,.2f} {rpm:>10.2f} {engaged_sessions:>18}"
+    # Fetch both repeated fields per row in one C-level call.
+    cells = [_row_values(r) for r in report_rows]
+    rows = {
+        "page_url": [dv[0].value or "(not set)" for _, dv in cells],
+        "page_views": np.fromiter((int(mv[1].value or 0) for mv, _ in cells), dtype=np.int64, count=count),
+        "total_ad_revenue": np.fromiter(
+            (float(mv[0].value or 0) for mv, _ in cells), dtype=np.float64, count=count
+        ),
+        "rpm": np.fromiter((float(mv[3].value or 0) for mv, _ in cells), dtype=np.float64, count=count),
+        "engaged_sessions": np.fromiter(
+            (int(mv[2].value or 0) for mv, _ in cells), dtype=np.int64, count=count
+        ),
+    }
+
+    lines = [
+        RPM_FMT(idx, page_url, views, revenue, rpm, engaged_sessions)
+        for idx, (page_url, views, revenue, rpm, engaged_sessions) in enumerate(
+            zip(
+                rows["page_url"],
+                rows["page_views"].tolist(),
+                rows["total_ad_revenue"].tolist(),
+                rows["rpm"].tolist(),
+                rows["engaged_sessions"].tolist(),
+            ),
+            start=1,
         )
+    ]
+    sys.stdout.write("\n".join(lines))
+    sys.stdout.write("\n")
+
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_path = Path(f"{prefix}_{ts}.csv")
+    with csv_path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(rows.keys())
+        writer.writerows(zip(*(column.tolist() if isinstance(column, np.ndarray) else column for column in rows.values())))
+    print(f"Saved CSV to {csv_path}")
 
     try:
-        import pandas as pd  # type: ignore
-
-        df = pd.DataFrame(rows)
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        prefix = "rpm_by_recipe"
-        csv_path = Path(f"{prefix}_{ts}.csv")
-        df.to_csv(csv_path, index=False)
-        print(f"Saved CSV to {csv_path}")
-
-        try:
-            import matplotlib.pyplot as plt  # type: ignore
-
-            top = df.head(20)
-            if not top.empty:
-                plt.figure(figsize=(14, 7))
-                plt.barh(top["page_url"], top["rpm"], color="#5B4B8A")
-                plt.xlabel("RPM")
-                plt.ylabel("Page URL")
-                plt.title("Recipe RPM Leaderboard")
-                plt.gca().invert_yaxis()
-                plt.tight_layout()
-                chart_path = Path(f"{prefix}_{ts}.png")
-                plt.savefig(chart_path)
-                plt.close()
-                print(f"Saved chart to {chart_path}")
-            else:
-                print("Insufficient data to render chart.")
-        except ImportError:
-            print("matplotlib not installed; skipping chart generation.")
-        except Exception as exc:
-            print(f"Failed to build chart: {exc}")
+        import matplotlib.pyplot as plt  # type: ignore
+
+        # Rows arrive ordered by RPM, so the top 20 is a slice.
+        top_urls = rows["page_url"][:20]
+        top_rpm = rows["rpm"][:20]
+        plt.figure(figsize=(14, 7))
+        plt.barh(top_urls, top_rpm, color="#5B4B8A")
+        plt.xlabel("RPM")
+        plt.ylabel("Page URL")
+        plt.title("Recipe RPM Leaderboard")
+        plt.gca().invert_yaxis()
+        plt.tight_layout()
+        chart_path = Path(f"{prefix}_{ts}.png")
+        plt.savefig(chart_path)
+        plt.close()
+        print(f"Saved chart to {chart_path}")
     except ImportError:
-        print("pandas not installed; skipping CSV/chart generation.")
+        print("matplotlib not installed; skipping chart generation.")
+    except Exception as exc:
+        print(f"Failed to build chart: {exc}")
+
+
+def main():
+    run(build_parser().parse_args())
 
 
 if __name__ == "__main__":
@@ -7,44 +7,50 @@ Generated on 2025-11-08 15:20:53 by generate_query_module.py.
 Query Name: Time distribution of sessions by source and medium
 Recommended Visualization: Line chart over time
 
-Original SQL:
+ROLLUP_SQL, the query grouped additionally by session date, fills a
+date-partitioned rollup table named after a hash of its text
+(session_hour_dist_<sha1>) in a separate dataset (--rollup-dataset), never the
+GA4 export itself. The days each run scanned are recorded next to it
+(session_hour_dist_<sha1>_days), so later runs scan only the events_* shards
+for days not processed yet; SQL then aggregates the whole range from the rollup.
+
+Rollup SQL (ROLLUP_SQL):
     -- Time distribution of sessions by source and medium
 
     -- Replace:
     --   YOUR_PROJECT.YOUR_DATASET.events_*   with your actual table
-    --   date range filter in _TABLE_SUFFIX   with your preferred time window
+    -- @scan_start/@scan_end are shard suffixes one day either side of @start/@end,
+    -- so sessions that cross a shard boundary are still counted on their UTC date.
 
     WITH session_info AS (
       SELECT
         user_pseudo_id,
-        (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS ga_session_id,
+        TIMESTAMP_MICROS(event_timestamp) AS event_ts,
+        event_name,
 
-        -- Make a unique session key
-        CONCAT(
-          user_pseudo_id, '.',
-          CAST((SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS STRING)
-        ) AS full_session_id,
+        -- One pass over event_params per event instead of a correlated UNNEST per key
+        MAX(IF(ep.key = 'ga_session_id', ep.value.int_value, NULL)) AS ga_session_id,
 
         -- Get traffic source info
-        (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'source') AS source,
-        (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'medium') AS medium,
-        (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'campaign') AS campaign,
-
-        TIMESTAMP_MICROS(event_timestamp) AS event_ts,
-        event_name
+        MAX(IF(ep.key = 'source', ep.value.string_value, NULL)) AS source,
+        MAX(IF(ep.key = 'medium', ep.value.string_value, NULL)) AS medium,
+        MAX(IF(ep.key = 'campaign', ep.value.string_value, NULL)) AS campaign
       FROM `YOUR_PROJECT.YOUR_DATASET.events_*`
+      LEFT JOIN UNNEST(event_params) AS ep
       WHERE
-        _TABLE_SUFFIX BETWEEN '20251001' AND '20251031'
-        AND event_name IN ('session_start', 'page_view')
+        _TABLE_SUFFIX BETWEEN @scan_start AND @scan_end
+        -- session_start carries the session's start time and traffic source, so
+        -- page_view rows (the bulk of the export) are never read
+        AND event_name = 'session_start'
+      GROUP BY user_pseudo_id, event_timestamp, event_name
     ),
 
     sessions AS (
       SELECT
-        full_session_id,
+        -- Make a unique session key
+        CONCAT(user_pseudo_id, '.', CAST(ga_session_id AS STRING)) AS full_session_id,
         user_pseudo_id,
         MIN(event_ts) AS session_start_ts,
-        MAX(event_ts) AS session_end_ts,
-        TIMESTAMP_DIFF(MAX(event_ts), MIN(event_ts), SECOND) AS session_duration_seconds,
         ANY_VALUE(source) AS source,
         ANY_VALUE(medium) AS medium,
         ANY_VALUE(campaign) AS campaign
@@ -56,37 +62,86 @@ Original SQL:
       SELECT
         source,
         medium,
+        DATE(session_start_ts) AS session_date,
         EXTRACT(HOUR FROM session_start_ts) AS session_hour,
-        COUNT(DISTINCT full_session_id) AS sessions
+        -- full_session_id is the grouping key of `sessions`, so rows are already unique
+        COUNT(full_session_id) AS sessions
       FROM sessions
+      GROUP BY source, medium, session_date, session_hour
+    )
+
+    SELECT source, medium, session_date, session_hour, sessions
+    FROM hour_distribution
+    WHERE session_date BETWEEN @start AND @end
+
+Report SQL (SQL):
+    -- Time distribution of sessions by source and medium (served from the rollup table)
+
+    WITH hour_distribution AS (
+      SELECT
+        source,
+        medium,
+        session_hour,
+        SUM(sessions) AS sessions
+      FROM `ROLLUP_TABLE`
+      WHERE session_date BETWEEN @start AND @end
       GROUP BY source, medium, session_hour
+    ),
+
+    totals AS (
+      SELECT
+        source,
+        medium,
+        SUM(sessions) AS total_sessions
+      FROM hour_distribution
+      GROUP BY source, medium
+      -- Long-tail source/medium pairs are dropped here; the join below removes
+      -- their hour rows too
+      HAVING SUM(sessions) >= @min_sessions
     )
 
     SELECT
-      source,
-      medium,
-      session_hour,
-      sessions,
-      ROUND(100 * sessions / SUM(sessions) OVER (PARTITION BY source, medium), 2) AS percent_within_source
-    FROM hour_distribution
+      hd.source,
+      hd.medium,
+      hd.session_hour,
+      hd.sessions,
+      ROUND(100 * hd.sessions / t.total_sessions, 2) AS percent_within_source
+    FROM hour_distribution hd
+    JOIN totals t
+      ON hd.source IS NOT DISTINCT FROM t.source
+      AND hd.medium IS NOT DISTINCT FROM t.medium
     ORDER BY source, medium, session_hour;
 """
 
 from __future__ import annotations
 
 import argparse
+import functools
+import hashlib
+import itertools
 import os
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
 
-import pandas as pd
-from google.cloud import bigquery
+# The BigQuery and Arrow packages are imported where they are used, so --help
+# and argument errors return without loading them.
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from google.cloud import bigquery, bigquery_storage
 
 QUERY_NAME = 'Time distribution of sessions by source and medium'
 RECOMMENDED_CHART = 'Line chart over time'
-SQL = "-- Time distribution of sessions by source and medium\n\n-- Replace:\n--   YOUR_PROJECT.YOUR_DATASET.events_*   with your actual table\n--   date range filter in _TABLE_SUFFIX   with your preferred time window\n\nWITH session_info AS (\n  SELECT\n    user_pseudo_id,\n    (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS ga_session_id,\n\n    -- Make a unique session key\n    CONCAT(\n      user_pseudo_id, '.',\n      CAST((SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS STRING)\n    ) AS full_session_id,\n\n    -- Get traffic source info\n    (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'source') AS source,\n    (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'medium') AS medium,\n    (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'campaign') AS campaign,\n\n    TIMESTAMP_MICROS(event_timestamp) AS event_ts,\n    event_name\n  FROM `YOUR_PROJECT.YOUR_DATASET.events_*`\n  WHERE\n    _TABLE_SUFFIX BETWEEN '20251001' AND '20251031'\n    AND event_name IN ('session_start', 'page_view')\n),\n\nsessions AS (\n  SELECT\n    full_session_id,\n    user_pseudo_id,\n    MIN(event_ts) AS session_start_ts,\n    MAX(event_ts) AS session_end_ts,\n    TIMESTAMP_DIFF(MAX(event_ts), MIN(event_ts), SECOND) AS session_duration_seconds,\n    ANY_VALUE(source) AS source,\n    ANY_VALUE(medium) AS medium,\n    ANY_VALUE(campaign) AS campaign\n  FROM session_info\n  GROUP BY full_session_id, user_pseudo_id\n),\n\nhour_distribution AS (\n  SELECT\n    source,\n    medium,\n    EXTRACT(HOUR FROM session_start_ts) AS session_hour,\n    COUNT(DISTINCT full_session_id) AS sessions\n  FROM sessions\n  GROUP BY source, medium, session_hour\n)\n\nSELECT\n  source,\n  medium,\n  session_hour,\n  sessions,\n  ROUND(100 * sessions / SUM(sessions) OVER (PARTITION BY source, medium), 2) AS percent_within_source\nFROM hour_distribution\nORDER BY source, medium, session_hour;"
+ROLLUP_SQL = "-- Time distribution of sessions by source and medium\n\n-- Replace:\n--   YOUR_PROJECT.YOUR_DATASET.events_*   with your actual table\n-- @scan_start/@scan_end are shard suffixes one day either side of @start/@end,\n-- so sessions that cross a shard boundary are still counted on their UTC date.\n\nWITH session_info AS (\n  SELECT\n    user_pseudo_id,\n    TIMESTAMP_MICROS(event_timestamp) AS event_ts,\n    event_name,\n\n    -- One pass over event_params per event instead of a correlated UNNEST per key\n    MAX(IF(ep.key = 'ga_session_id', ep.value.int_value, NULL)) AS ga_session_id,\n\n    -- Get traffic source info\n    MAX(IF(ep.key = 'source', ep.value.string_value, NULL)) AS source,\n    MAX(IF(ep.key = 'medium', ep.value.string_value, NULL)) AS medium,\n    MAX(IF(ep.key = 'campaign', ep.value.string_value, NULL)) AS campaign\n  FROM `YOUR_PROJECT.YOUR_DATASET.events_*`\n  LEFT JOIN UNNEST(event_params) AS ep\n  WHERE\n    _TABLE_SUFFIX BETWEEN @scan_start AND @scan_end\n    -- session_start carries the session's start time and traffic source, so\n    -- page_view rows (the bulk of the export) are never read\n    AND event_name = 'session_start'\n  GROUP BY user_pseudo_id, event_timestamp, event_name\n),\n\nsessions AS (\n  SELECT\n    -- Make a unique session key\n    CONCAT(user_pseudo_id, '.', CAST(ga_session_id AS STRING)) AS full_session_id,\n    user_pseudo_id,\n    MIN(event_ts) AS session_start_ts,\n    ANY_VALUE(source) AS source,\n    ANY_VALUE(medium) AS medium,\n    ANY_VALUE(campaign) AS campaign\n  FROM session_info\n  GROUP BY full_session_id, user_pseudo_id\n),\n\nhour_distribution AS (\n  SELECT\n    source,\n    medium,\n    DATE(session_start_ts) AS session_date,\n    EXTRACT(HOUR FROM session_start_ts) AS session_hour,\n    -- full_session_id is the grouping key of `sessions`, so rows are already unique\n    COUNT(full_session_id) AS sessions\n  FROM sessions\n  GROUP BY source, medium, session_date, session_hour\n)\n\nSELECT source, medium, session_date, session_hour, sessions\nFROM hour_distribution\nWHERE session_date BETWEEN @start AND @end"
+SQL = "-- Time distribution of sessions by source and medium (served from the rollup table)\n\nWITH hour_distribution AS (\n  SELECT\n    source,\n    medium,\n    session_hour,\n    SUM(sessions) AS sessions\n  FROM `ROLLUP_TABLE`\n  WHERE session_date BETWEEN @start AND @end\n  GROUP BY source, medium, session_hour\n),\n\ntotals AS (\n  SELECT\n    source,\n    medium,\n    SUM(sessions) AS total_sessions\n  FROM hour_distribution\n  GROUP BY source, medium\n  -- Long-tail source/medium pairs are dropped here; the join below removes\n  -- their hour rows too\n  HAVING SUM(sessions) >= @min_sessions\n)\n\nSELECT\n  hd.source,\n  hd.medium,\n  hd.session_hour,\n  hd.sessions,\n  ROUND(100 * hd.sessions / t.total_sessions, 2) AS percent_within_source\nFROM hour_distribution hd\nJOIN totals t\n  ON hd.source IS NOT DISTINCT FROM t.source\n  AND hd.medium IS NOT DISTINCT FROM t.medium\nORDER BY source, medium, session_hour;"
 DEFAULT_PROJECT = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET = os.getenv("GA_DATASET_ID", "analytics_427048881")
+# Columns of SQL's result, for the header of an empty CSV.
+RESULT_COLUMNS = ("source", "medium", "session_hour", "sessions", "percent_within_source")
+# 0 keeps every source/medium pair, as the unfiltered query did; the filter is opt-in.
+DEFAULT_MIN_SESSIONS = 0
+# The rollup is written here, not into the read-only GA4 export dataset.
+DEFAULT_ROLLUP_DATASET = os.getenv("GA_ROLLUP_DATASET", "ga4_rollups")
 
 
 def resolve_sql(project: str, dataset: str) -> str:
@@ -95,42 +150,206 @@ def resolve_sql(project: str, dataset: str) -> str:
     return text
 
 
-def run_query(project: str, dataset: str) -> pd.DataFrame:
+# One storage read client per process, built on first use so importing the
+# module (e.g. from the web app) does not need credentials.
+@functools.lru_cache(maxsize=1)
+def _storage_client() -> bigquery_storage.BigQueryReadClient:
+    from google.cloud import bigquery_storage
+
+    return bigquery_storage.BigQueryReadClient()
+
+
+def _date_params(start: date, end: date) -> list[bigquery.ScalarQueryParameter]:
+    from google.cloud import bigquery
+
+    return [
+        bigquery.ScalarQueryParameter("start", "DATE", start),
+        bigquery.ScalarQueryParameter("end", "DATE", end),
+    ]
+
+
+def ensure_rollup(
+    client: bigquery.Client, project: str, dataset: str, rollup_dataset: str, start: date, end: date
+) -> str:
+    # BigQuery materialized views cannot read wildcard tables, so the rollup is
+    # a plain table. It lives in its own dataset, never the GA4 export, and its
+    # name hashes the SQL, so editing the query builds a new one instead of
+    # silently serving the old aggregate.
+    from google.cloud import bigquery
+
+    source = client.get_dataset(f"{project}.{dataset}")
+    target = bigquery.Dataset(f"{project}.{rollup_dataset}")
+    # Cross-dataset queries need both datasets in one location.
+    target.location = source.location
+    client.create_dataset(target, exists_ok=True)
+
+    rollup_sql = ROLLUP_SQL.replace("YOUR_PROJECT", project).replace("YOUR_DATASET", dataset)
+    digest = hashlib.sha1(rollup_sql.encode("utf-8")).hexdigest()[:12]
+    table_id = f"{project}.{rollup_dataset}.session_hour_dist_{digest}"
+    # Days already scanned are recorded on their own, so a day with no
+    # sessions is not rescanned on every run.
+    days_id = f"{table_id}_days"
+    client.query(
+        f"CREATE TABLE IF NOT EXISTS `{table_id}` (\n"
+        "  source STRING, medium STRING, session_date DATE, session_hour INT64, sessions INT64\n"
+        ")\n"
+        "PARTITION BY session_date\n"
+        "CLUSTER BY source, medium;\n"
+        f"CREATE TABLE IF NOT EXISTS `{days_id}` (session_date DATE);"
+    ).result()
+
+    covered = {
+        row.session_date
+        for row in client.query(
+            f"SELECT session_date FROM `{days_id}` WHERE session_date BETWEEN @start AND @end",
+            job_config=bigquery.QueryJobConfig(query_parameters=_date_params(start, end)),
+        ).result()
+    }
+    # The export keeps landing events for the last couple of days, so those are
+    # always rebuilt rather than trusted from an earlier run.
+    settled = date.today() - timedelta(days=2)
+    missing = [
+        day
+        for day in (start + timedelta(days=offset) for offset in range((end - start).days + 1))
+        if day not in covered or day > settled
+    ]
+    if not missing:
+        return table_id
+
+    low, high = missing[0], missing[-1]
+    script = (
+        "BEGIN TRANSACTION;\n"
+        f"DELETE FROM `{table_id}` WHERE session_date BETWEEN @start AND @end;\n"
+        f"INSERT INTO `{table_id}` (source, medium, session_date, session_hour, sessions)\n"
+        f"{rollup_sql};\n"
+        f"DELETE FROM `{days_id}` WHERE session_date BETWEEN @start AND @end;\n"
+        f"INSERT INTO `{days_id}` (session_date)\n"
+        "SELECT day FROM UNNEST(GENERATE_DATE_ARRAY(@start, @end)) AS day;\n"
+        "COMMIT TRANSACTION;"
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=_date_params(low, high)
+        + [
+            bigquery.ScalarQueryParameter("scan_start", "STRING", (low - timedelta(days=1)).strftime("%Y%m%d")),
+            bigquery.ScalarQueryParameter("scan_end", "STRING", (high + timedelta(days=1)).strftime("%Y%m%d")),
+        ]
+    )
+    client.query(script, job_config=job_config).result()
+    return table_id
+
+
+def _query_result(
+    project: str, dataset: str, start_date: str, end_date: str, min_sessions: int, rollup_dataset: str
+) -> bigquery.table.RowIterator:
+    from google.cloud import bigquery
+
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
     client = bigquery.Client(project=project)
-    rendered_sql = resolve_sql(project, dataset)
-    job = client.query(rendered_sql)
-    return job.result().to_dataframe(create_bqstorage_client=True)
+    table_id = ensure_rollup(client, project, dataset, rollup_dataset, start, end)
+    rendered_sql = resolve_sql(project, dataset).replace("ROLLUP_TABLE", table_id)
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=_date_params(start, end)
+        + [bigquery.ScalarQueryParameter("min_sessions", "INT64", min_sessions)]
+    )
+    job = client.query(rendered_sql, job_config=job_config)
+    return job.result()
 
 
-def main() -> None:
+def run_query(
+    project: str,
+    dataset: str,
+    start_date: str,
+    end_date: str,
+    min_sessions: int = DEFAULT_MIN_SESSIONS,
+    rollup_dataset: str = DEFAULT_ROLLUP_DATASET,
+) -> pa.Table:
+    result = _query_result(project, dataset, start_date, end_date, min_sessions, rollup_dataset)
+    return result.to_arrow(bqstorage_client=_storage_client())
+
+
+def iter_query_batches(
+    project: str,
+    dataset: str,
+    start_date: str,
+    end_date: str,
+    min_sessions: int = DEFAULT_MIN_SESSIONS,
+    rollup_dataset: str = DEFAULT_ROLLUP_DATASET,
+) -> Iterator[pa.RecordBatch]:
+    # Record batches as the storage API delivers them, so callers can write the
+    # result out without holding all of it in memory.
+    result = _query_result(project, dataset, start_date, end_date, min_sessions, rollup_dataset)
+    return result.to_arrow_iterable(bqstorage_client=_storage_client())
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description=f"Run '{QUERY_NAME}' query")
     parser.add_argument("--project", default=DEFAULT_PROJECT, help="GCP project ID")
     parser.add_argument("--dataset", default=DEFAULT_DATASET, help="BigQuery dataset ID (used for placeholder replacement)")
+    parser.add_argument(
+        "--rollup-dataset",
+        default=DEFAULT_ROLLUP_DATASET,
+        help=f"Dataset for the hourly rollup tables, created if missing (default {DEFAULT_ROLLUP_DATASET})",
+    )
     parser.add_argument(
         "--output-prefix",
         default='time-distribution-of-sessions-by-source-and-medium',
         help="Prefix for CSV output",
     )
-    parser.add_argument("--start-date", help="Optional date range start label")
-    parser.add_argument("--end-date", help="Optional date range end label")
-    args = parser.parse_args()
+    parser.add_argument("--start-date", help="Start date (YYYY-MM-DD, default: 7 days ago)")
+    parser.add_argument("--end-date", help="End date (YYYY-MM-DD, default: yesterday)")
+    parser.add_argument(
+        "--min-sessions",
+        type=int,
+        default=DEFAULT_MIN_SESSIONS,
+        help=f"Skip source/medium pairs with fewer sessions in the range (default {DEFAULT_MIN_SESSIONS})",
+    )
+    return parser
 
-    df = run_query(args.project, args.dataset)
+
+def run(args: argparse.Namespace) -> None:
+    args.start_date = args.start_date or (date.today() - timedelta(days=7)).isoformat()
+    args.end_date = args.end_date or (date.today() - timedelta(days=1)).isoformat()
+    batches = iter_query_batches(
+        args.project, args.dataset, args.start_date, args.end_date, args.min_sessions, args.rollup_dataset
+    )
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
     print(f"Project: {args.project}")
     print(f"Dataset: {args.dataset}")
-    if args.start_date or args.end_date:
-        print(f"Date range: {args.start_date or 'N/A'} -> {args.end_date or 'N/A'}")
-    print(f"Returned {len(df)} rows")
-    print(df.head())
+    print(f"Rollup dataset: {args.rollup_dataset}")
+    print(f"Date range: {args.start_date} -> {args.end_date}")
+    print(f"Minimum sessions per source/medium: {args.min_sessions}")
+
+    import pyarrow.csv as pacsv
+
+    batches = iter(batches)
+    first_batch = next(batches, None)
+    if first_batch is not None:
+        print(first_batch.slice(0, 5).to_pandas())
 
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     csv_path = Path(f"{args.output_prefix}_{ts}.csv")
-    df.to_csv(csv_path, index=False)
+    columns = first_batch.schema.names if first_batch is not None else RESULT_COLUMNS
+    row_count = 0
+    with csv_path.open("wb") as handle:
+        # The header is written here (pyarrow would quote the column names), so
+        # an empty result still leaves a header-only CSV for run_all/the web app.
+        handle.write((",".join(columns) + "\n").encode("utf-8"))
+        if first_batch is not None:
+            # Each batch is written as it arrives; only one is held in memory at a time.
+            write_options = pacsv.WriteOptions(include_header=False)
+            with pacsv.CSVWriter(handle, first_batch.schema, write_options=write_options) as writer:
+                for batch in itertools.chain([first_batch], batches):
+                    writer.write_batch(batch)
+                    row_count += batch.num_rows
+    print(f"Returned {row_count} rows")
     print(f"Saved raw results to {csv_path}")
 
 
+def main() -> None:
+    run(build_parser().parse_args())
+
+
 if __name__ == "__main__":
     main()
@@ -13,62 +13,124 @@ Example:
       --start-date 2025-10-01 --end-date 2025-10-31 --limit 20
 """
 
+from __future__ import annotations
+
 import argparse
-import os
+import sys
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from _ga4_reports import DEFAULT_CACHE_TTL, create_client, run_report_cached, snap_to_day
 
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, OrderBy, RunReportRequest
+# The GA4 client pulls in grpc and hundreds of protobuf modules, so it is
+# imported where it is used and --help or a bad argument returns immediately.
+if TYPE_CHECKING:
+    from google.analytics.data_v1beta import BetaAnalyticsDataClient
+    from google.analytics.data_v1beta.types import RunReportRequest
 
 QUERY_NAME = "Top Revenue Recipe Pages"
 RECOMMENDED_CHART = "Horizontal bar chart showing revenue per page"
+DEFAULT_MIN_REVENUE = 0.01
+# mm:ss strings for the first hour, where nearly every average duration falls.
+_MMSS = tuple(f"{s // 60:02d}:{s % 60:02d}" for s in range(3600))
+
+
+def build_request(
+    property_id: str, start_date: str, end_date: str, limit: int, min_revenue: float = DEFAULT_MIN_REVENUE
+) -> RunReportRequest:
+    from google.analytics.data_v1beta.types import (
+        DateRange,
+        Dimension,
+        Filter,
+        FilterExpression,
+        Metric,
+        NumericValue,
+        OrderBy,
+        RunReportRequest,
+    )
 
-def create_client(service_account_key: str | None) -> BetaAnalyticsDataClient:
-    if service_account_key:
-        from google.oauth2 import service_account
-
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_key,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"],
-        )
-        return BetaAnalyticsDataClient(credentials=credentials)
-    return BetaAnalyticsDataClient()
-
-
-def fetch_report(client: BetaAnalyticsDataClient, property_id: str, start_date: str, end_date: str, limit: int):
-    request = RunReportRequest(
+    return RunReportRequest(
         property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+        date_ranges=[DateRange(start_date=snap_to_day(start_date), end_date=snap_to_day(end_date))],
         dimensions=[Dimension(name="pagePathPlusQueryString")],
         metrics=[
             Metric(name="totalAdRevenue"),
             Metric(name="engagedSessions"),
             Metric(name="averageSessionDuration"),
         ],
+        # Zero-revenue rows are dropped by GA4 instead of being shipped back.
+        metric_filter=FilterExpression(
+            filter=Filter(
+                field_name="totalAdRevenue",
+                numeric_filter=Filter.NumericFilter(
+                    operation=Filter.NumericFilter.Operation.GREATER_THAN_OR_EQUAL,
+                    value=NumericValue(double_value=min_revenue),
+                ),
+            )
+        ),
         order_bys=[OrderBy(metric=OrderBy.MetricOrderBy(metric_name="totalAdRevenue"), desc=True)],
         limit=limit,
+        return_property_quota=True,
     )
-    return client.run_report(request)
+
+
+def fetch_report(
+    client: BetaAnalyticsDataClient,
+    property_id: str,
+    start_date: str,
+    end_date: str,
+    limit: int,
+    cache_ttl: float = DEFAULT_CACHE_TTL,
+    refresh: bool = False,
+    min_revenue: float = DEFAULT_MIN_REVENUE,
+):
+    request = build_request(property_id, start_date, end_date, limit, min_revenue)
+    return run_report_cached(client, request, cache_ttl=cache_ttl, refresh=refresh)
 
 
 def format_seconds(value: float) -> str:
-    minutes, seconds = divmod(int(round(value)), 60)
-    return f"{minutes:02d}:{seconds:02d}"
+    seconds = int(round(value))
+    if 0 <= seconds < len(_MMSS):
+        return _MMSS[seconds]
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="List top revenue-driving recipe pages from GA4")
     parser.add_argument("--property-id", required=True, help="GA4 property ID (numbers only)")
     parser.add_argument("--service-account-key", help="Path to service account JSON key (optional)")
     parser.add_argument("--start-date", default="30daysAgo", help="Start date (YYYY-MM-DD or GA4 relative like 30daysAgo)")
     parser.add_argument("--end-date", default="yesterday", help="End date (YYYY-MM-DD or GA4 relative like yesterday)")
     parser.add_argument("--limit", type=int, default=20, help="Number of rows to return (default 20)")
+    parser.add_argument(
+        "--min-revenue",
+        type=float,
+        default=DEFAULT_MIN_REVENUE,
+        help=f"Minimum total ad revenue for a row to be returned (default {DEFAULT_MIN_REVENUE})",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help="Seconds to reuse a cached GA4 response (0 disables the cache)",
+    )
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached GA4 responses and re-fetch")
+    return parser
 
-    args = parser.parse_args()
 
+def run(args: argparse.Namespace) -> None:
     client = create_client(args.service_account_key)
-    response = fetch_report(client, args.property_id, args.start_date, args.end_date, args.limit)
+    response = fetch_report(
+        client,
+        args.property_id,
+        args.start_date,
+        args.end_date,
+        args.limit,
+        cache_ttl=args.cache_ttl,
+        refresh=args.refresh,
+        min_revenue=args.min_revenue,
+    )
 
     print(f"Query: {QUERY_NAME}")
     print(f"Recommended visualization: {RECOMMENDED_CHART}")
@@ -78,23 +140,27 @@ def main():
     print(f"{'Rank':<5} {'Page URL':<60} {'Revenue':>12} {'Engaged Sessions':>18} {'Avg Engagement':>16}")
     print("-" * 100)
 
+    quota = response.property_quota.tokens_per_day
+    if quota.consumed or quota.remaining:
+        print(f"GA4 tokens today: {quota.consumed} used, {quota.remaining} remaining")
+
     if not response.rows:
         print("No data returned.")
         return
 
     records = []
-
-    for idx, row in enumerate(response.rows, start=1):
+    lines = []
+    # Raw protobuf rows skip the proto-plus wrapper on every field access.
+    for idx, row in enumerate(response._pb.rows, start=1):
         page_url = row.dimension_values[0].value or "(not set)"
         revenue = float(row.metric_values[0].value or 0)
         engaged_sessions = int(row.metric_values[1].value or 0)
         avg_session_seconds = float(row.metric_values[2].value or 0)
 
-        print(
+        lines.append(
             f"{idx:<5} {page_url[:60]:<60} "
-            f"${revenue:>10,.2f} {engaged_sessions:>18} {format_seconds(avg_session_seconds):>16}"
+            f"${revenue:>10,.2f} {engaged_sessions:>18} {format_seconds(avg_session_seconds):>16}\n"
         )
-
         records.append(
             {
                 "rank": idx,
@@ -104,6 +170,7 @@ def main():
                 "avg_session_duration_seconds": avg_session_seconds,
             }
         )
+    sys.stdout.write("".join(lines))
 
     try:
         import pandas as pd  # type: ignore
@@ -141,5 +208,9 @@ def main():
         print("pandas not installed; skipping CSV/chart generation.")
 
 
+def main():
+    run(build_parser().parse_args())
+
+
 if __name__ == "__main__":
     main()
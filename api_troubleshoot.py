@@ -3,96 +3,110 @@
 
 import os
 import json
-import requests
-from google.auth import default
-from google.auth.transport.requests import Request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from auth_utils import RUN_REPORT_BODY, RUN_REPORT_URL, get_credentials, session
 
-print("="*70)
-print("GA4 API Authentication Troubleshooting")
-print("="*70)
 
 # Check 1: Credentials file
-print("\n1. Checking credentials file...")
-creds_path = os.path.join(os.getenv('APPDATA'), 'gcloud', 'application_default_credentials.json')
-if os.path.exists(creds_path):
-    print(f"   ✅ Credentials file exists: {creds_path}")
+def check_credentials_file():
+    lines = []
+    creds_path = os.path.join(os.getenv('APPDATA'), 'gcloud', 'application_default_credentials.json')
+    try:
+        raw = Path(creds_path).read_bytes()
+    except FileNotFoundError:
+        lines.append(f"   ❌ Credentials file not found: {creds_path}")
+        return "\n1. Checking credentials file...", lines
+    except OSError as e:
+        lines.append(f"   ⚠️  Could not read credentials: {e}")
+        return "\n1. Checking credentials file...", lines
+
+    lines.append(f"   ✅ Credentials file exists: {creds_path}")
     try:
-        with open(creds_path, 'r') as f:
-            creds_data = json.load(f)
-            print(f"   Type: {creds_data.get('type', 'unknown')}")
-            if 'quota_project_id' in creds_data:
-                print(f"   Quota project: {creds_data['quota_project_id']}")
+        # json.loads on bytes detects UTF-8/16/32 (and a UTF-8 BOM) itself, so
+        # the Windows locale codec never gets involved.
+        creds_data = json.loads(raw)
+        lines.append(f"   Type: {creds_data.get('type', 'unknown')}")
+        if 'quota_project_id' in creds_data:
+            lines.append(f"   Quota project: {creds_data['quota_project_id']}")
     except Exception as e:
-        print(f"   ⚠️  Could not read credentials: {e}")
-else:
-    print(f"   ❌ Credentials file not found: {creds_path}")
+        lines.append(f"   ⚠️  Could not read credentials: {e}")
+    return "\n1. Checking credentials file...", lines
+
 
 # Check 2: Token info
-print("\n2. Checking access token...")
-try:
-    credentials, project = default(scopes=['https://www.googleapis.com/auth/analytics.readonly'])
-    if not credentials.valid:
-        credentials.refresh(Request())
-    
-    token = credentials.token
-    print(f"   ✅ Token obtained")
-    print(f"   Token length: {len(token)} characters")
-    
-    # Get token info
-    r = requests.get(f'https://www.googleapis.com/oauth2/v1/tokeninfo?access_token={token}')
-    if r.status_code == 200:
-        info = r.json()
-        print(f"   ✅ Token is valid")
-        print(f"   Scope: {info.get('scope', 'N/A')}")
-        print(f"   Expires in: {info.get('expires_in', 'N/A')} seconds")
-        print(f"   Audience: {info.get('audience', 'N/A')}")
+def check_token_info():
+    lines = []
+    try:
+        credentials = get_credentials()
         
-        # Check if analytics scope is present
-        scope_str = info.get('scope', '')
-        if 'analytics' in scope_str.lower():
-            print(f"   ✅ Analytics scope found in token")
-        else:
-            print(f"   ⚠️  Analytics scope NOT found in token")
-            print(f"   This is likely the problem!")
-    else:
-        print(f"   ❌ Token invalid: {r.status_code}")
-        print(f"   Response: {r.text[:200]}")
+        token = credentials.token
+        lines.append(f"   ✅ Token obtained")
+        lines.append(f"   Token length: {len(token)} characters")
         
-except Exception as e:
-    print(f"   ❌ Error getting token: {e}")
+        # Get token info
+        r = session.get(f'https://www.googleapis.com/oauth2/v1/tokeninfo?access_token={token}')
+        if r.status_code == 200:
+            info = r.json()
+            lines.append(f"   ✅ Token is valid")
+            lines.append(f"   Scope: {info.get('scope', 'N/A')}")
+            lines.append(f"   Expires in: {info.get('expires_in', 'N/A')} seconds")
+            lines.append(f"   Audience: {info.get('audience', 'N/A')}")
+            
+            # Check if analytics scope is present
+            scope_str = info.get('scope', '')
+            if 'analytics' in scope_str.lower():
+                lines.append(f"   ✅ Analytics scope found in token")
+            else:
+                lines.append(f"   ⚠️  Analytics scope NOT found in token")
+                lines.append(f"   This is likely the problem!")
+        else:
+            lines.append(f"   ❌ Token invalid: {r.status_code}")
+            lines.append(f"   Response: {r.text[:200]}")
+            
+    except Exception as e:
+        lines.append(f"   ❌ Error getting token: {e}")
+    return "\n2. Checking access token...", lines
+
 
 # Check 3: Test API call with different scopes
-print("\n3. Testing API calls with different scope requests...")
-
-# Try with analytics.readonly explicitly
-try:
-    creds_analytics, _ = default(scopes=['https://www.googleapis.com/auth/analytics.readonly'])
-    if not creds_analytics.valid:
-        creds_analytics.refresh(Request())
-    
-    url = "https://analyticsdata.googleapis.com/v1beta/properties/427048881:runReport"
-    headers = {
-        'Authorization': f'Bearer {creds_analytics.token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "dateRanges": [{"startDate": "2025-11-01", "endDate": "2025-11-06"}],
-        "dimensions": [{"name": "country"}],
-        "metrics": [{"name": "activeUsers"}],
-        "limit": 1
-    }
-    
-    response = requests.post(url, json=payload, headers=headers, timeout=10)
-    print(f"   With analytics.readonly scope: Status {response.status_code}")
-    if response.status_code == 200:
-        print(f"   ✅ SUCCESS! API is working!")
-    elif response.status_code == 403:
-        error = response.json()
-        print(f"   ❌ Still getting 403: {error.get('error', {}).get('message', 'Unknown error')}")
-    else:
-        print(f"   Response: {response.text[:200]}")
-except Exception as e:
-    print(f"   Error: {e}")
+def check_run_report():
+    lines = []
+    # Try with analytics.readonly explicitly
+    try:
+        creds_analytics = get_credentials()
+        
+        response = session.post(
+            RUN_REPORT_URL,
+            data=RUN_REPORT_BODY,
+            headers={'Authorization': f'Bearer {creds_analytics.token}'},
+            timeout=10,
+        )
+        lines.append(f"   With analytics.readonly scope: Status {response.status_code}")
+        if response.status_code == 200:
+            lines.append(f"   ✅ SUCCESS! API is working!")
+        elif response.status_code == 403:
+            error = response.json()
+            lines.append(f"   ❌ Still getting 403: {error.get('error', {}).get('message', 'Unknown error')}")
+        else:
+            lines.append(f"   Response: {response.text[:200]}")
+    except Exception as e:
+        lines.append(f"   Error: {e}")
+    return "\n3. Testing API calls with different scope requests...", lines
+
+
+print("="*70)
+print("GA4 API Authentication Troubleshooting")
+print("="*70)
+
+# The checks only wait on disk and network, so they run concurrently on the
+# shared session; executor.map keeps the output in check order.
+with ThreadPoolExecutor(max_workers=3) as executor:
+    for title, lines in executor.map(lambda check: check(), [check_credentials_file, check_token_info, check_run_report]):
+        print(title)
+        for line in lines:
+            print(line)
 
 # Check 4: OAuth consent screen
 print("\n4. OAuth Consent Screen Configuration...")
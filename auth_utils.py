@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Shared HTTP session, GA4 credential cache and runReport probe for the API scripts."""
+
+import functools
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google.auth import default
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+ANALYTICS_READONLY = ('https://www.googleapis.com/auth/analytics.readonly',)
+
+
+def build_session(pool_connections=4, pool_maxsize=4, retries=2, backoff_factor=0.2):
+    """Return a pooled session that retries rate limits and transient 5xx."""
+    # Connections (and TLS handshakes) are reused per host. runReport is
+    # read-only, so POSTs are safe to retry; Retry-After is honoured.
+    http = requests.Session()
+    http.mount('https://', HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({'GET', 'POST'}),
+            # Hand the last response back so callers can still show its status and body
+            raise_on_status=False,
+        ),
+    ))
+    http.headers['Content-Type'] = 'application/json'
+    return http
+
+
+# One pooled session for every HTTP call, built at import so threads never
+# race to create it.
+session = build_session()
+
+# The runReport probe is fixed, so its body is encoded once and posted as bytes.
+RUN_REPORT_URL = "https://analyticsdata.googleapis.com/v1beta/properties/427048881:runReport"
+RUN_REPORT_BODY = json.dumps({
+    "dateRanges": [{"startDate": "2025-11-01", "endDate": "2025-11-06"}],
+    "dimensions": [{"name": "country"}],
+    "metrics": [{"name": "activeUsers"}],
+    "limit": 1
+}).encode('utf-8')
+
+# Token refreshes go through the same pooled session.
+auth_request = Request(session)
+_refresh_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_credentials(scopes, service_account_key):
+    # Loaded once per scope set and key path (or ADC) for the life of the
+    # process; default() walks the ADC search path (env vars, file stat, JSON
+    # parse), so it is worth skipping on repeat calls.
+    if service_account_key:
+        return service_account.Credentials.from_service_account_file(
+            service_account_key, scopes=list(scopes)
+        )
+    credentials, _ = default(scopes=list(scopes))
+    return credentials
+
+
+def get_credentials(scopes=ANALYTICS_READONLY, service_account_key=None):
+    """Return cached credentials for `scopes` (ADC, or the given key file), refreshed if stale."""
+    # The lookup happens under the lock too, so callers started together on a
+    # pool share one lookup and one refresh instead of racing the cache.
+    # `valid` is False shortly before expiry too, so a token about to lapse is
+    # refreshed here instead of failing mid-request.
+    with _refresh_lock:
+        credentials = _load_credentials(tuple(scopes), service_account_key)
+        if not credentials.valid:
+            credentials.refresh(auth_request)
+    return credentials
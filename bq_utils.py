@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Shared BigQuery clients, Arrow result reader and output timestamps for the export scripts."""
+
+import functools
+import os
+from datetime import datetime
+
+from google.cloud import bigquery
+
+# Parallel Storage API read streams for large results (--bq-streams).
+DEFAULT_BQ_STREAMS = min((os.cpu_count() or 1) * 2, 16)
+
+
+# BigQuery and storage read clients are built once per process (per project)
+# on first use, so repeated calls skip ADC discovery and client setup.
+@functools.lru_cache(maxsize=4)
+def bq_client(project: str) -> bigquery.Client:
+    return bigquery.Client(project=project)
+
+
+@functools.lru_cache(maxsize=1)
+def storage_client():
+    from google.cloud import bigquery_storage
+
+    return bigquery_storage.BigQueryReadClient()
+
+
+def read_arrow(rows, bq_streams: int = DEFAULT_BQ_STREAMS):
+    """Read a RowIterator into a pyarrow Table over at most `bq_streams` storage streams."""
+    # pyarrow is imported here so scripts that fall back to to_dataframe()
+    # can still use the clients without it.
+    import pyarrow as pa
+
+    # Small results arrive with the first page and skip the storage read
+    # session; larger ones fan out over streams. to_arrow() has no stream cap;
+    # the batch iterator does (google-cloud-bigquery>=3.29), so the table is
+    # assembled from its record batches.
+    batches = list(rows.to_arrow_iterable(bqstorage_client=storage_client(), max_stream_count=bq_streams))
+    if batches:
+        return pa.Table.from_batches(batches)
+    # No batches means no rows; keep the result's column names.
+    return pa.table({field.name: pa.array([], type=pa.null()) for field in rows.schema or ()})
+
+
+def output_timestamp() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
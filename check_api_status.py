@@ -1,29 +1,18 @@
 #!/usr/bin/env python3
 """Quick script to check if GA4 Data API is accessible."""
 
-import requests
-from google.auth import default
-from google.auth.transport.requests import Request
+from auth_utils import RUN_REPORT_BODY, RUN_REPORT_URL, get_credentials, session
 
 try:
-    credentials, project = default(scopes=['https://www.googleapis.com/auth/analytics.readonly'])
-    if not credentials.valid:
-        credentials.refresh(Request())
+    credentials = get_credentials()
     
     # Test API access
-    url = "https://analyticsdata.googleapis.com/v1beta/properties/427048881:runReport"
-    headers = {
-        'Authorization': f'Bearer {credentials.token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "dateRanges": [{"startDate": "2025-11-01", "endDate": "2025-11-06"}],
-        "dimensions": [{"name": "country"}],
-        "metrics": [{"name": "activeUsers"}],
-        "limit": 1
-    }
-    
-    response = requests.post(url, json=payload, headers=headers, timeout=10)
+    response = session.post(
+        RUN_REPORT_URL,
+        data=RUN_REPORT_BODY,
+        headers={'Authorization': f'Bearer {credentials.token}'},
+        timeout=10,
+    )
     
     print(f"Status Code: {response.status_code}")
     if response.status_code == 200:
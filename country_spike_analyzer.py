@@ -6,10 +6,22 @@ Country Spike Analyzer
 - Identifies country spikes that are >=25% above average AND >=50 views above average
 """
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import argparse
 import os
 
+def write_tsv(table: pa.Table, path: str):
+    """Write `table` as unquoted tab-separated text with a plain header line."""
+    # quoting_style='none' still quotes header names (quoting_header needs
+    # pyarrow 19+), so the header is written here and the rows by Arrow.
+    with open(path, 'wb') as f:
+        f.write(('\t'.join(table.column_names) + '\n').encode('utf-8'))
+        pacsv.write_csv(table, f, write_options=pacsv.WriteOptions(
+            include_header=False, delimiter='\t', quoting_style='none'
+        ))
+
 def analyze_spikes(input_file: str, min_pct_above_avg: float = 25.0, min_views_above_avg: int = 50):
     """
     Analyze country spikes vs weekly averages.
@@ -21,45 +33,65 @@ def analyze_spikes(input_file: str, min_pct_above_avg: float = 25.0, min_views_a
     """
     # Read the file (handle encoding issues with special characters)
     print(f"Reading {input_file}...")
+    parse_options = pacsv.ParseOptions(delimiter='\t')
+    # Keep week as text (as pandas did) rather than letting Arrow infer a date.
+    # Typing country as string makes invalid UTF-8 raise (and hit the latin-1
+    # retry) instead of being inferred as a binary column.
+    convert_options = pacsv.ConvertOptions(column_types={'week': pa.string(), 'country': pa.string()})
     try:
-        df = pd.read_csv(input_file, sep='\t', encoding='utf-8')
-    except UnicodeDecodeError:
+        table = pacsv.read_csv(input_file, parse_options=parse_options, convert_options=convert_options)
+    except pa.ArrowInvalid:
         # Try with different encoding if UTF-8 fails
-        df = pd.read_csv(input_file, sep='\t', encoding='latin-1')
-    
-    # Calculate weekly averages (average views across all countries for each week)
+        table = pacsv.read_csv(
+            input_file,
+            read_options=pacsv.ReadOptions(encoding='latin-1'),
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+    
+    # Weekly average and total views in one Arrow group_by pass
     print("Calculating weekly averages...")
-    weekly_avg = df.groupby('week')['total_views'].mean().reset_index()
-    weekly_avg.columns = ['week', 'avg_views']
+    weekly = table.group_by('week').aggregate([('total_views', 'mean'), ('total_views', 'sum')])
+    weekly = weekly.select(['week', 'total_views_mean', 'total_views_sum']).rename_columns(
+        ['week', 'avg_views', 'total_views']
+    )
     
     # Calculate overall average (average of all weekly averages)
-    overall_avg = weekly_avg['avg_views'].mean()
+    overall_avg = pc.mean(weekly['avg_views']).as_py() or 0.0
     print(f"Overall average views per country per week: {overall_avg:.1f}")
     
-    # Calculate weekly totals (sum of all views across all countries for each week)
-    weekly_totals = df.groupby('week')['total_views'].sum().reset_index()
-    weekly_totals.columns = ['week', 'total_views']
-    
     # Calculate ratio for each week (week's avg views / overall average)
     # Example: if overall avg is 100 and week avg is 150, ratio = 1.5
-    weekly_stats = pd.merge(weekly_avg, weekly_totals, on='week')
-    weekly_stats['week_ratio'] = weekly_stats['avg_views'] / overall_avg
+    weekly = weekly.append_column('week_ratio', pc.divide(weekly['avg_views'], overall_avg))
     
-    # Merge weekly averages back to main dataframe
-    df_with_avg = pd.merge(df, weekly_avg, on='week')
+    # Attach each week's average to its rows with a hash join inside Arrow
+    rows = table.join(weekly.select(['week', 'avg_views']), 'week')
     
     # Calculate spike metrics for each country-week
-    df_with_avg['views_above_avg'] = df_with_avg['total_views'] - df_with_avg['avg_views']
-    df_with_avg['pct_above_avg'] = ((df_with_avg['total_views'] - df_with_avg['avg_views']) / df_with_avg['avg_views']) * 100
+    avg_views = rows['avg_views']
+    views_above_avg = pc.subtract(pc.cast(rows['total_views'], pa.float64()), avg_views)
+    pct_above_avg = pc.if_else(
+        pc.greater(avg_views, 0), pc.multiply(pc.divide(views_above_avg, avg_views), 100.0), 0.0
+    )
+    rows = rows.append_column('views_above_avg', views_above_avg).append_column('pct_above_avg', pct_above_avg)
     
     # Identify spikes: >=25% above average AND >=50 views above average
-    spikes = df_with_avg[
-        (df_with_avg['pct_above_avg'] >= min_pct_above_avg) &
-        (df_with_avg['views_above_avg'] >= min_views_above_avg)
-    ].copy()
+    spikes_table = rows.filter(pc.and_(
+        pc.greater_equal(rows['pct_above_avg'], min_pct_above_avg),
+        pc.greater_equal(rows['views_above_avg'], min_views_above_avg),
+    ))
     
     # Sort by week (descending) then by views_above_avg (descending)
-    spikes = spikes.sort_values(['week', 'views_above_avg'], ascending=[False, False])
+    spikes_table = spikes_table.sort_by([('week', 'descending'), ('views_above_avg', 'descending')]).select(
+        ['week', 'country', 'total_views', 'avg_views', 'views_above_avg', 'pct_above_avg']
+    )
+    # The stats file lists weeks oldest first; the printed table newest first
+    weekly = weekly.sort_by([('week', 'ascending')])
+    
+    # Only the (small) result tables are handed to pandas, for printing
+    # (default NumPy dtypes: to_string formatters skip ArrowDtype columns)
+    spikes = spikes_table.to_pandas()
+    weekly_stats = weekly.sort_by([('week', 'descending')]).to_pandas()
     
     # Print results
     print("\n" + "="*80)
@@ -67,8 +99,17 @@ def analyze_spikes(input_file: str, min_pct_above_avg: float = 25.0, min_views_a
     print("="*80)
     print(f"\n{'Week':<12} {'Avg Views':>12} {'Total Views':>14} {'Week Ratio':>12}")
     print("-" * 80)
-    for _, row in weekly_stats.sort_values('week', ascending=False).iterrows():
-        print(f"{row['week']:<12} {row['avg_views']:>12.1f} {row['total_views']:>14.0f} {row['week_ratio']:>12.2f}")
+    if not weekly_stats.empty:
+        print(weekly_stats.to_string(
+            index=False,
+            header=False,
+            formatters={
+                'week': '{:<12}'.format,
+                'avg_views': '{:>12.1f}'.format,
+                'total_views': '{:>14.0f}'.format,
+                'week_ratio': '{:>12.2f}'.format,
+            },
+        ))
     
     print("\n" + "="*80)
     print(f"COUNTRY SPIKES (≥{min_pct_above_avg}% above avg AND ≥{min_views_above_avg} views above avg)")
@@ -80,21 +121,27 @@ def analyze_spikes(input_file: str, min_pct_above_avg: float = 25.0, min_views_a
         print(f"\nFound {len(spikes)} country-week spikes:\n")
         print(f"{'Week':<12} {'Country':<25} {'Views':>8} {'Avg':>8} {'Above Avg':>12} {'% Above':>10}")
         print("-" * 100)
-        
-        for _, row in spikes.iterrows():
-            print(f"{row['week']:<12} {row['country']:<25} {row['total_views']:>8.0f} "
-                  f"{row['avg_views']:>8.1f} {row['views_above_avg']:>12.0f} {row['pct_above_avg']:>9.1f}%")
+        print(spikes.to_string(
+            index=False,
+            header=False,
+            formatters={
+                'week': '{:<12}'.format,
+                'country': '{:<25}'.format,
+                'total_views': '{:>8.0f}'.format,
+                'avg_views': '{:>8.1f}'.format,
+                'views_above_avg': '{:>12.0f}'.format,
+                'pct_above_avg': '{:>9.1f}%'.format,
+            },
+        ))
     
     # Save results
     output_file = input_file.replace('.txt', '_spikes.txt')
-    spikes_output = spikes[['week', 'country', 'total_views', 'avg_views', 'views_above_avg', 'pct_above_avg']].copy()
-    spikes_output.to_csv(output_file, sep='\t', index=False)
+    write_tsv(spikes_table, output_file)
     print(f"\nSaved spikes to: {output_file}")
     
     # Also save weekly statistics
     weekly_stats_file = input_file.replace('.txt', '_weekly_stats.txt')
-    weekly_stats_output = weekly_stats[['week', 'avg_views', 'total_views', 'week_ratio']].copy()
-    weekly_stats_output.to_csv(weekly_stats_file, sep='\t', index=False)
+    write_tsv(weekly, weekly_stats_file)
     print(f"Saved weekly statistics to: {weekly_stats_file}")
     
     return spikes, weekly_stats
@@ -20,54 +20,103 @@ Env vars:
 """
 
 import argparse
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from pathlib import Path
 from google.cloud import bigquery
 # We'll use REST API directly with requests library instead of gRPC client
 try:
     import requests
+    from auth_utils import build_session, get_credentials
     REQUESTS_AVAILABLE = True
 except ImportError:
     REQUESTS_AVAILABLE = False
+# Optional: stream-parse large REST reports instead of loading the whole JSON
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 
 DEFAULT_PROJECT   = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET   = os.getenv("GA_DATASET_ID", "analytics_427048881")
 DEFAULT_TZ        = os.getenv("GA_TZ", "America/Los_Angeles")
 DEFAULT_WEEKS     = int(os.getenv("GA_WEEKS", "20"))
 DEFAULT_PROPERTY_ID = os.getenv("GA_PROPERTY_ID", "")
+API_CHUNK_WEEKS   = 4
+# Chunk boundaries are counted from a fixed Monday so the same (start, end)
+# pairs recur across runs and their cached results can be reused.
+API_CHUNK_EPOCH   = datetime(2000, 1, 3)
+API_CACHE_DIR     = Path(os.getenv("GA4_SPIKE_CACHE_DIR", str(Path.home() / ".cache" / "ga4_spike")))
+# GA4 keeps revising the most recent ~48h; only ranges older than that are cached.
+API_CACHE_SETTLE  = timedelta(hours=48)
 
+# tz and weeks are query parameters so the SQL text is identical across runs;
+# only the table path (which BigQuery cannot parameterize) is formatted in.
 SQL_TEMPLATE = """
-DECLARE tz STRING DEFAULT '{tz}';
-
 SELECT
-  DATE_TRUNC(DATE(TIMESTAMP_MICROS(event_timestamp), tz), WEEK(MONDAY)) AS week_start,
+  DATE_TRUNC(DATE(TIMESTAMP_MICROS(event_timestamp), @tz), WEEK(MONDAY)) AS week_start,
   geo.country AS country,
-  COUNT(DISTINCT user_pseudo_id) AS total_views
+  {distinct_users} AS total_views
 FROM `{project}.{dataset}.events_*`
 WHERE geo.country IS NOT NULL
   AND geo.country != ''
-  AND DATE(TIMESTAMP_MICROS(event_timestamp), tz)
-      >= DATE_SUB(CURRENT_DATE(tz), INTERVAL {weeks} WEEK)
+  -- Shard pruning: only scan daily tables in the window (padded a day each
+  -- side for timezone skew) plus the intraday tables for the latest days.
+  AND (
+    _TABLE_SUFFIX BETWEEN
+      FORMAT_DATE('%Y%m%d', DATE_SUB(CURRENT_DATE(@tz), INTERVAL @weeks * 7 + 1 DAY))
+      AND FORMAT_DATE('%Y%m%d', DATE_ADD(CURRENT_DATE(@tz), INTERVAL 1 DAY))
+    OR _TABLE_SUFFIX LIKE 'intraday_%'
+  )
+  AND DATE(TIMESTAMP_MICROS(event_timestamp), @tz)
+      >= DATE_SUB(CURRENT_DATE(@tz), INTERVAL @weeks WEEK)
 GROUP BY week_start, country
 ORDER BY week_start DESC, total_views DESC;
 """
 
-DATE_RANGE_SQL = """
-DECLARE tz STRING DEFAULT '{tz}';
+# HyperLogLog++ (~1% error) is plenty for spotting spikes and skips the
+# shuffle an exact distinct needs; --exact-distinct switches back for audits.
+APPROX_DISTINCT_USERS = "APPROX_COUNT_DISTINCT(user_pseudo_id)"
+EXACT_DISTINCT_USERS = "COUNT(DISTINCT user_pseudo_id)"
 
+DATE_RANGE_SQL = """
 SELECT
-  MIN(DATE(TIMESTAMP_MICROS(event_timestamp), tz)) AS earliest_date,
-  MAX(DATE(TIMESTAMP_MICROS(event_timestamp), tz)) AS latest_date,
-  COUNT(DISTINCT DATE(TIMESTAMP_MICROS(event_timestamp), tz)) AS distinct_days,
-  COUNT(DISTINCT DATE_TRUNC(DATE(TIMESTAMP_MICROS(event_timestamp), tz), WEEK(MONDAY))) AS distinct_weeks,
+  MIN(DATE(TIMESTAMP_MICROS(event_timestamp), @tz)) AS earliest_date,
+  MAX(DATE(TIMESTAMP_MICROS(event_timestamp), @tz)) AS latest_date,
+  COUNT(DISTINCT DATE(TIMESTAMP_MICROS(event_timestamp), @tz)) AS distinct_days,
+  COUNT(DISTINCT DATE_TRUNC(DATE(TIMESTAMP_MICROS(event_timestamp), @tz), WEEK(MONDAY))) AS distinct_weeks,
   COUNT(*) AS total_events
 FROM `{project}.{dataset}.events_*`
 WHERE geo.country IS NOT NULL
   AND geo.country != '';
 """
 
+# The chunked fetches get a longer retry budget than the one-shot checks.
+SESSION = build_session(pool_connections=2, retries=5, backoff_factor=0.5) if REQUESTS_AVAILABLE else None
+
+def _weekly_frame(dates, countries, users):
+    """Sum daily (date, country, users) columns into Monday-start weeks."""
+    df = pd.DataFrame({'date_str': dates, 'country': countries, 'total_views': users})
+    df = df[df['country'] != "(not set)"]
+    if df.empty:
+        return pd.DataFrame()
+    
+    # Parse once, then shift to Monday with integer day arithmetic: day 0
+    # (1970-01-01) was a Thursday, so (days + 3) % 7 is the Monday-based weekday
+    days = pd.to_datetime(df['date_str'], format="%Y%m%d").to_numpy().astype('datetime64[D]')
+    week_start = days - ((days.view('int64') + 3) % 7).astype('timedelta64[D]')
+    df = df.assign(week_start=week_start.astype(object))
+    # Unsorted: the chunk results are regrouped (and sorted once) by the caller
+    return df.groupby(['week_start', 'country'], sort=False)['total_views'].sum().reset_index()
+
 def query_ga4_api(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
     """Query GA4 Reporting API for country and user data by date."""
     # Try gRPC client first (better auth handling), fall back to REST
@@ -84,6 +133,26 @@ def query_ga4_api(property_id: str, start_date: str, end_date: str, service_acco
         raise ImportError("requests library required. Install with: pip install requests")
     return query_ga4_api_rest(property_id, start_date, end_date, service_account_key)
 
+def query_ga4_api_cached(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
+    """query_ga4_api, served from a parquet file for ranges GA4 no longer revises."""
+    settled = datetime.now() - datetime.strptime(end_date, "%Y-%m-%d") >= API_CACHE_SETTLE + timedelta(days=1)
+    key = hashlib.blake2b(f"{property_id}|{start_date}|{end_date}".encode("utf-8"), digest_size=16).hexdigest()
+    cache_path = API_CACHE_DIR / f"{key}.parquet"
+    if settled:
+        try:
+            return pd.read_parquet(cache_path)
+        except (OSError, ValueError, ImportError):
+            pass
+    
+    df = query_ga4_api(property_id, start_date, end_date, service_account_key)
+    if settled and not df.empty:
+        try:
+            API_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            df.to_parquet(cache_path, index=False)
+        except (OSError, ValueError, ImportError):
+            pass
+    return df
+
 def query_ga4_api_grpc(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
     """Query using gRPC client (preferred method)."""
     from google.analytics.data import BetaAnalyticsDataClient
@@ -115,64 +184,27 @@ def query_ga4_api_grpc(property_id: str, start_date: str, end_date: str, service
     
     response = client.run_report(request)
     
-    rows = []
-    for row in response.rows:
-        date_str = row.dimension_values[0].value
-        country = row.dimension_values[1].value
-        users = int(row.metric_values[0].value)
-        
-        if country == "(not set)":
-            continue
-        
-        date_obj = datetime.strptime(date_str, "%Y%m%d").date()
-        days_since_monday = date_obj.weekday()
-        week_start = date_obj - timedelta(days=days_since_monday)
-        
-        rows.append({
-            'week_start': week_start,
-            'country': country,
-            'total_views': users,
-            'date': date_obj
-        })
-    
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-    
-    df_weekly = df.groupby(['week_start', 'country'])['total_views'].sum().reset_index()
-    return df_weekly
+    rows = list(response.rows)
+    dims = [row.dimension_values for row in rows]
+    return _weekly_frame(
+        [d[0].value for d in dims],
+        [d[1].value for d in dims],
+        [int(row.metric_values[0].value) for row in rows],
+    )
 
 def query_ga4_api_rest(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
     """Query GA4 Reporting API for country and user data by date using REST API."""
     if not REQUESTS_AVAILABLE:
         raise ImportError("requests library required. Install with: pip install requests")
     
-    import requests
-    from google.auth import default
-    from google.auth.transport.requests import Request as AuthRequest
-    from google.oauth2 import service_account
-    
     try:
         # Use service account if provided, otherwise use ADC
-        if service_account_key:
-            credentials = service_account.Credentials.from_service_account_file(
-                service_account_key,
-                scopes=['https://www.googleapis.com/auth/analytics.readonly']
-            )
-            credentials.refresh(AuthRequest())
-        else:
-            # Get credentials - explicitly request analytics scope
-            # Note: This requires the stored credentials to have been created with this scope
-            credentials, project = default(scopes=['https://www.googleapis.com/auth/analytics.readonly'])
+        credentials = get_credentials(service_account_key=service_account_key)
         
         # Check if credentials have the required scope
         if hasattr(credentials, 'scopes') and credentials.scopes:
             print(f"Token scopes: {credentials.scopes}")
         
-        # Always refresh to ensure we have a valid token
-        if not credentials.valid or credentials.expired:
-            credentials.refresh(AuthRequest())
-        
         # Verify we have a token
         if not hasattr(credentials, 'token') or not credentials.token:
             raise ValueError("No access token available")
@@ -189,7 +221,7 @@ def query_ga4_api_rest(property_id: str, start_date: str, end_date: str, service
             "metrics": [{"name": "activeUsers"}]
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        response = SESSION.post(url, json=payload, headers=headers, timeout=60, stream=IJSON_AVAILABLE)
         
         # Debug: print response for troubleshooting
         if response.status_code != 200:
@@ -232,34 +264,28 @@ def query_ga4_api_rest(property_id: str, start_date: str, end_date: str, service
             raise PermissionError(f"Permission denied: {response.text}")
         
         response.raise_for_status()
-        data = response.json()
         
-        rows = []
-        for row in data.get('rows', []):
-            date_str = row['dimensionValues'][0]['value']
-            country = row['dimensionValues'][1]['value']
-            users = int(row['metricValues'][0]['value'])
-            
-            if country == "(not set)":
-                continue
-            
-            date_obj = datetime.strptime(date_str, "%Y%m%d").date()
-            days_since_monday = date_obj.weekday()
-            week_start = date_obj - timedelta(days=days_since_monday)
-            
-            rows.append({
-                'week_start': week_start,
-                'country': country,
-                'total_views': users,
-                'date': date_obj
-            })
-        
-        df = pd.DataFrame(rows)
-        if df.empty:
-            return df
+        if IJSON_AVAILABLE:
+            # Pull rows off the socket one at a time; the full report is never
+            # held as a dict. ijson reads to the end, so the connection goes
+            # back to the pool.
+            response.raw.decode_content = True
+            dates, countries, users = [], [], []
+            for row in ijson.items(response.raw, 'rows.item'):
+                dims = row['dimensionValues']
+                dates.append(dims[0]['value'])
+                countries.append(dims[1]['value'])
+                users.append(int(row['metricValues'][0]['value']))
+            return _weekly_frame(dates, countries, users)
         
-        df_weekly = df.groupby(['week_start', 'country'])['total_views'].sum().reset_index()
-        return df_weekly
+        data = response.json()
+        rows = data.get('rows', [])
+        dims = [r['dimensionValues'] for r in rows]
+        return _weekly_frame(
+            [d[0]['value'] for d in dims],
+            [d[1]['value'] for d in dims],
+            [int(r['metricValues'][0]['value']) for r in rows],
+        )
         
     except PermissionError:
         raise
@@ -279,7 +305,30 @@ def get_data_from_api(property_id: str, weeks: int, tz: str, service_account_key
     end_str = end_date.strftime("%Y-%m-%d")
     
     print(f"Querying GA4 API from {start_str} to {end_str}…")
-    df = query_ga4_api(property_id, start_str, end_str, service_account_key)
+    # Split the window into disjoint, epoch-aligned chunks and request them
+    # concurrently so GA4 builds the smaller reports in parallel; the shared
+    # session pools the connections and settled chunks come from the cache.
+    chunk_days = 7 * API_CHUNK_WEEKS
+    ranges = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        offset = (chunk_start - API_CHUNK_EPOCH).days % chunk_days
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - offset - 1), end_date)
+        ranges.append((chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+        chunk_start = chunk_end + timedelta(days=1)
+    
+    with ThreadPoolExecutor(max_workers=min(len(ranges), 8)) as executor:
+        frames = list(executor.map(
+            lambda r: query_ga4_api_cached(property_id, r[0], r[1], service_account_key),
+            ranges,
+        ))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    
+    # Chunks cover disjoint days, so a week split across two chunks is summed
+    # back together rather than de-duplicated.
+    df = pd.concat(frames, ignore_index=True).groupby(['week_start', 'country'])['total_views'].sum().reset_index()
     
     if not df.empty:
         print(f"Found {len(df)} country-week combinations from API")
@@ -294,23 +343,29 @@ def build_parser():
     p.add_argument("--property-id", default=DEFAULT_PROPERTY_ID, help="GA4 Property ID (for API access)")
     p.add_argument("--use-api", action="store_true", help="Use GA4 Reporting API instead of BigQuery")
     p.add_argument("--merge-bq", action="store_true", help="Merge API data with BigQuery (API for history, BQ for recent)")
+    p.add_argument("--exact-distinct", action="store_true", help="Count users exactly in BigQuery instead of APPROX_COUNT_DISTINCT")
     p.add_argument("--check-dates", action="store_true", help="Check available date range in the table")
     p.add_argument("--service-account-key", help="Path to service account JSON key file (for API access)")
     return p
 
-def run_query(client: bigquery.Client, sql: str):
-    job = client.query(sql)
-    return job.result().to_dataframe(create_bqstorage_client=True)
+def query_params(tz: str, weeks: int = None) -> bigquery.QueryJobConfig:
+    params = [bigquery.ScalarQueryParameter("tz", "STRING", tz)]
+    if weeks is not None:
+        params.append(bigquery.ScalarQueryParameter("weeks", "INT64", weeks))
+    return bigquery.QueryJobConfig(query_parameters=params)
 
-def save_text_file(df: pd.DataFrame, out_dir=".", prefix="country_weekly_views"):
+def run_query(client: bigquery.Client, sql: str, job_config: bigquery.QueryJobConfig = None) -> pa.Table:
+    job = client.query(sql, job_config=job_config)
+    # Keep the Storage API's Arrow batches as-is; pandas is only built once, at the end
+    return job.result().to_arrow(create_bqstorage_client=True)
+
+def save_text_file(table: pa.Table, out_dir=".", prefix="country_weekly_views"):
     ts = datetime.now(timezone.utc).astimezone().strftime("%Y%m%d_%H%M%S")
     path = os.path.join(out_dir, f"{prefix}_{ts}.txt")
-    with open(path, 'w') as f:
-        # Write header
-        f.write("week\tcountry\ttotal_views\n")
-        # Write data
-        for _, row in df.iterrows():
-            f.write(f"{row['week_start']}\t{row['country']}\t{row['total_views']}\n")
+    # Arrow's C++ writer straight from the report table; unquoted tab-separated
+    # output with a week/country/total_views header, as before
+    report = table.select(['week_start', 'country', 'total_views']).rename_columns(['week', 'country', 'total_views'])
+    pacsv.write_csv(report, path, write_options=pacsv.WriteOptions(delimiter='\t', quoting_style='none'))
     return path
 
 def main():
@@ -320,13 +375,12 @@ def main():
         client = bigquery.Client(project=args.project)
         print("Checking available date range in BigQuery table…")
         date_sql = DATE_RANGE_SQL.format(
-            tz=args.timezone,
             project=args.project,
             dataset=args.dataset,
         )
-        date_df = run_query(client, date_sql)
+        date_df = run_query(client, date_sql, query_params(args.timezone))
         print("\nAvailable data in BigQuery table:")
-        print(date_df.to_string(index=False))
+        print(date_df.to_pandas().to_string(index=False))
         print()
         return
 
@@ -347,21 +401,20 @@ def main():
             return
         
         df_api = get_data_from_api(args.property_id, args.weeks, args.timezone, service_account_key)
-        if args.use_api:
-            df = df_api
+        if args.use_api and not df_api.empty:
+            df = pa.Table.from_pandas(df_api, preserve_index=False)
 
     # Get data from BigQuery if not using API only, or if merging
     if not args.use_api:
         client = bigquery.Client(project=args.project)
         sql = SQL_TEMPLATE.format(
-            tz=args.timezone,
             project=args.project,
             dataset=args.dataset,
-            weeks=args.weeks,
+            distinct_users=EXACT_DISTINCT_USERS if args.exact_distinct else APPROX_DISTINCT_USERS,
         )
 
         print(f"Querying last {args.weeks} weeks from BigQuery…")
-        df_bq = run_query(client, sql)
+        df_bq = run_query(client, sql, query_params(args.timezone, args.weeks))
         
         if not args.merge_bq:
             df = df_bq
@@ -369,23 +422,31 @@ def main():
     # Merge API and BigQuery data if requested
     if args.merge_bq and df_api is not None and df_bq is not None:
         print("\nMerging API and BigQuery data…")
-        # Combine dataframes, preferring BigQuery for overlapping periods
-        df_combined = pd.concat([df_api, df_bq])
-        # Remove duplicates, keeping BigQuery data when there's overlap
-        df_combined = df_combined.drop_duplicates(subset=['week_start', 'country'], keep='last')
-        # Re-aggregate in case of any overlaps
-        df = df_combined.groupby(['week_start', 'country'])['total_views'].sum().reset_index()
-        df = df.sort_values(['week_start', 'total_views'], ascending=[False, False])
+        # Combine tables, preferring BigQuery for overlapping periods
+        tables = [df_bq]
+        if not df_api.empty:
+            api_table = pa.Table.from_pandas(df_api, preserve_index=False)
+            tables.insert(0, api_table.select(df_bq.column_names).cast(df_bq.schema))
+        # One ordered hash aggregation keeps the last (BigQuery) value per week-country
+        merged = pa.concat_tables(tables).group_by(['week_start', 'country'], use_threads=False).aggregate(
+            [('total_views', 'last')]
+        )
+        df = pa.table({
+            'week_start': merged['week_start'],
+            'country': merged['country'],
+            'total_views': merged['total_views_last'],
+        }).sort_by([('week_start', 'descending'), ('total_views', 'descending')])
         print(f"Merged: {len(df)} country-week combinations")
 
-    if df is None or df.empty:
+    if df is None or df.num_rows == 0:
         print("No data found for the specified period.")
         return
 
-    print(f"\nFound {len(df)} country-week combinations across {df['week_start'].nunique()} weeks")
-    print(f"Total countries: {df['country'].nunique()}")
-    if df['week_start'].nunique() < args.weeks:
-        print(f"\n⚠️  WARNING: Only {df['week_start'].nunique()} weeks of data found, but {args.weeks} weeks requested.")
+    n_weeks = pc.count_distinct(df['week_start']).as_py()
+    print(f"\nFound {df.num_rows} country-week combinations across {n_weeks} weeks")
+    print(f"Total countries: {pc.count_distinct(df['country']).as_py()}")
+    if n_weeks < args.weeks:
+        print(f"\n⚠️  WARNING: Only {n_weeks} weeks of data found, but {args.weeks} weeks requested.")
         if not args.use_api:
             print("   Consider using --use-api to pull historical data from GA4 API.")
 
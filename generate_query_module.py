@@ -11,6 +11,9 @@ Example:
   python generate_query_module.py --sql-file my_query.sql --name "Weekly RPM" \
       --output-dir Queries
 
+  # Generate one module per SQL file, in parallel (named after each file)
+  python generate_query_module.py --batch "sql/*.sql" --output-dir Queries
+
 The generator attempts to infer a descriptive name and chart suggestion if not
 provided. You can tweak the generated script afterwards as needed.
 """
@@ -18,16 +21,22 @@ provided. You can tweak the generated script afterwards as needed.
 from __future__ import annotations
 
 import argparse
+import glob
 import os
 import re
 import textwrap
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Tuple
-from string import Template
 
 DEFAULT_OUTPUT_DIR = Path("Queries")
 
+_NON_ALNUM = re.compile(r"[^a-zA-Z0-9]+")
+_DASHES = re.compile(r"-+")
+_SELECT_FROM = re.compile(r"select\s+(.*)\s+from", re.IGNORECASE | re.DOTALL)
+_PAREN = re.compile(r"\(.*?\)")
+
 
 def load_sql(sql: Optional[str], sql_file: Optional[str]) -> str:
     if sql:
@@ -41,8 +50,8 @@ def load_sql(sql: Optional[str], sql_file: Optional[str]) -> str:
 
 
 def slugify(text: str) -> str:
-    text = re.sub(r"[^a-zA-Z0-9]+", "-", text).strip("-")
-    text = re.sub(r"-+", "-", text)
+    text = _NON_ALNUM.sub("-", text).strip("-")
+    text = _DASHES.sub("-", text)
     return text.lower()
 
 
@@ -58,11 +67,11 @@ def infer_name(sql: str) -> str:
             continue
         break
 
-    match = re.search(r"select\s+(.*)\s+from", sql, re.IGNORECASE | re.DOTALL)
+    match = _SELECT_FROM.search(sql)
     if match:
         select_part = match.group(1)
         first_field = select_part.split(",")[0]
-        first_field = re.sub(r"\(.*?\)", "", first_field)  # remove functions
+        first_field = _PAREN.sub("", first_field)  # remove functions
         first_field = first_field.strip().strip("`")
         if first_field:
             return f"{first_field.title()} Analysis"
@@ -88,23 +97,22 @@ def create_module_code(
     chart_suggestion: str,
     sql: str,
 ) -> str:
-    from string import Template
-    
     doc_sql = textwrap.indent(sql, "    ")
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    # Build the template as a single string
+    # Build the template as a single format string; literal braces in the
+    # generated code are doubled and the constants are embedded with !r
     template_str = '''#!/usr/bin/env python3
 \'\'\'
 Auto-generated query module.
 
-Generated on ${TIMESTAMP} by generate_query_module.py.
+Generated on {timestamp} by generate_query_module.py.
 
-Query Name: ${QUERY_NAME_TEXT}
-Recommended Visualization: ${CHART_TEXT}
+Query Name: {query_name}
+Recommended Visualization: {chart_suggestion}
 
 Original SQL:
-${DOC_SQL}
+{doc_sql}
 \'\'\'
 
 from __future__ import annotations
@@ -115,11 +123,14 @@ from datetime import datetime
 from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from google.cloud import bigquery
 
-QUERY_NAME = ${QUERY_NAME}
-RECOMMENDED_CHART = ${CHART}
-SQL = ${SQL}
+QUERY_NAME = {query_name!r}
+RECOMMENDED_CHART = {chart_suggestion!r}
+SQL = {sql!r}
 DEFAULT_PROJECT = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET = os.getenv("GA_DATASET_ID", "analytics_427048881")
 
@@ -130,69 +141,85 @@ def resolve_sql(project: str, dataset: str) -> str:
     return text
 
 
-def run_query(project: str, dataset: str) -> pd.DataFrame:
+def run_query(project: str, dataset: str) -> pa.Table:
     client = bigquery.Client(project=project)
     rendered_sql = resolve_sql(project, dataset)
     job = client.query(rendered_sql)
-    return job.result().to_dataframe(create_bqstorage_client=True)
+    return job.result().to_arrow(create_bqstorage_client=True)
 
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description=f"Run '{QUERY_NAME}' query")
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=f"Run '{{QUERY_NAME}}' query")
     parser.add_argument("--project", default=DEFAULT_PROJECT, help="GCP project ID")
     parser.add_argument("--dataset", default=DEFAULT_DATASET, help="BigQuery dataset ID (used for placeholder replacement)")
     parser.add_argument(
         "--output-prefix",
-        default=${BASE_FILENAME},
+        default={base_filename!r},
         help="Prefix for CSV output",
     )
     parser.add_argument("--start-date", help="Optional date range start label")
     parser.add_argument("--end-date", help="Optional date range end label")
-    args = parser.parse_args()
+    parser.add_argument("--no-chart", action="store_true", help="Skip the chart (and the pandas conversion it needs)")
+    return parser
 
-    df = run_query(args.project, args.dataset)
 
-    print(f"Query: {QUERY_NAME}")
-    print(f"Recommended visualization: {RECOMMENDED_CHART}")
-    print(f"Project: {args.project}")
-    print(f"Dataset: {args.dataset}")
+def run(args: argparse.Namespace) -> None:
+    table = run_query(args.project, args.dataset)
+
+    print(f"Query: {{QUERY_NAME}}")
+    print(f"Recommended visualization: {{RECOMMENDED_CHART}}")
+    print(f"Project: {{args.project}}")
+    print(f"Dataset: {{args.dataset}}")
     if args.start_date or args.end_date:
-        print(f"Date range: {args.start_date or 'N/A'} -> {args.end_date or 'N/A'}")
-    print(f"Returned {len(df)} rows")
-    print(df.head())
+        print(f"Date range: {{args.start_date or 'N/A'}} -> {{args.end_date or 'N/A'}}")
+    print(f"Returned {{table.num_rows}} rows")
+    print(table.slice(0, 5).to_pandas())
 
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    csv_path = Path(f"{args.output_prefix}_{ts}.csv")
-    df.to_csv(csv_path, index=False)
-    print(f"Saved raw results to {csv_path}")
+    csv_path = Path(f"{{args.output_prefix}}_{{ts}}.csv")
+    # Arrow's multithreaded CSV writer, straight from the Storage API batches
+    pacsv.write_csv(table, csv_path)
+    print(f"Saved raw results to {{csv_path}}")
+
+    if args.no_chart:
+        return
 
     chart_path = None
     try:
         import matplotlib.pyplot as plt  # type: ignore
 
+        # Only the first 20 rows are charted, and numeric columns are read off
+        # the Arrow schema; pd.to_numeric is only tried on string columns.
+        head = table.slice(0, 20)
         numeric_cols: list[str] = []
-        for column in df.columns:
-            series = df[column]
-            if pd.api.types.is_numeric_dtype(series):
-                numeric_cols.append(column)
-                continue
-            coerced = pd.to_numeric(series, errors="coerce")
+        string_cols: list[str] = []
+        for index, field in enumerate(head.schema):
+            if pa.types.is_decimal(field.type):
+                head = head.set_column(index, field.name, pc.cast(head.column(index), pa.float64()))
+                numeric_cols.append(field.name)
+            elif pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+                numeric_cols.append(field.name)
+            elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                string_cols.append(field.name)
+
+        df = head.to_pandas()
+        for column in string_cols:
+            coerced = pd.to_numeric(df[column], errors="coerce")
             if coerced.notna().any():
                 df[column] = coerced
-                if pd.api.types.is_numeric_dtype(df[column]):
-                    numeric_cols.append(column)
+                numeric_cols.append(column)
 
         if numeric_cols:
-            subset = df[numeric_cols].head(20)
+            subset = df[numeric_cols]
             if not subset.empty:
-                chart_path = Path(f"{args.output_prefix}_{ts}.png")
+                chart_path = Path(f"{{args.output_prefix}}_{{ts}}.png")
                 plt.figure(figsize=(12, 6))
                 subset.plot(ax=plt.gca())
                 plt.title(QUERY_NAME)
                 plt.tight_layout()
                 plt.savefig(chart_path)
                 plt.close()
-                print(f"Saved chart to {chart_path}")
+                print(f"Saved chart to {{chart_path}}")
             else:
                 print("Insufficient data to render chart.")
         else:
@@ -200,25 +227,27 @@ def main() -> None:
     except ImportError:
         print("matplotlib not installed; skipping chart generation.")
     except Exception as exc:
-        print(f"Failed to build chart: {exc}")
+        print(f"Failed to build chart: {{exc}}")
+
+
+def main() -> None:
+    run(build_parser().parse_args())
 
 
 if __name__ == "__main__":
     main()
 '''
 
-    substitutions = {
-        "TIMESTAMP": timestamp,
-        "QUERY_NAME_TEXT": query_name,
-        "CHART_TEXT": chart_suggestion,
-        "DOC_SQL": doc_sql,
-        "QUERY_NAME": repr(query_name),
-        "CHART": repr(chart_suggestion),
-        "SQL": repr(sql),
-        "BASE_FILENAME": repr(base_filename),
-    }
-
-    return Template(template_str).substitute(substitutions)
+    return template_str.format_map(
+        {
+            "timestamp": timestamp,
+            "query_name": query_name,
+            "chart_suggestion": chart_suggestion,
+            "doc_sql": doc_sql,
+            "sql": sql,
+            "base_filename": base_filename,
+        }
+    )
 
 
 def ensure_output_dir(path: Path) -> None:
@@ -226,10 +255,24 @@ def ensure_output_dir(path: Path) -> None:
         path.mkdir(parents=True, exist_ok=True)
 
 
+def _generate_one(sql_file: str, output_dir: str) -> Tuple[Path, str, str]:
+    # Batch worker: the name and chart are inferred from the SQL, but the module
+    # is named after the SQL file so two queries with the same inferred name
+    # cannot overwrite each other.
+    sql = load_sql(None, sql_file)
+    query_name = infer_name(sql)
+    chart_suggestion = infer_chart(sql)
+    base_filename = slugify(Path(sql_file).stem)
+    module_path = Path(output_dir) / f"{base_filename}.py"
+    module_path.write_text(create_module_code(base_filename, query_name, chart_suggestion, sql), encoding="utf-8")
+    return module_path, query_name, chart_suggestion
+
+
 def main_generator():
     parser = argparse.ArgumentParser(description="Generate a GA4 BigQuery query module from SQL")
     parser.add_argument("--sql", help="SQL query string")
     parser.add_argument("--sql-file", help="Path to SQL file")
+    parser.add_argument("--batch", help="Glob of SQL files to generate modules for in parallel (e.g. 'sql/*.sql')")
     parser.add_argument("--name", help="Human-readable query name")
     parser.add_argument("--chart", help="Recommended chart description")
     parser.add_argument("--output-dir", default=str(DEFAULT_OUTPUT_DIR), help="Output directory for the module")
@@ -237,6 +280,30 @@ def main_generator():
 
     args = parser.parse_args()
 
+    if args.batch:
+        for option in ("name", "chart", "prefix"):
+            if getattr(args, option):
+                parser.error(f"--{option} cannot be combined with --batch")
+        sql_files = sorted(glob.glob(args.batch))
+        if not sql_files:
+            raise FileNotFoundError(f"No SQL files match: {args.batch}")
+        seen: dict[str, str] = {}
+        for sql_file in sql_files:
+            slug = slugify(Path(sql_file).stem)
+            if slug in seen:
+                parser.error(f"{seen[slug]} and {sql_file} would both generate {slug}.py")
+            seen[slug] = sql_file
+        output_dir = Path(args.output_dir)
+        ensure_output_dir(output_dir)
+        # Each file is independent, CPU-only work, so one process per core.
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(_generate_one, sql_files, [str(output_dir)] * len(sql_files)))
+        for module_path, query_name, chart_suggestion in results:
+            print(f"Generated module: {module_path}")
+            print(f"  Query Name: {query_name}")
+            print(f"  Recommended visualization: {chart_suggestion}")
+        return
+
     sql = load_sql(args.sql, args.sql_file)
     query_name = args.name or infer_name(sql)
     chart_suggestion = args.chart or infer_chart(sql)
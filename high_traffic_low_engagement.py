@@ -80,16 +80,15 @@ def main():
         page_url = row.dimension_values[0].value or "(not set)"
 
         if views >= args.min_views and engagement_rate <= args.max_engagement_rate:
-            flagged.append((views, engagement_rate, avg_eng_time, engaged_sessions, page_url))
+            flagged.append((views, engagement_rate, int(round(avg_eng_time)), engaged_sessions, page_url))
 
     if not flagged:
         print("No pages met the criteria.")
         return
 
-    for views, engagement_rate, avg_eng_time, engaged_sessions, page_url in flagged:
-        minutes, seconds = divmod(int(round(avg_eng_time)), 60)
+    for views, engagement_rate, avg_eng_secs, engaged_sessions, page_url in flagged:
         print(
-            f"{views:>12} {engagement_rate:>17.2%} {minutes:02d}:{seconds:02d}"
+            f"{views:>12} {engagement_rate:>17.2%} {avg_eng_secs // 60:02d}:{avg_eng_secs % 60:02d}"
             f" {engaged_sessions:>18} {page_url[:60]}"
         )
 
@@ -7,8 +7,8 @@ and then returned on a different day within the specified range. Outputs detaile
 information including demographics and key events.
 
 Requirements:
-  - google-cloud-bigquery
-  - pandas
+  - google-cloud-bigquery>=3.29 (max_stream_count on the Arrow batch reader)
+  - pyarrow
 
 Usage example:
   python repeat_customer_analyzer.py \
@@ -23,15 +23,52 @@ Usage example:
 
 import argparse
 import os
-from datetime import datetime
+from datetime import date
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from google.cloud import bigquery
 
+from bq_utils import DEFAULT_BQ_STREAMS, bq_client, output_timestamp, read_arrow
+
 DEFAULT_PROJECT = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET = os.getenv("GA_DATASET_ID", "analytics_427048881")
 DEFAULT_TZ = os.getenv("GA_TZ", "America/Los_Angeles")
 
+# Query columns in report order, and what an empty value is shown as in the text report.
+TEXT_COLUMNS = {
+    "user_pseudo_id": None,
+    "qualifying_days": None,
+    "total_qualifying_minutes": None,
+    "visit_dates": None,
+    "countries": "N/A",
+    "regions": "N/A",
+    "cities": "N/A",
+    "device_categories": "N/A",
+    "operating_systems": "N/A",
+    "traffic_sources": "N/A",
+    "traffic_mediums": "N/A",
+    "events_triggered": "N/A",
+    "conversion_events": "None",
+}
+USER_BLOCK_FMT = (
+    "User ID: {}\n"
+    "  Qualifying days: {}\n"
+    "  Total qualifying minutes: {:.2f}\n"
+    "  Visit dates: {}\n"
+    "  Countries: {}\n"
+    "  Regions: {}\n"
+    "  Cities: {}\n"
+    "  Device categories: {}\n"
+    "  Operating systems: {}\n"
+    "  Traffic sources: {}\n"
+    "  Traffic mediums: {}\n"
+    "  Events triggered: {}\n"
+    "  Conversion events: {}\n"
+    + "-" * 80 + "\n"
+).format
+
 
 def build_parser():
     parser = argparse.ArgumentParser(description="Find repeat visitors with high engagement from GA4 BigQuery export")
@@ -43,116 +80,130 @@ def build_parser():
     parser.add_argument("--min-minutes", type=float, default=3.0, help="Minimum minutes per day threshold (default 3)")
     parser.add_argument("--min-days", type=int, default=2, help="Minimum number of different days meeting threshold (default 2)")
     parser.add_argument("--prefix", default="repeat_customers", help="Prefix for output files")
+    parser.add_argument("--bq-streams", type=int, default=DEFAULT_BQ_STREAMS,
+                        help=f"Maximum BigQuery Storage read streams (default {DEFAULT_BQ_STREAMS})")
     return parser
 
 
 def run_query(project: str, dataset: str, timezone: str, start_date: str, end_date: str,
-              min_minutes: float, min_days: int) -> pd.DataFrame:
-    client = bigquery.Client(project=project)
-
-    min_msec = int(min_minutes * 60 * 1000)
+              min_minutes: float, min_days: int, bq_streams: int = DEFAULT_BQ_STREAMS) -> pa.Table:
+    client = bq_client(project)
+
+    # Everything but the table path is a query parameter, so the SQL text is
+    # the same on every run.
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("tz", "STRING", timezone),
+            bigquery.ScalarQueryParameter("start_date", "DATE", date.fromisoformat(start_date)),
+            bigquery.ScalarQueryParameter("end_date", "DATE", date.fromisoformat(end_date)),
+            bigquery.ScalarQueryParameter("min_msec", "INT64", int(min_minutes * 60 * 1000)),
+            bigquery.ScalarQueryParameter("min_days", "INT64", min_days),
+        ],
+        use_query_cache=True,
+        priority=bigquery.QueryPriority.INTERACTIVE,
+    )
 
     query = f"""
-    DECLARE tz STRING DEFAULT '{timezone}';
-
-    WITH user_daily_engagement AS (
+    -- One pass over events_*: per user and day, the engagement time plus every
+    -- attribute the report lists, so qualifying users need no second scan.
+    -- A single LEFT JOIN UNNEST picks out both event_params keys.
+    WITH user_days AS (
       SELECT
-        DATE(TIMESTAMP_MICROS(event_timestamp), tz) AS visit_date,
-        user_pseudo_id,
+        e.user_pseudo_id,
+        DATE(TIMESTAMP_MICROS(e.event_timestamp), @tz) AS visit_date,
         SUM(
-          IFNULL(
-            (SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'engagement_time_msec'),
-            0
-          )
-        ) AS engagement_time_msec
-      FROM `{project}.{dataset}.events_*`
-      WHERE _TABLE_SUFFIX BETWEEN REPLACE('{start_date}', '-', '') AND REPLACE('{end_date}', '-', '')
-        AND event_name = 'user_engagement'
-      GROUP BY visit_date, user_pseudo_id
-    ),
-
-    high_days AS (
-      SELECT
-        visit_date,
-        user_pseudo_id,
-        engagement_time_msec / 1000.0 / 60.0 AS engagement_minutes
-      FROM user_daily_engagement
-      WHERE engagement_time_msec >= {min_msec}
+          IF(e.event_name = 'user_engagement' AND ep.key = 'engagement_time_msec', IFNULL(ep.value.int_value, 0), 0)
+        ) AS engagement_time_msec,
+        ARRAY_AGG(DISTINCT e.geo.country IGNORE NULLS) AS countries,
+        ARRAY_AGG(DISTINCT e.geo.region IGNORE NULLS) AS regions,
+        ARRAY_AGG(DISTINCT e.geo.city IGNORE NULLS) AS cities,
+        ARRAY_AGG(DISTINCT e.device.category IGNORE NULLS) AS device_categories,
+        ARRAY_AGG(DISTINCT e.device.operating_system IGNORE NULLS) AS operating_systems,
+        ARRAY_AGG(DISTINCT e.traffic_source.source IGNORE NULLS) AS traffic_sources,
+        ARRAY_AGG(DISTINCT e.traffic_source.medium IGNORE NULLS) AS traffic_mediums,
+        ARRAY_AGG(DISTINCT e.event_name IGNORE NULLS) AS events_triggered,
+        ARRAY_AGG(
+          DISTINCT IF(ep.key = 'ga_is_conversion_event' AND ep.value.int_value = 1, e.event_name, NULL) IGNORE NULLS
+        ) AS conversion_events
+      FROM `{project}.{dataset}.events_*` AS e
+      LEFT JOIN UNNEST(e.event_params) AS ep
+        ON ep.key IN ('engagement_time_msec', 'ga_is_conversion_event')
+      WHERE e._TABLE_SUFFIX BETWEEN FORMAT_DATE('%Y%m%d', @start_date) AND FORMAT_DATE('%Y%m%d', @end_date)
+      GROUP BY user_pseudo_id, visit_date
     ),
 
     users_multi_days AS (
       SELECT
         user_pseudo_id,
-        ARRAY_AGG(visit_date ORDER BY visit_date) AS visit_dates,
-        COUNT(*) AS qualifying_days,
-        SUM(engagement_minutes) AS total_qualifying_minutes
-      FROM high_days
+        COUNTIF(engagement_time_msec >= @min_msec) AS qualifying_days,
+        SUM(IF(engagement_time_msec >= @min_msec, engagement_time_msec / 1000.0 / 60.0, 0)) AS total_qualifying_minutes,
+        ARRAY_AGG(IF(engagement_time_msec >= @min_msec, visit_date, NULL) IGNORE NULLS ORDER BY visit_date) AS visit_dates,
+        ARRAY_CONCAT_AGG(countries) AS countries,
+        ARRAY_CONCAT_AGG(regions) AS regions,
+        ARRAY_CONCAT_AGG(cities) AS cities,
+        ARRAY_CONCAT_AGG(device_categories) AS device_categories,
+        ARRAY_CONCAT_AGG(operating_systems) AS operating_systems,
+        ARRAY_CONCAT_AGG(traffic_sources) AS traffic_sources,
+        ARRAY_CONCAT_AGG(traffic_mediums) AS traffic_mediums,
+        ARRAY_CONCAT_AGG(events_triggered) AS events_triggered,
+        ARRAY_CONCAT_AGG(conversion_events) AS conversion_events
+      FROM user_days
       GROUP BY user_pseudo_id
-      HAVING COUNT(*) >= {min_days}
+      HAVING COUNTIF(engagement_time_msec >= @min_msec) >= @min_days
     )
 
     SELECT
-      u.user_pseudo_id,
-      u.qualifying_days,
-      u.total_qualifying_minutes,
-      ARRAY_TO_STRING(ARRAY(SELECT CAST(date_value AS STRING) FROM UNNEST(u.visit_dates) AS date_value), ', ') AS visit_dates,
-      STRING_AGG(DISTINCT IF(geo.country IS NULL, NULL, geo.country), ', ') AS countries,
-      STRING_AGG(DISTINCT IF(geo.region IS NULL, NULL, geo.region), ', ') AS regions,
-      STRING_AGG(DISTINCT IF(geo.city IS NULL, NULL, geo.city), ', ') AS cities,
-      STRING_AGG(DISTINCT IF(device.category IS NULL, NULL, device.category), ', ') AS device_categories,
-      STRING_AGG(DISTINCT IF(device.operating_system IS NULL, NULL, device.operating_system), ', ') AS operating_systems,
-      STRING_AGG(DISTINCT IF(traffic_source.source IS NULL, NULL, traffic_source.source), ', ') AS traffic_sources,
-      STRING_AGG(DISTINCT IF(traffic_source.medium IS NULL, NULL, traffic_source.medium), ', ') AS traffic_mediums,
-      STRING_AGG(DISTINCT IF(event_name IS NULL, NULL, event_name), ', ') AS events_triggered,
-      STRING_AGG(DISTINCT CASE WHEN IFNULL((SELECT ep.value.int_value FROM UNNEST(event_params) ep WHERE ep.key='ga_is_conversion_event'), 0) = 1 THEN event_name END, ', ') AS conversion_events
-    FROM users_multi_days u
-    JOIN `{project}.{dataset}.events_*` e
-      ON e.user_pseudo_id = u.user_pseudo_id
-    WHERE e._TABLE_SUFFIX BETWEEN REPLACE('{start_date}', '-', '') AND REPLACE('{end_date}', '-', '')
-    GROUP BY 1,2,3,4
-    ORDER BY u.total_qualifying_minutes DESC
+      user_pseudo_id,
+      qualifying_days,
+      total_qualifying_minutes,
+      ARRAY_TO_STRING(ARRAY(SELECT CAST(date_value AS STRING) FROM UNNEST(visit_dates) AS date_value), ', ') AS visit_dates,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(countries) AS v) AS countries,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(regions) AS v) AS regions,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(cities) AS v) AS cities,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(device_categories) AS v) AS device_categories,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(operating_systems) AS v) AS operating_systems,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(traffic_sources) AS v) AS traffic_sources,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(traffic_mediums) AS v) AS traffic_mediums,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(events_triggered) AS v) AS events_triggered,
+      (SELECT STRING_AGG(DISTINCT v, ', ') FROM UNNEST(conversion_events) AS v) AS conversion_events
+    FROM users_multi_days
+    ORDER BY total_qualifying_minutes DESC
     """
 
-    job = client.query(query)
-    return job.result().to_dataframe(create_bqstorage_client=True)
+    # Both outputs are written from the Arrow table, so pandas is never built.
+    rows = client.query_and_wait(query, job_config=job_config)
+    return read_arrow(rows, bq_streams)
 
 
-def save_outputs(df: pd.DataFrame, prefix: str) -> tuple[str, str]:
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+def save_outputs(table: pa.Table, prefix: str, ts: str = None) -> tuple[str, str]:
+    ts = ts or output_timestamp()
     csv_path = f"{prefix}_{ts}.csv"
     txt_path = f"{prefix}_{ts}.txt"
 
-    if df.empty:
+    if table.num_rows == 0:
         with open(txt_path, "w", encoding="utf-8") as f:
             f.write("No repeat high-engagement users found for the specified criteria.\n")
-        # create empty csv with headers
-        pd.DataFrame(columns=[
-            "user_pseudo_id", "qualifying_days", "total_qualifying_minutes", "visit_dates",
-            "countries", "regions", "cities", "device_categories", "operating_systems",
-            "traffic_sources", "traffic_mediums", "events_triggered", "conversion_events"
-        ]).to_csv(csv_path, index=False)
+        # create empty csv with headers (the query's columns, as in TEXT_COLUMNS)
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write(",".join(TEXT_COLUMNS) + "\n")
         return csv_path, txt_path
 
-    df.to_csv(csv_path, index=False)
-
+    # Arrow's C++ writer straight from the result buffers
+    pacsv.write_csv(table, csv_path)
+
+    # Fill the empty (NULL or "") aggregates with Arrow kernels, one column at
+    # a time, then format plain row tuples zipped from the column lists.
+    columns = []
+    for column, placeholder in TEXT_COLUMNS.items():
+        values = table[column]
+        if placeholder is not None:
+            values = pc.if_else(pc.fill_null(pc.equal(values, ""), True), placeholder, values)
+        columns.append(values.to_pylist())
+    # Header and every user block are joined in memory and written in one call.
+    parts = ["Repeat High-Engagement Customers\n", "=" * 80 + "\n\n"]
+    parts.extend(USER_BLOCK_FMT(*row) for row in zip(*columns))
     with open(txt_path, "w", encoding="utf-8") as f:
-        f.write("Repeat High-Engagement Customers\n")
-        f.write("=" * 80 + "\n\n")
-        for _, row in df.iterrows():
-            f.write(f"User ID: {row['user_pseudo_id']}\n")
-            f.write(f"  Qualifying days: {row['qualifying_days']}\n")
-            f.write(f"  Total qualifying minutes: {row['total_qualifying_minutes']:.2f}\n")
-            f.write(f"  Visit dates: {row['visit_dates']}\n")
-            f.write(f"  Countries: {row['countries'] or 'N/A'}\n")
-            f.write(f"  Regions: {row['regions'] or 'N/A'}\n")
-            f.write(f"  Cities: {row['cities'] or 'N/A'}\n")
-            f.write(f"  Device categories: {row['device_categories'] or 'N/A'}\n")
-            f.write(f"  Operating systems: {row['operating_systems'] or 'N/A'}\n")
-            f.write(f"  Traffic sources: {row['traffic_sources'] or 'N/A'}\n")
-            f.write(f"  Traffic mediums: {row['traffic_mediums'] or 'N/A'}\n")
-            f.write(f"  Events triggered: {row['events_triggered'] or 'N/A'}\n")
-            f.write(f"  Conversion events: {row['conversion_events'] or 'None'}\n")
-            f.write("-" * 80 + "\n")
+        f.write("".join(parts))
 
     return csv_path, txt_path
 
@@ -161,23 +212,26 @@ def main():
     parser = build_parser()
     args = parser.parse_args()
 
+    # One timestamp per run, shared by every output file
+    ts = output_timestamp()
     print(f"Analyzing repeat customers from {args.start_date} to {args.end_date}...")
-    df = run_query(
+    table = run_query(
         project=args.project,
         dataset=args.dataset,
         timezone=args.timezone,
         start_date=args.start_date,
         end_date=args.end_date,
         min_minutes=args.min_minutes,
-        min_days=args.min_days
+        min_days=args.min_days,
+        bq_streams=args.bq_streams,
     )
 
-    csv_path, txt_path = save_outputs(df, args.prefix)
+    csv_path, txt_path = save_outputs(table, args.prefix, ts)
 
-    if df.empty:
+    if table.num_rows == 0:
         print("No repeat customers found matching the criteria.")
     else:
-        print(f"Found {len(df)} repeat customers.")
+        print(f"Found {table.num_rows} repeat customers.")
     print(f"Saved CSV -> {csv_path}")
     print(f"Saved TXT -> {txt_path}")
 
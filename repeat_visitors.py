@@ -18,32 +18,67 @@ Usage:
 """
 
 import argparse
+import glob
 import os
-from datetime import datetime, timezone, timedelta
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from google.cloud import bigquery
 import pandas as pd
 
+from bq_utils import DEFAULT_BQ_STREAMS, bq_client, output_timestamp, read_arrow
+# Optional: read results as Arrow over capped storage streams
+try:
+    import pyarrow
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+# Optional: REST fallback over the shared pooled session and credential cache
+try:
+    from auth_utils import get_credentials, session
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+# Optional: stream-parse large REST reports instead of loading the whole JSON
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
 DEFAULT_PROJECT = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET = os.getenv("GA_DATASET_ID", "analytics_427048881")
 DEFAULT_TZ = os.getenv("GA_TZ", "America/Los_Angeles")
 DEFAULT_WEEKS = int(os.getenv("GA_WEEKS", "3"))
 DEFAULT_MIN_VISITS = int(os.getenv("GA_MIN_VISITS", "2"))
 DEFAULT_PROPERTY_ID = os.getenv("GA_PROPERTY_ID", "")
+# Fallback service-account key in the working directory: a .json whose name
+# mentions "service" or the project.
+SERVICE_KEY_RE = re.compile(r'(service|websitecountryspikes).*\.json$', re.IGNORECASE)
+# GA4 returns at most 100k rows per runReport call.
+REST_PAGE_SIZE = 100000
 
+# Dates, timezone and threshold are query parameters so the SQL text is the
+# same on every run; only the table path is formatted in.
 SQL_TEMPLATE = """
-DECLARE tz STRING DEFAULT '{tz}';
-
 WITH user_sessions AS (
   SELECT
     user_pseudo_id,
-    DATE(TIMESTAMP_MICROS(event_timestamp), tz) AS visit_date,
+    DATE(TIMESTAMP_MICROS(event_timestamp), @tz) AS visit_date,
     COUNT(DISTINCT CONCAT(
       CAST(user_pseudo_id AS STRING),
       CAST((SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS STRING)
     )) AS sessions_per_day
   FROM `{project}.{dataset}.events_*`
-  WHERE DATE(TIMESTAMP_MICROS(event_timestamp), tz) >= '{start_date}'
-    AND DATE(TIMESTAMP_MICROS(event_timestamp), tz) <= '{end_date}'
+  -- Shard pruning first (padded a day each side for timezone skew, plus the
+  -- intraday tables); the DATE() bounds below then trim the edge days exactly.
+  WHERE (
+      _TABLE_SUFFIX BETWEEN FORMAT_DATE('%Y%m%d', DATE_SUB(@start_date, INTERVAL 1 DAY))
+        AND FORMAT_DATE('%Y%m%d', DATE_ADD(@end_date, INTERVAL 1 DAY))
+      OR _TABLE_SUFFIX LIKE 'intraday_%'
+    )
+    AND DATE(TIMESTAMP_MICROS(event_timestamp), @tz) >= @start_date
+    AND DATE(TIMESTAMP_MICROS(event_timestamp), @tz) <= @end_date
   GROUP BY user_pseudo_id, visit_date
 ),
 
@@ -67,10 +102,19 @@ SELECT
   last_visit,
   days_between_first_last
 FROM user_visit_counts
-WHERE total_visits >= {min_visits}
+WHERE total_visits >= @min_visits
 ORDER BY total_visits DESC, total_sessions DESC;
 """
 
+def _visits_frame(dates, user_ids, sessions):
+    """Frame of (visit_date, user_id, sessions) from raw API columns, anonymous users dropped."""
+    df = pd.DataFrame({'visit_date': dates, 'user_id': user_ids, 'sessions': sessions})
+    # Skip rows with no userId (anonymous users) with one mask
+    df = df[df['user_id'].ne('') & df['user_id'].ne('(not set)')]
+    # Parse every date in one vectorized pass instead of per-row strptime
+    visit_date = pd.to_datetime(df['visit_date'], format="%Y%m%d", cache=True).dt.date
+    return df.assign(visit_date=visit_date).reset_index(drop=True)
+
 def query_ga4_api(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
     """Query GA4 Reporting API for repeat visitors using userId dimension."""
     try:
@@ -81,9 +125,7 @@ def query_ga4_api(property_id: str, start_date: str, end_date: str, service_acco
         print(f"gRPC method failed ({e}), trying REST API...")
     
     # Fall back to REST API
-    try:
-        import requests
-    except ImportError:
+    if not REQUESTS_AVAILABLE:
         raise ImportError("requests library required. Install with: pip install requests")
     return query_ga4_api_rest(property_id, start_date, end_date, service_account_key)
 
@@ -125,25 +167,13 @@ def query_ga4_api_grpc(property_id: str, start_date: str, end_date: str, service
         
         response = client.run_report(request)
         
-        rows = []
-        for row in response.rows:
-            date_str = row.dimension_values[0].value
-            user_id = row.dimension_values[1].value
-            sessions = int(row.metric_values[0].value)
-            
-            # Skip rows with no userId (anonymous users)
-            if not user_id or user_id == "(not set)":
-                continue
-            
-            date_obj = datetime.strptime(date_str, "%Y%m%d").date()
-            
-            rows.append({
-                'visit_date': date_obj,
-                'user_id': user_id,
-                'sessions': sessions,
-            })
-        
-        return pd.DataFrame(rows)
+        rows = list(response.rows)
+        dims = [row.dimension_values for row in rows]
+        return _visits_frame(
+            [d[0].value for d in dims],
+            [d[1].value for d in dims],
+            [int(row.metric_values[0].value) for row in rows],
+        )
     except Exception as e:
         error_str = str(e).lower()
         if 'userId' in error_str or 'not a valid dimension' in error_str:
@@ -155,37 +185,10 @@ def query_ga4_api_grpc(property_id: str, start_date: str, end_date: str, service
             )
         raise
 
-def query_ga4_api_rest(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
-    """Query GA4 Reporting API using REST API."""
-    import requests
-    from google.auth import default
-    from google.auth.transport.requests import Request as AuthRequest
-    from google.oauth2 import service_account
-    
-    # Use service account if provided, otherwise use ADC
-    if service_account_key:
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_key,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        credentials.refresh(AuthRequest())
-    else:
-        credentials, project = default(scopes=['https://www.googleapis.com/auth/analytics.readonly'])
-        if not credentials.valid or credentials.expired:
-            credentials.refresh(AuthRequest())
-    
-    url = f"https://analyticsdata.googleapis.com/v1beta/properties/{property_id}:runReport"
-    headers = {
-        'Authorization': f'Bearer {credentials.token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "dateRanges": [{"startDate": start_date, "endDate": end_date}],
-        "dimensions": [{"name": "date"}, {"name": "userId"}],
-        "metrics": [{"name": "sessions"}]
-    }
-    
-    response = requests.post(url, json=payload, headers=headers, timeout=60)
+def _fetch_rest_page(url: str, headers: dict, payload: dict, offset: int):
+    """POST one runReport page; returns (dates, user_ids, sessions, row_count)."""
+    page_payload = {**payload, "offset": offset, "limit": REST_PAGE_SIZE}
+    response = session.post(url, json=page_payload, headers=headers, timeout=60, stream=IJSON_AVAILABLE)
     
     if response.status_code == 400:
         error_data = response.json() if response.text else {}
@@ -199,42 +202,82 @@ def query_ga4_api_rest(property_id: str, start_date: str, end_date: str, service
             )
     
     response.raise_for_status()
+    
+    if IJSON_AVAILABLE:
+        # Pull values off the socket one at a time straight into three column
+        # lists; the full page is never held as a dict. rowCount follows the
+        # rows in the response, so it is picked up from the same event stream.
+        response.raw.decode_content = True
+        dates, user_ids, sessions = [], [], []
+        row_count = 0
+        for prefix, _, value in ijson.parse(response.raw):
+            if prefix == 'rows.item.dimensionValues.item.value':
+                # Two dimensions per row: date, then userId
+                (dates if len(dates) == len(user_ids) else user_ids).append(value)
+            elif prefix == 'rows.item.metricValues.item.value':
+                sessions.append(int(value))
+            elif prefix == 'rowCount':
+                row_count = int(value)
+        return dates, user_ids, sessions, row_count
+    
     data = response.json()
+    rows = data.get('rows', [])
+    return (
+        [row['dimensionValues'][0]['value'] for row in rows],
+        [row['dimensionValues'][1]['value'] for row in rows],
+        [int(row['metricValues'][0]['value']) for row in rows],
+        int(data.get('rowCount', len(rows))),
+    )
+
+def query_ga4_api_rest(property_id: str, start_date: str, end_date: str, service_account_key: str = None):
+    """Query GA4 Reporting API using REST API."""
+    # Use service account if provided, otherwise use ADC
+    credentials = get_credentials(service_account_key=service_account_key)
     
-    rows = []
-    for row in data.get('rows', []):
-        date_str = row['dimensionValues'][0]['value']
-        user_id = row['dimensionValues'][1]['value']
-        sessions = int(row['metricValues'][0]['value'])
-        
-        if not user_id or user_id == "(not set)":
-            continue
-        
-        date_obj = datetime.strptime(date_str, "%Y%m%d").date()
-        rows.append({
-            'visit_date': date_obj,
-            'user_id': user_id,
-            'sessions': sessions,
-        })
+    url = f"https://analyticsdata.googleapis.com/v1beta/properties/{property_id}:runReport"
+    headers = {
+        'Authorization': f'Bearer {credentials.token}',
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        "dateRanges": [{"startDate": start_date, "endDate": end_date}],
+        "dimensions": [{"name": "date"}, {"name": "userId"}],
+        "metrics": [{"name": "sessions"}]
+    }
     
-    return pd.DataFrame(rows)
+    # The first page reports the total row count; any further pages are
+    # requested concurrently over the pooled session.
+    dates, user_ids, sessions, row_count = _fetch_rest_page(url, headers, payload, 0)
+    offsets = range(REST_PAGE_SIZE, row_count, REST_PAGE_SIZE)
+    if offsets:
+        with ThreadPoolExecutor(max_workers=min(len(offsets), 4)) as executor:
+            for page in executor.map(lambda offset: _fetch_rest_page(url, headers, payload, offset), offsets):
+                dates.extend(page[0])
+                user_ids.extend(page[1])
+                sessions.extend(page[2])
+    return _visits_frame(dates, user_ids, sessions)
 
 def process_api_data(df: pd.DataFrame, min_visits: int):
     """Process API data to calculate repeat visitor statistics."""
     if df.empty:
         return df
     
-    # Group by user_id to calculate visit counts
-    user_stats = df.groupby('user_id').agg({
-        'visit_date': ['min', 'max', 'nunique'],
-        'sessions': 'sum'
-    }).reset_index()
+    # Group by user_id to calculate visit counts; named aggregations give flat
+    # columns directly, and the final sort makes a sorted groupby unnecessary
+    user_stats = df.groupby('user_id', sort=False).agg(
+        first_visit=('visit_date', 'min'),
+        last_visit=('visit_date', 'max'),
+        total_visits=('visit_date', 'nunique'),
+        total_sessions=('sessions', 'sum'),
+    ).reset_index()
     
-    user_stats.columns = ['user_id', 'first_visit', 'last_visit', 'total_visits', 'total_sessions']
-    user_stats['days_between_first_last'] = (user_stats['last_visit'] - user_stats['first_visit']).dt.days
-    
-    # Filter by minimum visits
+    # Filter by minimum visits before any per-user date math
     user_stats = user_stats[user_stats['total_visits'] >= min_visits]
+    # visit_date holds datetime.date objects; day-resolution datetime64 turns the
+    # gap into one integer subtraction
+    last_visit = user_stats['last_visit'].to_numpy().astype('datetime64[D]')
+    first_visit = user_stats['first_visit'].to_numpy().astype('datetime64[D]')
+    user_stats = user_stats.assign(days_between_first_last=(last_visit - first_visit).astype('int64'))
     user_stats = user_stats.sort_values(['total_visits', 'total_sessions'], ascending=[False, False])
     
     return user_stats
@@ -252,16 +295,42 @@ def build_parser():
     p.add_argument("--min-visits", type=int, default=DEFAULT_MIN_VISITS, 
                    help="Minimum number of visits to include (default: 2)")
     p.add_argument("--service-account-key", help="Path to service account JSON key file (for API access)")
+    p.add_argument("--bq-streams", type=int, default=DEFAULT_BQ_STREAMS,
+                   help=f"Maximum BigQuery Storage read streams (default {DEFAULT_BQ_STREAMS})")
     return p
 
-def run_query(client: bigquery.Client, sql: str):
-    job = client.query(sql)
-    return job.result().to_dataframe(create_bqstorage_client=True)
 
-def save_results(df: pd.DataFrame, prefix="repeat_visitors"):
-    ts = datetime.now(timezone.utc).astimezone().strftime("%Y%m%d_%H%M%S")
+def _to_frame(rows, bq_streams: int) -> pd.DataFrame:
+    if not PYARROW_AVAILABLE:
+        return rows.to_dataframe()
+    # Converted to NumPy-backed columns (NULLs come back as None, as with
+    # to_dataframe); self_destruct releases each Arrow column once converted.
+    return read_arrow(rows, bq_streams).to_pandas(self_destruct=True, split_blocks=True)
+
+def query_params(tz: str, start_date, end_date, min_visits: int) -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("tz", "STRING", tz),
+            bigquery.ScalarQueryParameter("start_date", "DATE", start_date),
+            bigquery.ScalarQueryParameter("end_date", "DATE", end_date),
+            bigquery.ScalarQueryParameter("min_visits", "INT64", min_visits),
+        ],
+        use_query_cache=True,
+        priority=bigquery.QueryPriority.INTERACTIVE,
+    )
+
+def run_query(client: bigquery.Client, sql: str, job_config: bigquery.QueryJobConfig = None,
+              bq_streams: int = DEFAULT_BQ_STREAMS):
+    # query_and_wait returns small results in the first page, and the Arrow
+    # batch reader then skips the storage read session; larger ones fan out
+    # over at most bq_streams streams.
+    rows = client.query_and_wait(sql, job_config=job_config)
+    return _to_frame(rows, bq_streams)
+
+def save_results(df: pd.DataFrame = None, prefix="repeat_visitors", ts: str = None):
+    ts = ts or output_timestamp()
     
-    if df.empty:
+    if df is None or df.empty:
         # Create empty files with headers
         csv_path = f"{prefix}_{ts}.csv"
         txt_path = f"{prefix}_{ts}.txt"
@@ -278,17 +347,23 @@ def save_results(df: pd.DataFrame, prefix="repeat_visitors"):
     # Save text file
     txt_path = f"{prefix}_{ts}.txt"
     user_id_col = 'user_id' if 'user_id' in df.columns else 'user_pseudo_id'
+    # Plain tuples in column order; no per-row Series as with iterrows(). The
+    # header and rows are joined in memory and written in one call.
+    rows = df[[user_id_col, 'total_visits', 'total_sessions', 'first_visit', 'last_visit', 'days_between_first_last']]
+    parts = [f"{user_id_col}\ttotal_visits\ttotal_sessions\tfirst_visit\tlast_visit\tdays_between\n"]
+    parts.extend(
+        f"{user_id or ''}\t{visits}\t{sessions}\t{first}\t{last}\t{days}\n"
+        for user_id, visits, sessions, first, last, days in rows.itertuples(index=False, name=None)
+    )
     with open(txt_path, 'w', encoding='utf-8') as f:
-        f.write(f"{user_id_col}\ttotal_visits\ttotal_sessions\tfirst_visit\tlast_visit\tdays_between\n")
-        for _, row in df.iterrows():
-            user_id = row.get('user_id') or row.get('user_pseudo_id', '')
-            f.write(f"{user_id}\t{row['total_visits']}\t{row['total_sessions']}\t"
-                   f"{row['first_visit']}\t{row['last_visit']}\t{row['days_between_first_last']}\n")
+        f.write("".join(parts))
     
     return csv_path, txt_path
 
 def main():
     args = build_parser().parse_args()
+    # One timestamp per run, shared by every output file
+    ts = output_timestamp()
     
     # Calculate date range
     if args.end_date:
@@ -319,7 +394,7 @@ def main():
         
         # Try to find service account key in current directory
         if not service_account_key:
-            potential_keys = [f for f in os.listdir('.') if f.endswith('.json') and 'service' in f.lower() or 'websitecountryspikes' in f.lower()]
+            potential_keys = [f for f in glob.glob('*.json') if SERVICE_KEY_RE.search(f)]
             if potential_keys:
                 service_account_key = potential_keys[0]
                 print(f"Using service account key: {service_account_key}")
@@ -338,19 +413,16 @@ def main():
     
     if not args.use_api:
         # Use BigQuery
-        client = bigquery.Client(project=args.project)
+        client = bq_client(args.project)
         
         sql = SQL_TEMPLATE.format(
-            tz=args.timezone,
             project=args.project,
             dataset=args.dataset,
-            start_date=start_date.strftime("%Y-%m-%d"),
-            end_date=end_date.strftime("%Y-%m-%d"),
-            min_visits=args.min_visits,
         )
+        job_config = query_params(args.timezone, start_date, end_date, args.min_visits)
         
         print(f"Querying BigQuery from {start_date} to {end_date}...")
-        df = run_query(client, sql)
+        df = run_query(client, sql, job_config, args.bq_streams)
     
     if df is None or df.empty:
         print(f"\nNo users found with {args.min_visits} or more visits in this period.")
@@ -367,7 +439,7 @@ def main():
         print("\nTop 20 repeat visitors:")
         print(df.head(20).to_string(index=False))
     
-    csv_path, txt_path = save_results(df if df is not None and not df.empty else pd.DataFrame())
+    csv_path, txt_path = save_results(df, ts=ts)
     print(f"\nSaved CSV → {csv_path}")
     print(f"Saved TXT → {txt_path}")
 
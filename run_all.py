@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Query Suite Runner
+
+Runs every module in Queries/ concurrently and prints each module's output once
+it finishes. Arguments for each query come from webapp/query_config.json (the
+same defaults the web app uses); modules without an entry run with their own
+defaults.
+
+Each query is dispatched with asyncio.gather + run_in_executor so the GA4 and
+BigQuery round-trips overlap and the suite takes roughly as long as the slowest
+query. Workers are separate processes because the query modules print to stdout
+and draw charts through pyplot's global state, neither of which is safe to share
+between threads.
+
+Usage:
+  python run_all.py
+  python run_all.py --only category_performance,hidden_gem_recipes
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import runpy
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+QUERY_DIR = PROJECT_ROOT / "Queries"
+CONFIG_PATH = PROJECT_ROOT / "webapp" / "query_config.json"
+# Libraries most query modules import; pooled workers load them once so each
+# job only pays for its own module.
+PREIMPORT_MODULES = (
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "matplotlib.pyplot",
+    "google.cloud.bigquery",
+    "google.analytics.data_v1beta",
+)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run all query modules concurrently")
+    parser.add_argument("--only", help="Comma-separated query identifiers to run (default: all)")
+    parser.add_argument("--config", default=str(CONFIG_PATH), help="JSON map of query identifier to CLI arguments")
+    parser.add_argument("--max-workers", type=int, help="Maximum concurrent queries (default: one per query)")
+    return parser
+
+
+def load_config(path: str) -> dict[str, list[str]]:
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {key: [str(item) for item in value] for key, value in data.items() if isinstance(value, list)}
+
+
+def _add_script_dir(path: Path) -> None:
+    # As `python script.py` does, so a query can import its sibling helpers.
+    script_dir = str(path.resolve().parent)
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+
+
+def run_module(script_path: str, argv: list[str]) -> tuple[str, str | None]:
+    """Import a query module by path and call its run(); returns (output, error)."""
+    path = Path(script_path)
+    _add_script_dir(path)
+    buffer = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(buffer):
+        try:
+            spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.run(module.build_parser().parse_args(argv))
+        except SystemExit as exc:
+            if exc.code:
+                error = f"exited with code {exc.code}"
+        except Exception:
+            error = traceback.format_exc()
+    return buffer.getvalue(), error
+
+
+def preimport() -> None:
+    """Process pool initializer: warm the shared imports and match the CLI's cwd."""
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    os.chdir(PROJECT_ROOT)
+    for name in PREIMPORT_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def run_script(script_path: str, argv: list[str], stdout_path: str, stderr_path: str) -> int:
+    """Run a query script as __main__ with its output sent to the given files; returns the exit code."""
+    saved_argv = sys.argv
+    _add_script_dir(Path(script_path))
+    with open(stdout_path, "w", encoding="utf-8", buffering=1) as out, \
+            open(stderr_path, "w", encoding="utf-8", buffering=1) as err, \
+            contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        sys.argv = [script_path, *argv]
+        try:
+            runpy.run_path(script_path, run_name="__main__")
+        except SystemExit as exc:
+            if exc.code is None or isinstance(exc.code, int):
+                return exc.code or 0
+            print(exc.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.argv = saved_argv
+            # Workers are reused, so figures a script left open must not pile up.
+            pyplot = sys.modules.get("matplotlib.pyplot")
+            if pyplot is not None:
+                pyplot.close("all")
+    return 0
+
+
+async def run_all(scripts: list[Path], config: dict[str, list[str]], max_workers: int | None):
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=max_workers or len(scripts)) as executor:
+        tasks = [
+            loop.run_in_executor(executor, run_module, str(script), config.get(script.stem, []))
+            for script in scripts
+        ]
+        return await asyncio.gather(*tasks)
+
+
+def main():
+    args = build_parser().parse_args()
+
+    # Underscore-prefixed modules (e.g. _ga4_reports.py) are shared helpers, not queries.
+    scripts = sorted(script for script in QUERY_DIR.glob("*.py") if not script.name.startswith("_"))
+    if args.only:
+        wanted = {name.strip() for name in args.only.split(",") if name.strip()}
+        scripts = [script for script in scripts if script.stem in wanted]
+    if not scripts:
+        print("No query modules to run.")
+        return
+
+    # Workers inherit this, so matplotlib never probes for a GUI backend.
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    config = load_config(args.config)
+
+    print(f"Running {len(scripts)} queries…")
+    results = asyncio.run(run_all(scripts, config, args.max_workers))
+
+    failures = 0
+    for script, (output, error) in zip(scripts, results):
+        print("\n" + "=" * 80)
+        print(script.stem)
+        print("=" * 80)
+        if output:
+            print(output, end="" if output.endswith("\n") else "\n")
+        if error:
+            failures += 1
+            print(f"ERROR: {error}")
+
+    print(f"\nFinished {len(scripts)} queries ({failures} failed).")
+
+
+if __name__ == "__main__":
+    main()
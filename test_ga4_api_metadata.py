@@ -11,6 +11,19 @@ from google.oauth2 import service_account
 PROPERTY_ID = "427048881"
 SERVICE_ACCOUNT_KEY = "websitecountryspikes-c44a6b026c7b.json"
 
+# Category keywords in precedence order; the first match wins.
+DIMENSION_BUCKETS = (('user',), ('session',), ('country', 'city', 'region', 'continent'))
+METRIC_BUCKETS = (('user',), ('session',), ('event',))
+
+def bucket_fields(fields, buckets):
+    """Split fields into one list per bucket plus a trailing list for the rest, in one pass."""
+    groups = [[] for _ in range(len(buckets) + 1)]
+    for field in fields:
+        name = field.api_name.lower()
+        index = next((i for i, keywords in enumerate(buckets) if any(k in name for k in keywords)), len(buckets))
+        groups[index].append(field)
+    return groups
+
 def get_metadata():
     """Get metadata for available dimensions and metrics."""
     
@@ -31,20 +44,7 @@ def get_metadata():
     print("GA4 DATA API - AVAILABLE DIMENSIONS")
     print("="*80)
     
-    user_related = []
-    session_related = []
-    geo_related = []
-    other_dims = []
-    
-    for dimension in metadata.dimensions:
-        if 'user' in dimension.api_name.lower():
-            user_related.append(dimension)
-        elif 'session' in dimension.api_name.lower():
-            session_related.append(dimension)
-        elif any(x in dimension.api_name.lower() for x in ['country', 'city', 'region', 'continent']):
-            geo_related.append(dimension)
-        else:
-            other_dims.append(dimension)
+    user_related, session_related, geo_related, other_dims = bucket_fields(metadata.dimensions, DIMENSION_BUCKETS)
     
     print(f"\n{'USER-RELATED DIMENSIONS:':<50} (Count: {len(user_related)})")
     print("-"*80)
@@ -65,20 +65,7 @@ def get_metadata():
     print("GA4 DATA API - AVAILABLE METRICS")
     print("="*80)
     
-    user_metrics = []
-    session_metrics = []
-    event_metrics = []
-    other_metrics = []
-    
-    for metric in metadata.metrics:
-        if 'user' in metric.api_name.lower():
-            user_metrics.append(metric)
-        elif 'session' in metric.api_name.lower():
-            session_metrics.append(metric)
-        elif 'event' in metric.api_name.lower():
-            event_metrics.append(metric)
-        else:
-            other_metrics.append(metric)
+    user_metrics, session_metrics, event_metrics, other_metrics = bucket_fields(metadata.metrics, METRIC_BUCKETS)
     
     print(f"\n{'USER-RELATED METRICS:':<50} (Count: {len(user_metrics)})")
     print("-"*80)
@@ -107,14 +94,17 @@ def get_metadata():
     user_id_fields = ['userId', 'user_id', 'userPseudoId', 'user_pseudo_id', 'clientId', 'client_id']
     found_fields = []
     
+    # Index the dimensions by lowercased name once (first one wins, as the
+    # original scan did) so each field is a dict lookup
+    dims_by_name = {}
+    for dim in metadata.dimensions:
+        dims_by_name.setdefault(dim.api_name.lower(), dim)
+    
     for field_name in user_id_fields:
-        found = False
-        for dim in metadata.dimensions:
-            if field_name.lower() == dim.api_name.lower():
-                found_fields.append(f"✅ Found: {dim.api_name} ({dim.ui_name})")
-                found = True
-                break
-        if not found:
+        dim = dims_by_name.get(field_name.lower())
+        if dim is not None:
+            found_fields.append(f"✅ Found: {dim.api_name} ({dim.ui_name})")
+        else:
             found_fields.append(f"❌ Not found: {field_name}")
     
     for result in found_fields:
@@ -17,7 +17,8 @@ Outputs:
   2. Bar chart (PNG) showing overall user counts per bucket
 
 Requirements:
-  - google-cloud-bigquery
+  - google-cloud-bigquery>=3.29, google-cloud-bigquery-storage
+  - pyarrow
   - pandas
   - matplotlib
 
@@ -31,12 +32,14 @@ Usage:
 """
 
 import argparse
+import hashlib
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from pathlib import Path
 
 import pandas as pd
-from google.cloud import bigquery
-import matplotlib.pyplot as plt
+
+from bq_utils import DEFAULT_BQ_STREAMS, bq_client, output_timestamp, read_arrow
 
 # Duration buckets in minutes (upper bounds)
 BUCKETS = [
@@ -47,10 +50,22 @@ BUCKETS = [
     (10, 30, "10-30 min"),
     (30, None, "30+ min"),
 ]
+BUCKET_LABELS = tuple(label for _, _, label in BUCKETS)
+# Left-closed CASE branches derived from BUCKETS, compared on the integer
+# millisecond totals; values outside every bucket map to NULL and drop out.
+BUCKET_CASE_SQL = "\n".join(
+    f"WHEN engagement_time_msec >= {lower * 60_000} THEN '{label}'"
+    if upper is None
+    else f"WHEN engagement_time_msec >= {lower * 60_000} AND engagement_time_msec < {upper * 60_000} THEN '{label}'"
+    for lower, upper, label in BUCKETS
+)
 
 DEFAULT_PROJECT = os.getenv("GCP_PROJECT", "websitecountryspikes")
 DEFAULT_DATASET = os.getenv("GA_DATASET_ID", "analytics_427048881")
 DEFAULT_TZ = os.getenv("GA_TZ", "America/Los_Angeles")
+CACHE_DIR = Path(os.getenv("GA4_BQ_CACHE_DIR", str(Path.home() / ".cache" / "ga4_bq")))
+# The export keeps revising the most recent ~48h; only ranges older than that are cached.
+CACHE_SETTLE = timedelta(hours=48)
 
 
 def build_parser():
@@ -61,13 +76,20 @@ def build_parser():
     parser.add_argument("--start-date", default="2025-11-02", help="Start date (YYYY-MM-DD)")
     parser.add_argument("--end-date", default="2025-11-06", help="End date (YYYY-MM-DD)")
     parser.add_argument("--prefix", default="user_time_buckets", help="Prefix for output files")
+    parser.add_argument("--bq-streams", type=int, default=DEFAULT_BQ_STREAMS,
+                        help=f"Maximum BigQuery Storage read streams (default {DEFAULT_BQ_STREAMS})")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached BigQuery results and re-query")
     return parser
 
 
-def run_query(project: str, dataset: str, timezone: str, start_date: str, end_date: str) -> pd.DataFrame:
-    """Run BigQuery to get daily engagement time per user."""
-    client = bigquery.Client(project=project)
+def run_query(project: str, dataset: str, timezone: str, start_date: str, end_date: str,
+              bq_streams: int = DEFAULT_BQ_STREAMS, refresh: bool = False) -> pd.DataFrame:
+    """Run BigQuery to get per-day user counts for each engagement bucket.
 
+    Results for settled date ranges are kept as parquet under CACHE_DIR, keyed
+    by the query text, and reused by later runs.
+    """
+    bucket_case = BUCKET_CASE_SQL.replace("\n", "\n          ")
     query = f"""
     DECLARE tz STRING DEFAULT '{timezone}';
 
@@ -85,105 +107,118 @@ def run_query(project: str, dataset: str, timezone: str, start_date: str, end_da
       WHERE _TABLE_SUFFIX BETWEEN REPLACE('{start_date}', '-', '') AND REPLACE('{end_date}', '-', '')
         AND event_name = 'user_engagement'
       GROUP BY visit_date, user_pseudo_id
+    ),
+
+    bucketed AS (
+      SELECT
+        visit_date,
+        CASE
+          {bucket_case}
+        END AS bucket
+      FROM user_daily_engagement
     )
 
-    SELECT
-      visit_date,
-      user_pseudo_id,
-      engagement_time_msec / 1000.0 / 60.0 AS engagement_minutes
-    FROM user_daily_engagement
+    -- user_daily_engagement has one row per user per day, so COUNT(*) is the
+    -- number of distinct users in each bucket.
+    SELECT visit_date, bucket, COUNT(*) AS user_count
+    FROM bucketed
+    WHERE bucket IS NOT NULL
+    GROUP BY visit_date, bucket
     """
 
-    job = client.query(query)
-    df = job.result().to_dataframe(create_bqstorage_client=True)
+    settled = datetime.now() - datetime.strptime(end_date, "%Y-%m-%d") >= CACHE_SETTLE + timedelta(days=1)
+    if not settled:
+        return _fetch(project, query, bq_streams)
+
+    key = hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest()
+    cache_path = CACHE_DIR / f"{key}.parquet"
+    if not refresh:
+        try:
+            return pd.read_parquet(cache_path)
+        except (OSError, ValueError, ImportError):
+            pass
+
+    df = _fetch(project, query, bq_streams)
+    # Written beside the final path and renamed into place, so a job in another
+    # process never reads a half-written file.
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError, ImportError):
+        tmp_path.unlink(missing_ok=True)
     return df
 
 
-def assign_bucket(minutes: float) -> str:
-    for lower, upper, label in BUCKETS:
-        if upper is None:
-            if minutes >= lower:
-                return label
-        else:
-            if lower <= minutes < upper:
-                return label
-    # Fallback
-    return "Unknown"
+def _fetch(project: str, query: str, bq_streams: int) -> pd.DataFrame:
+    rows = bq_client(project).query(query).result()
+    # self_destruct releases each Arrow column once it has been converted.
+    return read_arrow(rows, bq_streams).to_pandas(self_destruct=True, split_blocks=True)
 
 
-def bucketize(df: pd.DataFrame) -> pd.DataFrame:
+def bucketize(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """Return the date x bucket user-count matrix and the per-bucket totals."""
     if df.empty:
-        return pd.DataFrame(columns=["visit_date", "bucket", "user_count"])
-
-    df = df.copy()
-    df["bucket"] = df["engagement_minutes"].apply(assign_bucket)
-
-    # Count users per date per bucket
-    grouped = (
-        df.groupby(["visit_date", "bucket"])
-        ["user_pseudo_id"].nunique()
-        .reset_index()
-        .rename(columns={"user_pseudo_id": "user_count"})
-    )
-
-    # Ensure all buckets exist for each date
-    all_dates = sorted(df["visit_date"].unique())
-    bucket_labels = [label for _, _, label in BUCKETS]
-    complete_index = pd.MultiIndex.from_product([all_dates, bucket_labels], names=["visit_date", "bucket"])
-    grouped = grouped.set_index(["visit_date", "bucket"]).reindex(complete_index, fill_value=0).reset_index()
-
-    return grouped
-
-
-def save_text_report(grouped: pd.DataFrame, prefix: str) -> str:
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        pivot = pd.DataFrame(columns=list(BUCKET_LABELS), dtype="int64")
+    else:
+        # Every bucket gets a column and missing (date, bucket) pairs count zero
+        pivot = (
+            df.pivot(index="visit_date", columns="bucket", values="user_count")
+            .reindex(columns=BUCKET_LABELS)
+            .fillna(0)
+            .astype("int64")
+            .sort_index()
+        )
+    totals = pivot.sum(axis=0)
+    return pivot, totals
+
+
+def save_text_report(pivot: pd.DataFrame, totals: pd.Series, prefix: str, ts: str | None = None) -> str:
+    ts = ts or output_timestamp()
     path = f"{prefix}_{ts}.txt"
 
-    bucket_labels = [label for _, _, label in BUCKETS]
+    # The report is assembled in memory and written in one call; counts come
+    # out of the matrix as plain ints in a single tolist().
+    parts = ["User Time Buckets (counts of unique users per day)\n", "=" * 60 + "\n\n"]
+    for visit_date, counts in zip(pivot.index, pivot.to_numpy().tolist()):
+        parts.append(f"Date: {visit_date}\n")
+        parts.extend(f"  {label:<8}: {int(count)}\n" for label, count in zip(BUCKET_LABELS, counts))
+        parts.append("\n")
+
+    parts.append("Overall totals:\n")
+    parts.extend(f"  {label:<8}: {int(total)}\n" for label, total in zip(BUCKET_LABELS, totals.tolist()))
 
     with open(path, "w", encoding="utf-8") as f:
-        f.write("User Time Buckets (counts of unique users per day)\n")
-        f.write("=" * 60 + "\n\n")
-
-        for visit_date in sorted(grouped["visit_date"].unique()):
-            f.write(f"Date: {visit_date}\n")
-            df_date = grouped[grouped["visit_date"] == visit_date]
-            for label in bucket_labels:
-                count = int(df_date[df_date["bucket"] == label]["user_count"].values[0])
-                f.write(f"  {label:<8}: {count}\n")
-            f.write("\n")
-
-        f.write("Overall totals:\n")
-        totals = grouped.groupby("bucket")["user_count"].sum()
-        for label in bucket_labels:
-            f.write(f"  {label:<8}: {int(totals.get(label, 0))}\n")
+        f.write("".join(parts))
     return path
 
 
-def save_bar_chart(grouped: pd.DataFrame, prefix: str) -> str:
-    if grouped.empty:
+def save_bar_chart(totals: pd.Series, prefix: str, ts: str | None = None) -> str:
+    if not totals.any():
         print("No data available to plot.")
         return ""
 
-    totals = grouped.groupby("bucket")["user_count"].sum().reindex([label for _, _, label in BUCKETS], fill_value=0)
+    # A plain Agg Figure, without pyplot's global state; the script draws one
+    # chart per run, so there is no figure worth keeping between calls.
+    import matplotlib
 
-    plt.figure(figsize=(10, 6))
-    bars = plt.bar(totals.index, totals.values, color="#4F81BD")
-    plt.title("Users by Time-on-Site Buckets")
-    plt.xlabel("Time Spent on Site (per day)")
-    plt.ylabel("Unique Users")
-    plt.grid(axis="y", linestyle="--", alpha=0.5)
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
 
-    max_height = totals.values.max() if len(totals.values) > 0 else 0
-    for bar in bars:
-        height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width() / 2, height + max_height * 0.01, f"{int(height)}", ha="center", va="bottom")
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot(111)
+    bars = ax.bar(totals.index, totals.values, color="#4F81BD")
+    ax.set_title("Users by Time-on-Site Buckets")
+    ax.set_xlabel("Time Spent on Site (per day)")
+    ax.set_ylabel("Unique Users")
+    ax.grid(axis="y", linestyle="--", alpha=0.5)
+    ax.bar_label(bars, labels=[str(int(value)) for value in totals.tolist()], padding=3)
 
-    plt.tight_layout()
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    fig.tight_layout()
+    ts = ts or output_timestamp()
     path = f"{prefix}_{ts}.png"
-    plt.savefig(path)
-    plt.close()
+    fig.savefig(path)
     return path
 
 
@@ -192,18 +227,21 @@ def main():
     args = parser.parse_args()
 
     print(f"Querying BigQuery for {args.start_date} to {args.end_date}...")
-    df = run_query(args.project, args.dataset, args.timezone, args.start_date, args.end_date)
+    df = run_query(args.project, args.dataset, args.timezone, args.start_date, args.end_date,
+                   args.bq_streams, args.refresh)
 
     if df.empty:
         print("No engagement data found for the specified date range.")
         return
 
-    grouped = bucketize(df)
+    pivot, totals = bucketize(df)
 
-    txt_path = save_text_report(grouped, args.prefix)
+    # One timestamp for both outputs so the report and chart pair up by name.
+    ts = output_timestamp()
+    txt_path = save_text_report(pivot, totals, args.prefix, ts)
     print(f"\nSaved text report to {txt_path}")
 
-    chart_path = save_bar_chart(grouped, args.prefix)
+    chart_path = save_bar_chart(totals, args.prefix, ts)
     if chart_path:
         print(f"Saved bar chart to {chart_path}")
 
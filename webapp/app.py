@@ -2,18 +2,37 @@ from __future__ import annotations
 
 import ast
 import json
+import multiprocessing
 import os
 import re
 import subprocess
 import sys
 import threading
 import uuid
-from dataclasses import dataclass
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+from datetime import date, datetime
 from pathlib import Path
-from typing import Any, Dict, List
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Sequence
 
 from flask import Flask, abort, jsonify, render_template, request, send_file, url_for
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -21,14 +40,35 @@ PROJECT_ROOT = BASE_DIR.parent
 QUERY_DIR = PROJECT_ROOT / "Queries"
 CONFIG_PATH = BASE_DIR / "query_config.json"
 OUTPUT_DIR = PROJECT_ROOT / "outputs"
+_PROJECT_ROOT_STR = str(PROJECT_ROOT)
+_PROJECT_ROOT_PREFIX = os.path.join(_PROJECT_ROOT_STR, "")
 
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".svg"}
 DATA_EXTENSIONS = {".csv", ".txt", ".tsv", ".json", ".parquet"}
-FILE_PATTERN = re.compile(r"(?P<path>[^\s\"']+\.(?:png|jpg|jpeg|svg|csv|txt|tsv|json|parquet))", re.IGNORECASE)
-DATE_INPUT_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m-%d-%Y")
+OUTPUT_EXTENSIONS = IMAGE_EXTENSIONS | DATA_EXTENSIONS
+# Scripts report the files they wrote at the end of their run, so only the
+# tail of each stream is searched for output paths.
+OUTPUT_SCAN_CHARS = 64 * 1024
+# Job output is streamed to log files under OUTPUT_DIR; the last
+# OUTPUT_SCAN_CHARS of each are republished every LOG_PUBLISH_INTERVAL seconds.
+LOG_PUBLISH_INTERVAL = 1.0
+QUERY_WORKERS = int(os.environ.get("QUERY_WORKERS", "4"))
+# Accepted date inputs: YYYY-MM-DD, MM/DD/YYYY and MM-DD-YYYY, in one pattern.
+_DATE_INPUT_RE = re.compile(
+    r"(?:(?P<y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})"
+    r"|(?P<m2>\d{1,2})(?P<sep>[/-])(?P<d2>\d{1,2})(?P=sep)(?P<y2>\d{4}))"
+)
+_SAFE_QUERY_RE = re.compile(r"[^A-Za-z0-9_-]+")
+# Query metadata sits at the top of each script, so discovery scans only the
+# head of the file; ast.parse is the fallback when QUERY_NAME is not found there.
+METADATA_HEAD_BYTES = 8192
+_DOCSTRING_RE = re.compile(r'\A(?:[ \t]*(?:#[^\n]*)?\n)*[ \t]*[rRuU]?("""|\'\'\')(.*?)\1', re.S)
+_QUERY_NAME_RE = re.compile(r'^QUERY_NAME\s*=\s*(["\'])([^"\'\\\n]+)\1\s*(?:#.*)?$', re.M)
+
+import run_all
 
 try:
     from generate_query_module import create_module_code, infer_chart, infer_name, slugify
@@ -39,30 +79,34 @@ except ImportError:  # pragma: no cover
 def normalize_date_input(value: str | None) -> str | None:
     if not value or not isinstance(value, str):
         return None
-    text = value.strip()
-    if not text:
+    match = _DATE_INPUT_RE.fullmatch(value.strip())
+    if not match:
+        return None
+    if match["y"]:
+        year, month, day = int(match["y"]), int(match["m"]), int(match["d"])
+    else:
+        year, month, day = int(match["y2"]), int(match["m2"]), int(match["d2"])
+    try:
+        # date() rejects impossible days (Feb 30) just as strptime did.
+        return date(year, month, day).isoformat()
+    except ValueError:
         return None
-    for pattern in DATE_INPUT_FORMATS:
-        try:
-            parsed = datetime.strptime(text, pattern)
-            return parsed.strftime("%Y-%m-%d")
-        except ValueError:
-            continue
-    return None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class QueryDefinition:
     identifier: str
     title: str
     file_path: Path
     summary: str | None = None
+    # Filesystem-safe form of identifier for job log names, fixed at discovery.
+    safe_slug: str = "query"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class JobResult:
     chart_path: Path | None
-    data_files: list[Path]
+    data_files: tuple[Path, ...]
     stdout: str
     stderr: str
 
@@ -75,71 +119,179 @@ class JobStatus:
 
 
 class JobManager:
+    # Jobs are stored as read-only snapshots that updates replace wholesale, so
+    # status polls read them without locking or copying. Each job has its own
+    # lock for writers; the shared lock only guards inserting new jobs.
     def __init__(self) -> None:
-        self._jobs: Dict[str, Dict[str, Any]] = {}
-        self._lock = threading.Lock()
+        self._jobs: Dict[str, Mapping[str, Any]] = {}
+        self._job_locks: Dict[str, threading.Lock] = {}
+        self._insert_lock = threading.Lock()
 
-    def create_job(self, query: QueryDefinition) -> Dict[str, Any]:
+    def create_job(self, query: QueryDefinition) -> Mapping[str, Any]:
         job_id = uuid.uuid4().hex
-        with self._lock:
-            self._jobs[job_id] = {
-                "id": job_id,
-                "query": query.identifier,
-                "title": query.title,
-                "status": JobStatus.QUEUED,
-                "createdAt": datetime.utcnow().isoformat() + "Z",
-                "updatedAt": datetime.utcnow().isoformat() + "Z",
-                "stdout": "",
-                "stderr": "",
-                "chartPath": None,
-                "dataFiles": [],
-                "error": None,
-                "parameters": {},
-            }
-        return self._jobs[job_id]
+        now = datetime.utcnow().isoformat() + "Z"
+        job = MappingProxyType({
+            "id": job_id,
+            "query": query.identifier,
+            "title": query.title,
+            "status": JobStatus.QUEUED,
+            "createdAt": now,
+            "updatedAt": now,
+            "stdout": "",
+            "stderr": "",
+            "chartPath": None,
+            "dataFiles": (),
+            "error": None,
+            "parameters": {},
+        })
+        with self._insert_lock:
+            self._job_locks[job_id] = threading.Lock()
+            self._jobs[job_id] = job
+        return job
 
     def update_job(self, job_id: str, **changes: Any) -> None:
-        with self._lock:
-            job = self._jobs.get(job_id)
-            if not job:
-                return
-            job.update(changes)
-            job["updatedAt"] = datetime.utcnow().isoformat() + "Z"
-
-    def get_job(self, job_id: str) -> Dict[str, Any] | None:
-        with self._lock:
-            job = self._jobs.get(job_id)
-            return dict(job) if job else None
-
-    def set_result(self, job_id: str, result: JobResult) -> None:
+        lock = self._job_locks.get(job_id)
+        if lock is None:
+            return
+        with lock:
+            self._jobs[job_id] = MappingProxyType({
+                **self._jobs[job_id],
+                **changes,
+                "updatedAt": datetime.utcnow().isoformat() + "Z",
+            })
+
+    def get_job(self, job_id: str) -> Mapping[str, Any] | None:
+        return self._jobs.get(job_id)
+
+    def set_result(self, job_id: str, result: JobResult, **changes: Any) -> None:
+        # Extra changes (the final status) land in the same snapshot, so a
+        # finished job is published, copied and timestamped once.
         payload = {
             "stdout": result.stdout,
             "stderr": result.stderr,
             "chartPath": str(result.chart_path) if result.chart_path else None,
-            "dataFiles": [str(path) for path in result.data_files],
+            "dataFiles": tuple(str(path) for path in result.data_files),
         }
-        self.update_job(job_id, **payload)
+        self.update_job(job_id, **payload, **changes)
 
 
 job_manager = JobManager()
 
+_query_pool: ProcessPoolExecutor | None = None
+_query_pool_lock = threading.Lock()
+
+# Parsed metadata per script, reused while the file's (mtime_ns, size) is
+# unchanged, so requests only re-read and re-parse scripts that were edited.
+# _QUERY_INDEX maps identifiers to the same definitions and is rebuilt only
+# when a discovery pass sees a script added, edited or removed.
+_QUERY_CACHE: Dict[Path, tuple[tuple[int, int], QueryDefinition]] = {}
+_QUERY_INDEX: Dict[str, QueryDefinition] = {}
+_query_cache_lock = threading.Lock()
+# With a watchdog observer running, discovery results stand until Queries/
+# reports a change, so requests in between skip even the scandir/stat pass.
+# Without one the flag stays set and every call rescans.
+_QUERY_LIST: list[QueryDefinition] = []
+_query_dir_watched = False
+_query_dir_dirty = threading.Event()
+_query_dir_dirty.set()
+
 
 def discover_queries() -> list[QueryDefinition]:
+    global _QUERY_INDEX, _QUERY_LIST
+    if _query_dir_watched and not _query_dir_dirty.is_set():
+        return list(_QUERY_LIST)
     if not QUERY_DIR.exists():
         return []
 
     definitions: list[QueryDefinition] = []
-    for script_path in sorted(QUERY_DIR.glob("*.py")):
-        metadata = extract_query_metadata(script_path)
-        definitions.append(metadata)
-    return definitions
+    with _query_cache_lock:
+        # Cleared before scanning, so changes made mid-scan mark it dirty again.
+        if _query_dir_watched:
+            _query_dir_dirty.clear()
+        seen = set()
+        changed = False
+        # scandir hands back names and file types without building a Path per
+        # entry; only the .py scripts get a stat and a Path. Underscore-prefixed
+        # modules are helpers the queries import, not queries.
+        with os.scandir(QUERY_DIR) as entries:
+            scripts = sorted(
+                (
+                    entry
+                    for entry in entries
+                    if entry.name.endswith(".py") and not entry.name.startswith("_") and entry.is_file()
+                ),
+                key=lambda entry: entry.name,
+            )
+        for entry in scripts:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            script_path = Path(entry.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            cached = _QUERY_CACHE.get(script_path)
+            if cached is None or cached[0] != signature:
+                cached = (signature, extract_query_metadata(script_path))
+                _QUERY_CACHE[script_path] = cached
+                changed = True
+            definitions.append(cached[1])
+            seen.add(script_path)
+        for stale in _QUERY_CACHE.keys() - seen:
+            del _QUERY_CACHE[stale]
+            changed = True
+        if changed:
+            _QUERY_INDEX = {definition.identifier: definition for definition in definitions}
+        _QUERY_LIST = definitions
+    return list(definitions)
+
+
+def watch_query_dir() -> None:
+    """Start a watchdog observer that marks the discovery cache dirty on change."""
+    global _query_dir_watched
+    if not WATCHDOG_AVAILABLE or _query_dir_watched or not QUERY_DIR.exists():
+        return
+
+    class _QueryDirHandler(FileSystemEventHandler):
+        # Open/close events (from our own reads) leave the cache alone.
+        def on_any_event(self, event) -> None:
+            if event.event_type in {"created", "deleted", "modified", "moved"}:
+                _query_dir_dirty.set()
+
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(_QueryDirHandler(), str(QUERY_DIR), recursive=False)
+    observer.start()
+    _query_dir_dirty.set()
+    _query_dir_watched = True
 
 
 def extract_query_metadata(script_path: Path) -> QueryDefinition:
     identifier = script_path.stem
     title = identifier.replace("_", " ").title()
+    safe_slug = _SAFE_QUERY_RE.sub("-", identifier).strip("-") or "query"
     summary: str | None = None
 
+    try:
+        with script_path.open("rb") as handle:
+            head = handle.read(METADATA_HEAD_BYTES).decode("utf-8", "ignore")
+    except OSError:
+        return QueryDefinition(identifier=identifier, title=title, file_path=script_path, safe_slug=safe_slug)
+
+    docstring_match = _DOCSTRING_RE.match(head)
+    if docstring_match:
+        lines = docstring_match.group(2).strip().splitlines()
+        if lines and lines[0].strip():
+            summary = lines[0].strip()
+
+    name_match = _QUERY_NAME_RE.search(head)
+    if name_match:
+        candidate = name_match.group(2).strip()
+        if candidate:
+            title = candidate
+        return QueryDefinition(
+            identifier=identifier, title=title, file_path=script_path, summary=summary, safe_slug=safe_slug
+        )
+
     try:
         source = script_path.read_text(encoding="utf-8")
         module = ast.parse(source)
@@ -157,92 +309,214 @@ def extract_query_metadata(script_path: Path) -> QueryDefinition:
                             candidate = node.value.value.strip()
                             if candidate:
                                 title = candidate
-            if isinstance(node, ast.Assign):
-                continue
     except (OSError, SyntaxError):
         pass
 
-    return QueryDefinition(identifier=identifier, title=title, file_path=script_path, summary=summary)
+    return QueryDefinition(
+        identifier=identifier, title=title, file_path=script_path, summary=summary, safe_slug=safe_slug
+    )
+
+
+def _inside_project(path: str) -> bool:
+    return path == _PROJECT_ROOT_STR or path.startswith(_PROJECT_ROOT_PREFIX)
 
 
 def sanitize_path(path: str) -> Path:
-    candidate = Path(path).expanduser()
-    resolved = (PROJECT_ROOT / candidate).resolve() if not candidate.is_absolute() else candidate.resolve()
-    if PROJECT_ROOT not in resolved.parents and resolved != PROJECT_ROOT:
+    # Cheap checks first: a string prefix test on the normalized path, then a
+    # single stat. Only paths that exist inside the project pay for realpath,
+    # which still rejects symlinks that point outside it.
+    candidate = os.path.normpath(os.path.join(_PROJECT_ROOT_STR, os.path.expanduser(path)))
+    if not _inside_project(candidate):
         raise ValueError("Resolved path is outside the project directory.")
-    if not resolved.exists():
-        raise FileNotFoundError(f"File not found: {resolved}")
-    return resolved
+    try:
+        os.stat(candidate)
+    except OSError:
+        raise FileNotFoundError(f"File not found: {candidate}") from None
+    resolved = os.path.realpath(candidate)
+    if not _inside_project(resolved):
+        raise ValueError("Resolved path is outside the project directory.")
+    return Path(resolved)
+
+
+def stored_job_path(path: str) -> Path:
+    """Check a path recorded on a finished job before serving it.
+
+    Job paths were resolved by sanitize_path (or created under OUTPUT_DIR) when
+    the job finished, so serving only re-confirms containment and existence.
+    """
+    if not _inside_project(path):
+        raise ValueError("Resolved path is outside the project directory.")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"File not found: {path}")
+    return Path(path)
+
+
+def _file_etag(path: Path) -> str:
+    # Job outputs are written once, so mtime and size identify a version; a
+    # repeat fetch revalidates with a 304 instead of re-sending the file.
+    stat = path.stat()
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
 
 
 def parse_generated_files(stdout: str, stderr: str) -> JobResult:
-    candidates = set(FILE_PATTERN.findall(stdout)) | set(FILE_PATTERN.findall(stderr))
+    tail = stdout[-OUTPUT_SCAN_CHARS:] + "\n" + stderr[-OUTPUT_SCAN_CHARS:]
+    # Ordered dedupe on the raw tokens, then again on the resolved paths, so a
+    # file printed several times (or as both relative and absolute) is stat'ed
+    # and listed once, and the first chart printed wins.
+    candidates: dict[str, None] = {}
+    for token in tail.split():
+        token = token.strip("\"'()[]<>,;:").rstrip(".")
+        if os.path.splitext(token)[1].lower() in OUTPUT_EXTENSIONS:
+            candidates[token] = None
     chart_path: Path | None = None
     data_files: list[Path] = []
+    seen_resolved: set[Path] = set()
 
     for candidate in candidates:
         try:
             resolved = sanitize_path(candidate)
         except (ValueError, FileNotFoundError):
             continue
+        if resolved in seen_resolved:
+            continue
+        seen_resolved.add(resolved)
 
         if resolved.suffix.lower() in IMAGE_EXTENSIONS and chart_path is None:
             chart_path = resolved
         elif resolved.suffix.lower() in DATA_EXTENSIONS:
             data_files.append(resolved)
 
-    return JobResult(chart_path=chart_path, data_files=data_files, stdout=stdout, stderr=stderr)
+    return JobResult(chart_path=chart_path, data_files=tuple(data_files), stdout=stdout, stderr=stderr)
+
+
+def _read_tail(path: Path) -> str:
+    try:
+        with path.open("rb") as handle:
+            handle.seek(0, os.SEEK_END)
+            handle.seek(max(handle.tell() - OUTPUT_SCAN_CHARS, 0))
+            return handle.read().decode("utf-8", "replace")
+    except OSError:
+        return ""
+
+
+def _drain(stream, handle) -> None:
+    # Raw bytes straight through: nothing is decoded until a tail is read back,
+    # and each chunk is flushed so live previews see it.
+    for chunk in iter(lambda: stream.read1(65536), b""):
+        handle.write(chunk)
+        handle.flush()
+    stream.close()
+
+
+def _get_query_pool() -> ProcessPoolExecutor:
+    global _query_pool
+    with _query_pool_lock:
+        if _query_pool is None:
+            _query_pool = ProcessPoolExecutor(
+                max_workers=QUERY_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=run_all.preimport,
+            )
+        return _query_pool
+
+
+def _reset_query_pool(pool: ProcessPoolExecutor) -> None:
+    global _query_pool
+    with _query_pool_lock:
+        if _query_pool is pool:
+            _query_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_pool(job_id: str, script_path: Path, extra_args: list[str], stdout_file: Path, stderr_file: Path) -> int:
+    pool = _get_query_pool()
+    future = pool.submit(run_all.run_script, str(script_path), extra_args, str(stdout_file), str(stderr_file))
+    # Publish the latest output while the script runs so polling shows progress.
+    while True:
+        try:
+            return future.result(timeout=LOG_PUBLISH_INTERVAL)
+        except FuturesTimeout:
+            job_manager.update_job(job_id, stdout=_read_tail(stdout_file), stderr=_read_tail(stderr_file))
+        except BrokenProcessPool:
+            _reset_query_pool(pool)
+            with stderr_file.open("a", encoding="utf-8") as handle:
+                handle.write("Query worker process exited unexpectedly.\n")
+            return 1
+
+
+def _run_in_subprocess(
+    job_id: str, executable: str, script_path: Path, extra_args: list[str], stdout_file: Path, stderr_file: Path
+) -> int:
+    # No preexec_fn, so CPython can take its posix_spawn/vfork fast path.
+    with stdout_file.open("wb") as stdout_handle, stderr_file.open("wb") as stderr_handle:
+        process = subprocess.Popen(
+            [executable, str(script_path), *extra_args],
+            cwd=str(PROJECT_ROOT),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=-1,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        )
+        drains = [
+            threading.Thread(target=_drain, args=(process.stdout, stdout_handle), daemon=True),
+            threading.Thread(target=_drain, args=(process.stderr, stderr_handle), daemon=True),
+        ]
+        for drain in drains:
+            drain.start()
+        for drain in drains:
+            while drain.is_alive():
+                drain.join(LOG_PUBLISH_INTERVAL)
+                job_manager.update_job(job_id, stdout=_read_tail(stdout_file), stderr=_read_tail(stderr_file))
+        return process.wait()
 
 
 def run_query_script(job_id: str, query: QueryDefinition, overrides: Dict[str, str] | None = None) -> None:
     job_manager.update_job(job_id, status=JobStatus.RUNNING)
 
-    executable = os.environ.get("PYTHON_EXECUTABLE", sys.executable)
     extra_args = resolve_query_args(query, overrides)
-    process = subprocess.Popen(
-        [executable, str(query.file_path), *extra_args],
-        cwd=str(PROJECT_ROOT),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    stdout, stderr = process.communicate()
 
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    stdout_file = OUTPUT_DIR / f"{query.safe_slug}_{timestamp}_{job_id[:8]}_output.txt"
+    stderr_file = OUTPUT_DIR / f"{query.safe_slug}_{timestamp}_{job_id[:8]}_stderr.txt"
+
+    # Scripts run in pre-warmed pool workers; a PYTHON_EXECUTABLE naming some
+    # other interpreter still gets a fresh process of that interpreter per job.
+    executable = os.environ.get("PYTHON_EXECUTABLE", sys.executable)
+    if executable == sys.executable:
+        returncode = _run_in_pool(job_id, query.file_path, extra_args, stdout_file, stderr_file)
+    else:
+        returncode = _run_in_subprocess(job_id, executable, query.file_path, extra_args, stdout_file, stderr_file)
+
+    stdout = _read_tail(stdout_file)
+    stderr = _read_tail(stderr_file)
     result = parse_generated_files(stdout, stderr)
     extra_files: list[Path] = []
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    safe_query = re.sub(r"[^A-Za-z0-9_-]+", "-", query.identifier).strip("-") or "query"
-    if stdout.strip():
-        stdout_file = OUTPUT_DIR / f"{safe_query}_{timestamp}_{job_id[:8]}_output.txt"
-        stdout_file.write_text(stdout, encoding="utf-8")
-        extra_files.append(stdout_file)
-    if stderr.strip():
-        stderr_file = OUTPUT_DIR / f"{safe_query}_{timestamp}_{job_id[:8]}_stderr.txt"
-        stderr_file.write_text(stderr, encoding="utf-8")
-        extra_files.append(stderr_file)
-
-    result.data_files.extend(extra_files)
-    job_manager.set_result(job_id, result)
-
-    if process.returncode != 0:
-        job_manager.update_job(
+    for log_file, text in ((stdout_file, stdout), (stderr_file, stderr)):
+        if text.strip():
+            extra_files.append(log_file)
+        else:
+            log_file.unlink(missing_ok=True)
+
+    result = replace(result, data_files=result.data_files + tuple(extra_files))
+
+    if returncode != 0:
+        job_manager.set_result(
             job_id,
+            result,
             status=JobStatus.ERROR,
-            error=stderr.strip() or f"Query script exited with code {process.returncode}.",
+            error=stderr.strip() or f"Query script exited with code {returncode}.",
         )
-        return
-
-    if result.chart_path is None:
-        job_manager.update_job(
+    elif result.chart_path is None:
+        job_manager.set_result(
             job_id,
+            result,
             status=JobStatus.ERROR,
             error="Query completed but no chart file was detected in the output.",
         )
-        return
-
-    job_manager.update_job(job_id, status=JobStatus.COMPLETED)
+    else:
+        job_manager.set_result(job_id, result, status=JobStatus.COMPLETED)
 
 
 def serialize_query(definition: QueryDefinition) -> Dict[str, Any]:
@@ -255,41 +529,58 @@ def serialize_query(definition: QueryDefinition) -> Dict[str, Any]:
 
 
 def get_query_definition(query_id: str) -> QueryDefinition:
-    for definition in discover_queries():
-        if definition.identifier == query_id:
-            return definition
-    raise KeyError(f"Query '{query_id}' not found.")
+    discover_queries()
+    try:
+        return _QUERY_INDEX[query_id]
+    except KeyError:
+        raise KeyError(f"Query '{query_id}' not found.") from None
+
+
+# Parsed query_config.json, reused until the file's (mtime_ns, size) changes.
+_config_cache: tuple[tuple[int, int], Dict[str, List[str]]] | None = None
+_config_cache_lock = threading.Lock()
 
 
 def load_query_config() -> Dict[str, List[str]]:
-    if not CONFIG_PATH.exists():
-        return {}
+    global _config_cache
     try:
-        data = json.loads(CONFIG_PATH.read_text(encoding="utf-8"))
+        stat = CONFIG_PATH.stat()
+    except OSError:
+        return {}
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _config_cache_lock:
+        if _config_cache is not None and _config_cache[0] == signature:
+            return _config_cache[1]
+
+        normalized: Dict[str, List[str]] = {}
+        try:
+            data = json.loads(CONFIG_PATH.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
         if isinstance(data, dict):
-            normalized: Dict[str, List[str]] = {}
             for key, value in data.items():
                 if isinstance(value, list):
                     normalized[key] = [str(item) for item in value]
-            return normalized
-    except (OSError, json.JSONDecodeError):
-        return {}
-    return {}
+        _config_cache = (signature, normalized)
+        return normalized
 
 
 def resolve_query_args(query: QueryDefinition, overrides: Dict[str, str] | None = None) -> List[str]:
     config = load_query_config()
+    # The config dict is shared across requests, so callers get their own list.
     baseline = config.get(query.identifier, [])
     if not overrides:
-        return baseline
-
-    result = baseline[:]
+        return list(baseline)
+
+    result = list(baseline)
+    # First position of each flag, found in one pass over the args.
+    positions: Dict[str, int] = {}
+    for idx, arg in enumerate(result):
+        if arg.startswith("--"):
+            positions.setdefault(arg, idx)
     for flag in ("--start-date", "--end-date"):
         if flag in overrides:
-            try:
-                idx = result.index(flag)
-            except ValueError:
-                idx = None
+            idx = positions.get(flag)
             if idx is not None and idx + 1 < len(result):
                 result[idx + 1] = overrides[flag]
             else:
@@ -297,8 +588,24 @@ def resolve_query_args(query: QueryDefinition, overrides: Dict[str, str] | None
     return result
 
 
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; unknown types fall back to Flask's own encoder."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
+    if ORJSON_AVAILABLE:
+        # Status polling hits jsonify several times a second per open job.
+        app.json = ORJSONProvider(app)
+    # Behind nginx/Apache, let the proxy send job files itself via X-Sendfile.
+    app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "0") == "1"
+    watch_query_dir()
 
     @app.route("/")
     def index() -> str:
@@ -393,15 +700,17 @@ def create_app() -> Flask:
     @app.route("/api/queries/<query_id>", methods=["DELETE"])
     def api_delete_query(query_id: str):
         script_path = QUERY_DIR / f"{query_id}.py"
-        if not script_path.exists():
+        # Shared helper modules are not queries and cannot be deleted here.
+        if query_id.startswith("_") or not script_path.exists():
             return jsonify({"error": f"Query '{query_id}' not found."}), 404
 
-        backup_path = script_path.with_suffix(script_path.suffix + "_old")
-        suffix = 1
-        candidate = backup_path
-        while candidate.exists():
-            candidate = script_path.with_suffix(script_path.suffix + f"_old{suffix}")
-            suffix += 1
+        # A microsecond UTC stamp makes the backup name unique in practice, so
+        # one stat replaces probing _old, _old1, _old2, ... in turn. rename()
+        # would silently replace an existing file on POSIX, hence the check.
+        stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+        candidate = script_path.with_suffix(f"{script_path.suffix}_old_{stamp}")
+        if candidate.exists():
+            candidate = script_path.with_suffix(f"{script_path.suffix}_old_{stamp}_{uuid.uuid4().hex[:6]}")
 
         script_path.rename(candidate)
         return jsonify({"message": "Query archived.", "backup": candidate.name})
@@ -437,11 +746,17 @@ def create_app() -> Flask:
             abort(404)
 
         try:
-            chart_path = sanitize_path(job["chartPath"])
+            chart_path = stored_job_path(job["chartPath"])
         except (ValueError, FileNotFoundError):
             abort(404)
 
-        return send_file(chart_path, mimetype=f"image/{chart_path.suffix.lstrip('.')}")
+        return send_file(
+            chart_path,
+            mimetype=f"image/{chart_path.suffix.lstrip('.')}",
+            conditional=True,
+            etag=_file_etag(chart_path),
+            max_age=0,
+        )
 
     @app.route("/api/jobs/<job_id>/files/<int:file_index>", methods=["GET"])
     def api_job_file(job_id: str, file_index: int):
@@ -449,16 +764,23 @@ def create_app() -> Flask:
         if not job:
             abort(404)
 
-        files: List[str] = job.get("dataFiles", [])
+        files: Sequence[str] = job.get("dataFiles", ())
         if file_index < 0 or file_index >= len(files):
             abort(404)
 
         try:
-            file_path = sanitize_path(files[file_index])
+            file_path = stored_job_path(files[file_index])
         except (ValueError, FileNotFoundError):
             abort(404)
 
-        return send_file(file_path, as_attachment=True, download_name=file_path.name)
+        return send_file(
+            file_path,
+            as_attachment=True,
+            download_name=file_path.name,
+            conditional=True,
+            etag=_file_etag(file_path),
+            max_age=0,
+        )
 
     return app
 